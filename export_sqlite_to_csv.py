@@ -1,94 +1,288 @@
-import sqlite3
+import argparse
 import csv
+import gzip
+import itertools
+import io
+import json
+import os
 import pathlib
-from collections import defaultdict
-from datetime import datetime
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import zstandard
+except ImportError:  # valgfri: kun nødvendig for --compress zstd
+    zstandard = None
 
 ROOT = pathlib.Path(__file__).parent
 EXPORT_DIR = ROOT / "exports_csv"
-EXPORT_DIR.mkdir(exist_ok=True)
+
+# Ikke forretningsdata: reporting.db er reporting-servicens KPI-historik
+EXCLUDED_DBS = {"reporting.db"}
+
+# Rækker pr. fetchmany og bytes i skrivebufferen; hukommelsen er
+# O(BATCH_SIZE) uanset tabellens størrelse
+BATCH_SIZE = 5000
+WRITE_BUFFER = 1 << 20
+PROGRESS_EVERY = 100_000
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+# -----------------------------
+# Streaming output
+# -----------------------------
+
+def output_path(name: str, compression: str = "none") -> pathlib.Path:
+    """EXPORT_DIR/<name>.csv, evt. med .gz/.zst."""
+    return EXPORT_DIR / f"{name}.csv{COMPRESSIONS[compression]}"
+
+
+def open_output(path: pathlib.Path, compression: str = "none"):
+    """Åbner en (evt. komprimeret) CSV-fil til skrivning som tekst med stor buffer."""
+    if compression == "gzip":
+        raw = gzip.GzipFile(path, "wb", compresslevel=6)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-komprimering kræver pakken 'zstandard' (pip install zstandard)")
+        raw = zstandard.ZstdCompressor(level=3).stream_writer(path.open("wb"), closefd=True)
+    else:
+        raw = path.open("wb")
+    return io.TextIOWrapper(io.BufferedWriter(raw, WRITE_BUFFER), encoding="utf-8", newline="")
+
+
+def iter_batches(cur: sqlite3.Cursor, batch_size: int = BATCH_SIZE):
+    """Lister af rækker fra cursoren, batch_size ad gangen (fetchmany)."""
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def open_input(path: pathlib.Path):
+    """Åbner en eksporteret CSV-fil til læsning; komprimering ses af endelsen."""
+    if path.suffix == ".gz":
+        raw = gzip.GzipFile(path, "rb")
+    elif path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"{path.name}: læsning kræver pakken 'zstandard' (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+    else:
+        raw = path.open("rb")
+    return io.TextIOWrapper(io.BufferedReader(raw, WRITE_BUFFER), encoding="utf-8", newline="")
+
+
+def write_csv(name: str, headers, batches, compression: str = "none", path: pathlib.Path = None):
+    """
+    Skriver headers + rækker fra batches til path (default:
+    EXPORT_DIR/<name>.csv[.gz|.zst]) med løbende fremdrift.
+    Returnerer (sti, antal rækker).
+    """
+    path = path or output_path(name, compression)
+    written = 0
+    next_report = PROGRESS_EVERY
+    started = time.monotonic()
+    with open_output(path, compression) as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(headers)
+        for batch in batches:
+            writer.writerows(batch)
+            written += len(batch)
+            if written >= next_report:
+                rate = written / max(time.monotonic() - started, 1e-9)
+                print(f"     ... {name}: {written:,} rækker ({rate:,.0f}/s)")
+                next_report += PROGRESS_EVERY
+    return path, written
 
 
 # -----------------------------
 # Hjælpere til generel eksport
 # -----------------------------
 
-def export_db(db_path: pathlib.Path):
+def list_tables(db_path: pathlib.Path):
+    """Brugertabellerne i en .db-fil."""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT name
+            FROM sqlite_master
+            WHERE type = 'table'
+            AND name NOT LIKE 'sqlite_%'
+        """).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
+
+
+def export_table(db_path: pathlib.Path, table: str, compression: str = "none", batch_size: int = BATCH_SIZE):
     """
-    Eksporterer alle tabeller i en given .db-fil til CSV.
-    Filnavne: <dbname>__<tablename>.csv
+    Eksporterer én tabel til <dbname>__<tablename>.csv[.gz|.zst].
+    Rækkerne streames med fetchmany, så hukommelsen ikke vokser med tabellen.
+    Returnerer antal rækker (tomme tabeller springes over).
     """
-    print(f"\n=== Eksporterer DB: {db_path} ===")
     conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    try:
+        cur = conn.execute(f'SELECT * FROM "{table}"')
+        headers = [d[0] for d in cur.description]
+        first = cur.fetchmany(batch_size)
+        if not first:
+            print(f"     ({db_path.stem}.{table}: ingen rækker, springer over)")
+            return 0
+
+        def batches():
+            yield first
+            yield from iter_batches(cur, batch_size)
+
+        csv_path, written = write_csv(f"{db_path.stem}__{table}", headers, batches(), compression)
+    finally:
+        conn.close()
+    print(f"     -> skrevet til {csv_path} ({written:,} rækker)")
+    return written
 
-    cur.execute("""
-        SELECT name
-        FROM sqlite_master
-        WHERE type = 'table'
-        AND name NOT LIKE 'sqlite_%'
-    """)
-    tables = [row[0] for row in cur.fetchall()]
 
+def export_db(db_path: pathlib.Path, compression: str = "none", batch_size: int = BATCH_SIZE,
+              table_fn=export_table):
+    """
+    Eksporterer alle tabeller i en given .db-fil til CSV med table_fn
+    (export_table eller export_incremental).
+    Filnavne: <dbname>__<tablename>.csv[.gz|.zst]
+    """
+    print(f"\n=== Eksporterer DB: {db_path} ===")
+    tables = list_tables(db_path)
     if not tables:
         print("  (Ingen tabeller fundet)")
-        conn.close()
         return
 
     for table in tables:
         print(f"  -> Tabel: {table}")
-        cur.execute(f"SELECT * FROM {table}")
-        rows = cur.fetchall()
-        if not rows:
-            print("     (ingen rækker, springer over)")
-            continue
-
-        headers = rows[0].keys()
-        csv_name = f"{db_path.stem}__{table}.csv"
-        csv_path = EXPORT_DIR / csv_name
-
-        with csv_path.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f, delimiter=";")
-            writer.writerow(headers)
-            for row in rows:
-                writer.writerow([row[h] for h in headers])
-
-        print(f"     -> skrevet til {csv_path}")
-
-    conn.close()
+        table_fn(db_path, table, compression, batch_size)
 
 
 # -----------------------------
 # Hjælpere til joins (analytics)
 # -----------------------------
 
-def load_table(db_path: pathlib.Path, table_name: str):
+# Analytics-joinets tabeller: prefiks -> (schema-alias, DB-fil, tabel).
+# DB-filerne er standardstierne; med --db bruges filen med samme navn fra listen.
+JOIN_SOURCES = {
+    "lease": ("lease", ROOT / "services" / "lease_service" / "lease.db", "leases"),
+    "damage": ("damage", ROOT / "services" / "damage_service" / "damage.db", "damages"),
+    "vehicle": ("fleet", ROOT / "services" / "fleet_service" / "fleet.db", "vehicles"),
+    "reservation": ("reservation", ROOT / "services" / "reservation_service" / "reservation.db", "reservations"),
+}
+
+# Kolonner der altid kommer med, selv hvis tabellen mangler (Tableau bliver gladere)
+DEFAULT_COLUMNS = {
+    "vehicle": ["id", "model_name", "fuel_type", "monthly_price", "status", "delivery_location"],
+    "reservation": ["id", "pickup_date", "pickup_location", "status", "actual_pickup_at"],
+}
+
+
+def join_sources(db_files):
     """
-    Loader en tabel som list[dict]. Returnerer [] hvis DB eller tabel mangler.
+    JOIN_SOURCES med DB-filerne taget fra db_files (matchet på filnavn, fx
+    lease.db). Kilder der ikke er med i db_files udelades.
     """
-    if not db_path.exists():
-        print(f"  [ADVARSEL] DB mangler: {db_path}")
-        return []
-
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    by_name = {db.name: db for db in db_files}
+    return {
+        prefix: (alias, by_name[db_path.name], table)
+        for prefix, (alias, db_path, table) in JOIN_SOURCES.items()
+        if db_path.name in by_name
+    }
 
-    try:
-        cur.execute(f"SELECT * FROM {table_name}")
-        rows = cur.fetchall()
-    except sqlite3.Error as e:
-        print(f"  [ADVARSEL] Kunne ikke læse {table_name} fra {db_path}: {e}")
-        conn.close()
-        return []
 
-    result = [dict(r) for r in rows]
-    conn.close()
-    return result
+def attach_sources(conn: sqlite3.Connection, sources=JOIN_SOURCES):
+    """
+    ATTACH'er join-kildernes DB'er (sources, se JOIN_SOURCES) read-only på conn.
+    Returnerer {prefiks: kolonner} for de tabeller der kunne læses.
+    """
+    columns = {}
+    for prefix, (alias, db_path, table) in sources.items():
+        if not db_path.exists():
+            print(f"  [ADVARSEL] DB mangler: {db_path}")
+            continue
+        try:
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"{db_path.as_uri()}?mode=ro",))
+            cols = [row[1] for row in conn.execute(f"PRAGMA {alias}.table_info({table})")]
+        except sqlite3.Error as e:
+            print(f"  [ADVARSEL] Kunne ikke læse {table} fra {db_path}: {e}")
+            continue
+        if not cols:
+            print(f"  [ADVARSEL] Kunne ikke læse {table} fra {db_path}: tabellen findes ikke")
+            continue
+        columns[prefix] = cols
+    return columns
+
+
+def header_sort_key(k: str):
+    """Sorter headers lidt pænt: lease_, vehicle_, reservation_, damage_"""
+    if k.startswith("lease_"):
+        prio = 0
+    elif k.startswith("vehicle_"):
+        prio = 1
+    elif k.startswith("reservation_"):
+        prio = 2
+    elif k.startswith("damage_"):
+        prio = 3
+    else:
+        prio = 9
+    return (prio, k)
 
 
-def export_analytics_join():
+def analytics_join_sql(columns):
+    """
+    (headers, SQL) for joinet over de attachede tabeller i columns.
+    Vehicle og reservation LEFT JOIN'es kun hvis tabellen findes; ellers
+    bliver deres standardkolonner NULL.
+    """
+    aliases = {"lease": "l", "damage": "d", "vehicle": "v", "reservation": "r"}
+    select = {}
+    for prefix, alias in aliases.items():
+        if prefix in columns:
+            for col in columns[prefix]:
+                select[f"{prefix}_{col}"] = f'{alias}."{col}"'
+        else:
+            for col in DEFAULT_COLUMNS[prefix]:
+                select[f"{prefix}_{col}"] = "NULL"
+    headers = sorted(select, key=header_sort_key)
+
+    sql = []
+    if "reservation" in columns:
+        # Primær reservation pr. lease: tidligste pickup_date (gyldige datoer
+        # først, derefter tekst-sortering), ved lighed laveste id
+        sql.append(
+            """
+            WITH primary_reservation AS (
+                SELECT * FROM (
+                    SELECT res.*,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY res.lease_id
+                               ORDER BY julianday(res.pickup_date) IS NULL,
+                                        julianday(res.pickup_date),
+                                        res.pickup_date,
+                                        res.id
+                           ) AS rn
+                    FROM reservation.reservations res
+                    WHERE res.lease_id IS NOT NULL
+                )
+                WHERE rn = 1
+            )
+            """
+        )
+    sql.append("SELECT " + ", ".join(f'{select[h]} AS "{h}"' for h in headers))
+    # Skader uden lease giver ikke mening til analytics (INNER JOIN)
+    sql.append("FROM damage.damages d JOIN lease.leases l ON l.id = d.lease_id")
+    if "vehicle" in columns:
+        sql.append("LEFT JOIN fleet.vehicles v ON v.id = l.vehicle_id")
+    if "reservation" in columns:
+        sql.append("LEFT JOIN primary_reservation r ON r.lease_id = d.lease_id")
+    sql.append("ORDER BY d.id")
+    return headers, "\n".join(sql)
+
+
+def export_analytics_join(compression: str = "none", batch_size: int = BATCH_SIZE, db_files=None):
     """
     Laver en joined CSV på tværs af:
       - leases (lease.db)
@@ -98,157 +292,403 @@ def export_analytics_join():
 
     Grain: én række per skade (damage),
     joinet med tilhørende lease, vehicle og (evt.) reservation.
+
+    De fire DB'er ATTACH'es på én forbindelse, og hele joinet (inkl. valg af
+    primær reservation med en window-funktion) køres i SQLite; resultatet
+    streames med fetchmany direkte til CSV-writeren.
+
+    db_files (fx fra --db) bestemmer hvilke DB-filer der joines; None giver
+    standardstierne i JOIN_SOURCES.
     """
     print("\n=== Bygger analytics-join ===")
 
-    lease_db = ROOT / "services" / "lease_service" / "lease.db"
-    damage_db = ROOT / "services" / "damage_service" / "damage.db"
-    fleet_db = ROOT / "services" / "fleet_service" / "fleet.db"
-    reservation_db = ROOT / "services" / "reservation_service" / "reservation.db"
+    sources = JOIN_SOURCES if db_files is None else join_sources(db_files)
+    for prefix, (_, db_path, _) in JOIN_SOURCES.items():
+        if prefix not in sources:
+            print(f"  ({db_path.name} er ikke blandt DB-filerne, springes over i joinet)")
 
-    leases = load_table(lease_db, "leases")
-    damages = load_table(damage_db, "damages")
-    vehicles = load_table(fleet_db, "vehicles")
-    reservations = load_table(reservation_db, "reservations")
-
-    print(f"  leases: {len(leases)} rækker")
-    print(f"  damages: {len(damages)} rækker")
-    print(f"  vehicles: {len(vehicles)} rækker")
-    print(f"  reservations: {len(reservations)} rækker")
+    conn = sqlite3.connect(":memory:", uri=True)
+    try:
+        columns = attach_sources(conn, sources)
+        for prefix, (alias, _, table) in sources.items():
+            if prefix in columns:
+                count = conn.execute(f"SELECT COUNT(*) FROM {alias}.{table}").fetchone()[0]
+                print(f"  {table}: {count} rækker")
+
+        if "lease" not in columns or "damage" not in columns:
+            print("  Ikke nok data til at lave meningsfuldt join (leases/damages mangler).")
+            return
+
+        headers, sql = analytics_join_sql(columns)
+        cur = conn.execute(sql)
+        out_path, written = write_csv(
+            "analytics__lease_damage_vehicle", headers, iter_batches(cur, batch_size), compression
+        )
+    finally:
+        conn.close()
 
-    if not leases or not damages:
-        print("  Ikke nok data til at lave meningsfuldt join (leases/damages mangler).")
+    if not written:
+        out_path.unlink()
+        print("  Ingen joined rækker dannet (muligvis ingen skader).")
         return
 
-    # Indexer leases og vehicles efter id
-    leases_by_id = {l["id"]: l for l in leases if "id" in l}
-    vehicles_by_id = {v["id"]: v for v in vehicles if "id" in v}
-
-    # Indexer reservationer pr. lease_id
-    # Hvis der er flere, vælger vi den tidligste pickup_date
-    reservations_by_lease = defaultdict(list)
-    for r in reservations:
-        lease_id = r.get("lease_id")
-        if lease_id is not None:
-            reservations_by_lease[lease_id].append(r)
-
-    # Vælg én "primær" reservation per lease (tidligste pickup_date)
-    reservation_primary_by_lease = {}
-    for lease_id, r_list in reservations_by_lease.items():
-        def parse_pickup(r):
-            val = r.get("pickup_date") or ""
-            # pickup_date burde være ISO8601; string-sort virker fint som fallback
-            try:
-                return datetime.fromisoformat(val)
-            except Exception:
-                return val
-        r_sorted = sorted(r_list, key=parse_pickup)
-        reservation_primary_by_lease[lease_id] = r_sorted[0]
+    print(f"  -> Analytics-CSV skrevet til {out_path} ({written:,} rækker)")
+
 
-    # Byg joined rækker: én række per damage
-    joined_rows = []
+# -----------------------------
+# Inkrementel eksport (watermarks)
+# -----------------------------
+#
+# Pr. tabel ligger EXPORT_DIR/incremental/<dbname>__<tabel>/ med
+#   base.csv[.gz|.zst]          fuldt snapshot (første kørsel / compaction)
+#   delta_<tidspunkt>.csv[...]  rækker indsat eller ændret siden forrige kørsel
+#   watermark.json              high-water mark for næste kørsel
+#
+# Watermark vælges pr. tabel:
+#   changelog   servicens change log (tabellen changes): seq > sidste kørsel.
+#               Foretrækkes altid, da seq følger commit-rækkefølgen.
+#   updated_at  kun uden change log: updated_at >= sidste max - UPDATED_AT_OVERLAP.
+#               updated_at sættes før commit, så en langsom transaktion kan
+#               committe en ældre værdi efter kørslen; overlappet fanger den,
+#               og gentagne rækker flettes væk ved compaction.
+#   full        ingen af delene (små tabeller som users): base skrives hver gang
+#
+# Selve tabellen changes eksporteres ikke inkrementelt (den er kun et middel).
+#
+# Compaction fletter base + deltas (nyeste række pr. id vinder) til en ny base.
 
-    for d in damages:
-        lease_id = d.get("lease_id")
-        lease = leases_by_id.get(lease_id)
+INCREMENTAL_DIR = "incremental"
 
-        # Hvis der ikke findes lease, giver det ikke mening til analytics
-        if lease is None:
-            continue
+UPDATED_AT_OVERLAP = timedelta(minutes=5)
 
-        # Vehicle: kræver at lease har vehicle_id-kolonne
-        vehicle = None
-        vehicle_id = lease.get("vehicle_id")
-        if vehicle_id is not None:
-            vehicle = vehicles_by_id.get(vehicle_id)
+# Tabel -> entity i servicernes change log (changelog.record_change)
+CHANGELOG_ENTITIES = {
+    "leases": "lease",
+    "damages": "damage",
+    "vehicles": "vehicle",
+    "reservations": "reservation",
+}
 
-        # Reservation: primære pr. lease_id
-        reservation = reservation_primary_by_lease.get(lease_id)
 
-        row_out = {}
+def incremental_dir(name: str) -> pathlib.Path:
+    return EXPORT_DIR / INCREMENTAL_DIR / name
 
-        # Prefiks alle felter, så navne ikke clasher
-        # Lease-felter
-        for k, v in lease.items():
-            row_out[f"lease_{k}"] = v
 
-        # Damage-felter
-        for k, v in d.items():
-            row_out[f"damage_{k}"] = v
+def _base_file(target: pathlib.Path):
+    return next(iter(sorted(target.glob("base.csv*"))), None)
+
+
+def _delta_files(target: pathlib.Path):
+    # Tidsstemplet i navnet sorterer kronologisk
+    return sorted(target.glob("delta_*.csv*"))
+
+
+def _load_watermark(target: pathlib.Path):
+    try:
+        return json.loads((target / "watermark.json").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def _save_watermark(target: pathlib.Path, state: dict):
+    tmp = target / "watermark.json.tmp"
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, target / "watermark.json")
+
+
+def _replace_base(target: pathlib.Path, tmp_path: pathlib.Path, compression: str):
+    """Gør tmp_path til ny base og fjerner gammel base og alle deltas."""
+    for old in [*target.glob("base.csv*"), *_delta_files(target)]:
+        old.unlink()
+    base = target / f"base.csv{COMPRESSIONS[compression]}"
+    os.replace(tmp_path, base)
+    return base
+
+
+def table_strategy(conn: sqlite3.Connection, table: str, columns):
+    """changelog / updated_at / full (se ovenfor)."""
+    if "id" not in columns:
+        return "full"
+    has_changelog = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'"
+    ).fetchone()
+    if has_changelog and table in CHANGELOG_ENTITIES:
+        return "changelog"
+    if "updated_at" in columns:
+        return "updated_at"
+    return "full"
+
+
+def _updated_at_since(watermark: str) -> str:
+    """Nedre grænse for næste updated_at-delta: watermark minus overlap."""
+    try:
+        return (datetime.fromisoformat(watermark) - UPDATED_AT_OVERLAP).isoformat()
+    except ValueError:
+        return watermark
 
-        # Vehicle-felter (kan være None)
-        if vehicle is not None:
-            for k, v in vehicle.items():
-                row_out[f"vehicle_{k}"] = v
+
+def export_incremental(db_path: pathlib.Path, table: str, compression: str = "none", batch_size: int = BATCH_SIZE):
+    """
+    Eksporterer rækker indsat/ændret siden sidste kørsel til en delta-fil.
+    Første kørsel, skiftende kolonner eller en change log der er ryddet
+    forbi watermarket giver i stedet en ny base (fuldt snapshot).
+    Returnerer antal skrevne rækker.
+    """
+    name = f"{db_path.stem}__{table}"
+    if table == "changes":
+        print(f"     -> {name}: springes over (change log)")
+        return 0
+    target = incremental_dir(name)
+    target.mkdir(parents=True, exist_ok=True)
+    state = _load_watermark(target)
+
+    conn = sqlite3.connect(f"{db_path.as_uri()}?mode=ro", uri=True)
+    try:
+        # Data og nyt watermark læses i samme transaktion (ét snapshot)
+        conn.execute("BEGIN")
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        strategy = table_strategy(conn, table, columns)
+        full = (
+            strategy == "full"
+            or state is None
+            or state.get("strategy") != strategy
+            or state.get("columns") != columns
+            or _base_file(target) is None
+        )
+
+        if strategy == "updated_at":
+            last = conn.execute(f'SELECT MAX(updated_at) FROM "{table}"').fetchone()[0]
+            watermark = {"updated_at": last or ""}
+            if not full:
+                cur = conn.execute(
+                    f"""
+                    SELECT * FROM "{table}"
+                    WHERE updated_at >= ?
+                    ORDER BY updated_at, id
+                    """,
+                    (_updated_at_since(state["updated_at"]),),
+                )
+        elif strategy == "changelog":
+            seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+            seq = seq[0] if seq else 0
+            oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0] or seq + 1
+            watermark = {"seq": seq}
+            # Ændringer efter watermarket er ryddet væk (retention) eller DB'en er ny
+            if not full and (state["seq"] < oldest - 1 or state["seq"] > seq):
+                print(f"     ({name}: change log dækker ikke watermark {state['seq']}, laver fuldt snapshot)")
+                full = True
+            if not full:
+                cur = conn.execute(
+                    f"""
+                    SELECT * FROM "{table}"
+                    WHERE id IN (SELECT entity_id FROM changes WHERE entity = ? AND seq > ?)
+                    ORDER BY id
+                    """,
+                    (CHANGELOG_ENTITIES[table], state["seq"]),
+                )
         else:
-            # Sikrer at nogle typiske vehicle-felter findes (Tableau bliver gladere)
-            for k in ["id", "model_name", "fuel_type", "monthly_price", "status", "delivery_location"]:
-                key = f"vehicle_{k}"
-                row_out.setdefault(key, None)
-
-        # Reservation-felter (kan være None)
-        if reservation is not None:
-            for k, v in reservation.items():
-                row_out[f"reservation_{k}"] = v
+            watermark = {}
+
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+        if full:
+            cur = conn.execute(f'SELECT * FROM "{table}"')
+            tmp_path = target / f".base.csv{COMPRESSIONS[compression]}.tmp"
+            _, written = write_csv(name, columns, iter_batches(cur, batch_size), compression, tmp_path)
+            path = _replace_base(target, tmp_path, compression)
         else:
-            for k in ["id", "pickup_date", "pickup_location", "status", "actual_pickup_at"]:
-                key = f"reservation_{k}"
-                row_out.setdefault(key, None)
+            path = target / f"delta_{stamp}.csv{COMPRESSIONS[compression]}"
+            _, written = write_csv(name, columns, iter_batches(cur, batch_size), compression, path)
+            if not written:
+                path.unlink()
+    finally:
+        conn.close()
+
+    # Watermark gemmes først når filen er skrevet; et afbrudt run giver
+    # højst en gentaget delta, som compaction alligevel fletter væk
+    _save_watermark(target, {"strategy": strategy, "columns": columns, **watermark, "exported_at": stamp})
+    if full:
+        print(f"     -> {name}: snapshot skrevet til {path} ({written:,} rækker, {strategy})")
+    elif written:
+        print(f"     -> {name}: delta skrevet til {path} ({written:,} rækker)")
+    else:
+        print(f"     -> {name}: ingen ændringer")
+    return written
 
-        joined_rows.append(row_out)
 
-    if not joined_rows:
-        print("  Ingen joined rækker dannet (muligvis ingen skader).")
-        return
+def compact_table(target: pathlib.Path, compression: str = "none", batch_size: int = BATCH_SIZE):
+    """
+    Fletter base + deltas til en ny base: for hvert id vinder den nyeste
+    række. Flettes i en midlertidig SQLite-DB på disk, så hukommelsen ikke
+    afhænger af tabellens størrelse. Returnerer antal rækker (None hvis
+    der ikke var noget at flette).
+    """
+    base, deltas = _base_file(target), _delta_files(target)
+    if base is None or not deltas:
+        return None
 
-    # Skriv til CSV
-    # Saml alle nøgler på tværs, så vi får fuldt header-set
-    all_keys = set()
-    for r in joined_rows:
-        all_keys.update(r.keys())
-
-    # Sorter headers lidt pænt: lease_, vehicle_, reservation_, damage_
-    def header_sort_key(k: str):
-        if k.startswith("lease_"):
-            prio = 0
-        elif k.startswith("vehicle_"):
-            prio = 1
-        elif k.startswith("reservation_"):
-            prio = 2
-        elif k.startswith("damage_"):
-            prio = 3
-        else:
-            prio = 9
-        return (prio, k)
+    merged = sqlite3.connect("")   # tom sti: midlertidig DB, slettes ved close
+    try:
+        merged.execute("CREATE TABLE rows (id INTEGER PRIMARY KEY, row TEXT NOT NULL)")
+        headers = None
+        for path in [base, *deltas]:
+            with open_input(path) as f:
+                reader = csv.reader(f, delimiter=";")
+                file_headers = next(reader, None)
+                if headers is None:
+                    headers = file_headers
+                    id_index = headers.index("id")
+                elif file_headers != headers:
+                    raise ValueError(f"{target.name}/{path.name}: kolonnerne matcher ikke base-filen")
+                while True:
+                    chunk = list(itertools.islice(reader, batch_size))
+                    if not chunk:
+                        break
+                    merged.executemany(
+                        "INSERT OR REPLACE INTO rows (id, row) VALUES (?, ?)",
+                        ((int(r[id_index]), json.dumps(r)) for r in chunk),
+                    )
+
+        cur = merged.execute("SELECT row FROM rows ORDER BY id")
+        batches = ([json.loads(r[0]) for r in batch] for batch in iter_batches(cur, batch_size))
+        tmp_path = target / f".base.csv{COMPRESSIONS[compression]}.tmp"
+        _, written = write_csv(target.name, headers, batches, compression, tmp_path)
+    finally:
+        merged.close()
+
+    path = _replace_base(target, tmp_path, compression)
+    print(f"     -> {target.name}: {len(deltas)} delta(s) flettet ind i {path} ({written:,} rækker)")
+    return written
+
+
+def compact_all(compression: str = "none", batch_size: int = BATCH_SIZE):
+    """Compaction af alle inkrementelle tabeller i EXPORT_DIR."""
+    print("\n=== Compaction af inkrementelle eksporter ===")
+    root = EXPORT_DIR / INCREMENTAL_DIR
+    targets = sorted(p for p in root.iterdir() if p.is_dir()) if root.is_dir() else []
+    if not any([compact_table(t, compression, batch_size) is not None for t in targets]):
+        print("  (ingen deltas at flette)")
 
-    headers = sorted(all_keys, key=header_sort_key)
 
-    out_path = EXPORT_DIR / "analytics__lease_damage_vehicle.csv"
-    with out_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f, delimiter=";")
-        writer.writerow(headers)
-        for r in joined_rows:
-            writer.writerow([r.get(h) for h in headers])
+# -----------------------------
+# Parallel eksport
+# -----------------------------
+
+def _init_worker(export_dir: pathlib.Path):
+    """Sætter outputmappen i worker-processen (arves ikke ved spawn)."""
+    global EXPORT_DIR
+    EXPORT_DIR = export_dir
 
-    print(f"  -> Analytics-CSV skrevet til {out_path} ({len(joined_rows)} rækker)")
 
+def export_parallel(db_files, workers: int, compression: str = "none", batch_size: int = BATCH_SIZE,
+                    table_fn=export_table):
+    """
+    Eksporterer alle tabeller i db_files (med table_fn, fx
+    export_incremental) samt analytics-joinet i en procespulje med workers
+    processer. Hver tabel er sin egen opgave, og joinet sendes først
+    afsted, så det kører mens dumpene står på.
+    Returnerer antal opgaver der fejlede.
+    """
+    tasks = [("analytics-join", export_analytics_join, (compression, batch_size, db_files))]
+    for db_path in db_files:
+        tables = list_tables(db_path)
+        if not tables:
+            print(f"  ({db_path}: ingen tabeller fundet)")
+        for table in tables:
+            tasks.append((f"{db_path.stem}.{table}", table_fn, (db_path, table, compression, batch_size)))
+
+    print(f"\n=== Eksporterer {len(tasks)} opgaver med {workers} processer ===")
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(EXPORT_DIR,)) as pool:
+        futures = {pool.submit(fn, *args): name for name, fn, args in tasks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  [FEJL] {futures[future]}: {e}")
+    return failed
+
+
+def default_db_files():
+    """Servicernes DB'er (services/*/*.db) undtagen EXCLUDED_DBS."""
+    return [db for db in sorted(ROOT.glob("services/*/*.db")) if db.name not in EXCLUDED_DBS]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Eksporterer alle SQLite-DB'er til CSV (streaming).")
+    parser.add_argument("--out", type=pathlib.Path, default=EXPORT_DIR, help="outputmappe (default: exports_csv)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSIONS), default="none", help="komprimering af CSV-filerne")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rækker pr. fetchmany")
+    parser.add_argument(
+        "--db", dest="dbs", type=pathlib.Path, action="append",
+        help="DB-fil der skal eksporteres og joines (kan gentages; default: services/*/*.db uden reporting.db)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="antal processer; >1 eksporterer tabeller og analytics-join parallelt (0 = antal kerner)",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="skriv kun rækker ændret siden sidste kørsel (delta-filer under <out>/incremental)",
+    )
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="flet inkrementelle deltas ind i et fuldt snapshot (uden --incremental: kun compaction)",
+    )
+    args = parser.parse_args(argv)
+    if args.compress == "zstd" and zstandard is None:
+        parser.error("--compress zstd kræver pakken 'zstandard' (pip install zstandard)")
+    if args.batch_size < 1:
+        parser.error("--batch-size skal være mindst 1")
+    if args.workers < 0:
+        parser.error("--workers skal være 0 eller derover")
+    missing = [str(db) for db in args.dbs or [] if not db.is_file()]
+    if missing:
+        parser.error(f"DB-fil(er) findes ikke: {', '.join(missing)}")
+    stems = [db.stem for db in args.dbs or []]
+    if len(stems) != len(set(stems)):
+        # Outputfilerne hedder <dbname>__<tabel>.csv, så navnene skal være unikke
+        parser.error("--db-filerne skal have forskellige navne")
+    return args
+
+
+def main(argv=None):
+    global EXPORT_DIR
+    args = parse_args(argv)
+    EXPORT_DIR = args.out
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+
+    if args.compact and not args.incremental:
+        compact_all(args.compress, args.batch_size)
+        return
+    table_fn = export_incremental if args.incremental else export_table
 
-def main():
-    # 1) Eksporter alle .db-filer og tabeller
-    db_files = list(ROOT.rglob("*.db"))
+    # Kun servicernes egne DB'er (eller en eksplicit liste), ikke tilfældige .db-filer i træet
+    db_files = [db.resolve() for db in args.dbs] if args.dbs else default_db_files()
 
     if not db_files:
         print("Ingen .db-filer fundet. Tjek at du kører scriptet i projektroden.")
     else:
         print("Følgende DB-filer behandles:")
         for db in db_files:
-            print(f" - {db.relative_to(ROOT)}")
+            print(f" - {db}")
 
+    if workers > 1:
+        # Tabeller og analytics-join på tværs af processer
+        if export_parallel(db_files, workers, args.compress, args.batch_size, table_fn):
+            raise SystemExit(1)
+    else:
+        # 1) Eksporter alle .db-filer og tabeller
         for db in db_files:
-            export_db(db)
+            export_db(db, args.compress, args.batch_size, table_fn)
+
+        # 2) Lav samlet analytics-join til Tableau mv.
+        export_analytics_join(args.compress, args.batch_size, db_files)
 
-    # 2) Lav samlet analytics-join til Tableau mv.
-    export_analytics_join()
+    # 3) Evt. compaction af de inkrementelle eksporter
+    if args.compact:
+        compact_all(args.compress, args.batch_size)
 
 
 if __name__ == "__main__":
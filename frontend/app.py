@@ -495,19 +495,19 @@ def page_leases():
             available_models_options = ["(ingen tilgængelige data)", "Anden model (manuel indtastning)"]
 
             try:
+                # Modelkataloget har allerede antal ledige pr. model
                 fleet_resp = api_get(
-                    "/fleet/vehicles",
-                    params={"status": "AVAILABLE"},
+                    "/fleet/vehicles/models",
+                    params={"available_only": "true"},
                     token=st.session_state.token,
                 )
                 if fleet_resp.status_code == 200:
-                    vehicles = fleet_resp.json()
-                    model_counts = {}
-                    for v in vehicles:
-                        m = v.get("model_name")
-                        if not m:
-                            continue
-                        model_counts[m] = model_counts.get(m, 0) + 1
+                    models = fleet_resp.json()
+                    model_counts = {
+                        m["model_name"]: m["available_count"]
+                        for m in models
+                        if m.get("model_name")
+                    }
 
                     if model_counts:
                         available_models_options = [
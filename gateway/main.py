@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
 import requests
 import jwt
@@ -38,6 +38,9 @@ ROUTE_PERMISSIONS = {
     # Allocate bil til lease
     ("POST", "/fleet/vehicles/allocate"): ["DATAREG", "LEDELSE", "ADMIN"],
 
+    # Re-sync af flåden fra CSV (kun admin)
+    ("POST", "/fleet/vehicles/sync"): ["ADMIN"],
+
      # Opdatere status (fx DAMAGED, REPAIR, AVAILABLE)
     ("PUT", "/fleet/vehicles/"): ["DATAREG", "SKADE", "LEDELSE", "ADMIN"],  # /fleet/vehicles/<id>/status
 
@@ -50,6 +53,12 @@ ROUTE_PERMISSIONS = {
     # ----- REPORTING -----
     ("GET", "/reporting/kpi"): ["FORRET", "LEDELSE", "ADMIN"],
     ("GET", "/reporting/kpi/overview"): ["FORRET", "LEDELSE", "ADMIN"],
+    ("POST", "/reporting/kpi/history"): ["LEDELSE", "ADMIN"],
+    ("GET", "/reporting/revenue"): ["FORRET", "LEDELSE", "ADMIN"],
+    ("GET", "/reporting/fleet"): ["FORRET", "LEDELSE", "ADMIN"],
+    ("GET", "/reporting/damage-cube"): ["SKADE", "FORRET", "LEDELSE", "ADMIN"],
+    ("GET", "/reporting/distributions"): ["SKADE", "FORRET", "LEDELSE", "ADMIN"],
+    ("GET", "/reporting/customers"): ["FORRET", "LEDELSE", "ADMIN"],
 
     # ----- RKI -----
     ("POST", "/rki/check"): ["DATAREG", "FORRET", "LEDELSE", "ADMIN"],
@@ -149,6 +158,46 @@ def _safe_forward(method: str, url: str, **kwargs):
         }), 503
 
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def _wants_ndjson():
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def _forward_list(url: str):
+    """
+    GET til en list-endpoint. Beder klienten om NDJSON, streames svaret
+    videre chunk for chunk i stedet for at blive samlet i gatewayen.
+    """
+    if not _wants_ndjson():
+        return _safe_forward("GET", url, params=request.args)
+
+    try:
+        resp = requests.get(
+            url,
+            params=request.args,
+            headers={"Accept": NDJSON_MIMETYPE},
+            timeout=5,
+            stream=True,
+        )
+    except requests.exceptions.RequestException as e:
+        return jsonify({
+            "error": "Upstream service unavailable",
+            "upstream_url": url,
+            "details": str(e),
+        }), 503
+
+    out = Response(
+        resp.iter_content(chunk_size=64 * 1024),
+        status=resp.status_code,
+        content_type=resp.headers.get("Content-Type", NDJSON_MIMETYPE),
+    )
+    out.call_on_close(resp.close)
+    return out
+
+
 # -------- AUTH ROUTES (proxy til AuthService) --------
 
 @app.post("/auth/login")
@@ -198,7 +247,7 @@ def auth_change_role(user_id):
 @app.get("/leases")
 def gw_get_leases():
     url = f"{LEASE_BASE}/leases"
-    return _safe_forward("GET", url, params=request.args)
+    return _forward_list(url)
 
 
 @app.get("/leases/<int:lease_id>")
@@ -230,7 +279,7 @@ def gw_end_lease(lease_id):
 @app.get("/damages")
 def gw_get_damages():
     url = f"{DAMAGE_BASE}/damages"
-    return _safe_forward("GET", url, params=request.args)
+    return _forward_list(url)
 
 
 @app.get("/damages/<int:damage_id>")
@@ -261,6 +310,16 @@ def gw_get_vehicles():
     GET /fleet/vehicles?status=AVAILABLE
     """
     url = f"{FLEET_BASE}/vehicles"
+    return _forward_list(url)
+
+
+@app.get("/fleet/vehicles/models")
+def gw_get_vehicle_models():
+    """
+    GET /fleet/vehicles/models
+    GET /fleet/vehicles/models?available_only=true
+    """
+    url = f"{FLEET_BASE}/vehicles/models"
     return _safe_forward("GET", url, params=request.args)
 
 
@@ -285,6 +344,18 @@ def gw_allocate_vehicle():
     return _safe_forward("POST", url, json=request.get_json())
 
 
+@app.post("/fleet/vehicles/sync")
+def gw_sync_vehicles():
+    """
+    POST /fleet/vehicles/sync
+    Body (optional): { "chunk_size": 500 }
+
+    Admin: indlæser en opdateret flåde-CSV inkrementelt.
+    """
+    url = f"{FLEET_BASE}/vehicles/sync"
+    return _safe_forward("POST", url, json=request.get_json(silent=True))
+
+
 @app.put("/fleet/vehicles/<int:vehicle_id>/status")
 def gw_update_vehicle_status(vehicle_id):
     """
@@ -302,7 +373,49 @@ def gw_update_vehicle_status(vehicle_id):
 @app.get("/reporting/kpi/overview")
 def gw_kpi_overview():
     url = f"{REPORT_BASE}/reporting/kpi/overview"
-    return _safe_forward("GET", url)
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.get("/reporting/kpi/history")
+def gw_kpi_history():
+    url = f"{REPORT_BASE}/reporting/kpi/history"
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.post("/reporting/kpi/history")
+def gw_kpi_history_record():
+    url = f"{REPORT_BASE}/reporting/kpi/history"
+    return _safe_forward("POST", url)
+
+
+@app.get("/reporting/revenue/mrr")
+def gw_revenue_mrr():
+    url = f"{REPORT_BASE}/reporting/revenue/mrr"
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.get("/reporting/fleet/utilization")
+def gw_fleet_utilization():
+    url = f"{REPORT_BASE}/reporting/fleet/utilization"
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.get("/reporting/damage-cube")
+def gw_damage_cube():
+    url = f"{REPORT_BASE}/reporting/damage-cube"
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.get("/reporting/distributions")
+def gw_distributions():
+    url = f"{REPORT_BASE}/reporting/distributions"
+    return _safe_forward("GET", url, params=request.args)
+
+
+@app.get("/reporting/customers")
+def gw_customers():
+    url = f"{REPORT_BASE}/reporting/customers"
+    return _safe_forward("GET", url, params=request.args)
 
 
 # -------- RKI ROUTES (proxy til RKI Service) --------
@@ -319,7 +432,7 @@ def gw_rki_check():
 @app.get("/reservations")
 def gw_get_reservations():
     url = f"{RESERVATION_BASE}/reservations"
-    return _safe_forward("GET", url, params=request.args)
+    return _forward_list(url)
 
 @app.post("/reservations")
 def gw_create_reservation():
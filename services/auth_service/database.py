@@ -3,6 +3,8 @@ from pathlib import Path
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from serialization import query_json_array
+
 DB_PATH = Path(__file__).parent / "auth.db"
 
 
@@ -69,17 +71,26 @@ def get_user_by_id(user_id: int):
     return row
 
 
+LIST_USERS_SQL = "SELECT id, username, email, role, is_active, created_at FROM users ORDER BY id"
+
+
 def list_users():
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, username, email, role, is_active, created_at FROM users ORDER BY id"
-    )
+    cur.execute(LIST_USERS_SQL)
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
+def list_users_json() -> str:
+    """Som list_users, men returnerer færdig JSON bygget i SQLite."""
+    conn = get_connection()
+    payload = query_json_array(conn, LIST_USERS_SQL)
+    conn.close()
+    return payload
+
+
 def update_user_role(user_id: int, new_role: str):
     conn = get_connection()
     cur = conn.cursor()
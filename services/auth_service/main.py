@@ -3,12 +3,13 @@ import jwt
 import os
 from datetime import datetime, timedelta
 
+from serialization import json_response
 from database import (
     init_db,
     create_user,
     get_user_by_username,
     get_user_by_id,
-    list_users,
+    list_users_json,
     update_user_role,
     verify_password,
 )
@@ -148,9 +149,7 @@ def require_role(required_roles):
 @app.get("/users")
 @require_role(["ADMIN", "LEDELSE"])
 def get_users():
-    rows = list_users()
-    users = [dict(row) for row in rows]
-    return jsonify(users)
+    return json_response(list_users_json())
 
 
 @app.post("/users")
@@ -0,0 +1,171 @@
+"""
+Transaktionel change log (change feed) for en data-service.
+
+Hver skrivning kalder record_change() med samme cursor som selve mutationen,
+så ændringen og log-rækken committes (eller rulles tilbage) sammen.
+GET /changes?since=<seq>&limit=&wait= læser loggen; med wait > 0 long-poller
+endpointet indtil der kommer nye ændringer eller tiden løber ud.
+GET /version giver højeste seq som en billig tabel-version, så forbrugere
+kan se om noget er ændret uden at læse data.
+
+Kilden ligger i services/common/ og kopieres ind i lease-, fleet-, damage-
+og reservation_service med services/common/vendor.py.
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+# Hvor længe ændringer gemmes. Forbrugere der er længere bagud får
+# reset_required = true og må lave en fuld genindlæsning.
+CHANGELOG_RETENTION_DAYS = int(os.getenv("CHANGELOG_RETENTION_DAYS", "7"))
+CHANGELOG_PRUNE_EVERY = 500        # oprydning ved hver N'te ændring
+CHANGES_MAX_LIMIT = 1000
+CHANGES_MAX_WAIT = 30.0            # sek. long-poll
+CHANGES_POLL_INTERVAL = 0.25
+
+
+def init_changelog(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity         TEXT NOT NULL,
+            entity_id      INTEGER NOT NULL,
+            op             TEXT NOT NULL,       -- INSERT / UPDATE / DELETE
+            changed_fields TEXT NOT NULL,       -- JSON-objekt med nye værdier
+            changed_at     TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at
+        ON changes(changed_at)
+        """
+    )
+
+
+def record_changes(cur: sqlite3.Cursor, entries):
+    """
+    Skriver ændringer i den igangværende transaktion.
+    entries: iterable af (entity, entity_id, op, changed_fields: dict).
+    """
+    now = datetime.utcnow().isoformat()
+    rows = [
+        (entity, entity_id, op, json.dumps(fields, default=str), now)
+        for entity, entity_id, op, fields in entries
+    ]
+    if not rows:
+        return
+    cur.executemany(
+        """
+        INSERT INTO changes (entity, entity_id, op, changed_fields, changed_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+    # Ryd op hver gang sekvensen passerer et multiplum af CHANGELOG_PRUNE_EVERY
+    seq = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+    if seq // CHANGELOG_PRUNE_EVERY != (seq - len(rows)) // CHANGELOG_PRUNE_EVERY:
+        prune_changes(cur)
+
+
+def record_change(cur: sqlite3.Cursor, entity: str, entity_id: int, op: str, changed_fields: dict):
+    record_changes(cur, [(entity, entity_id, op, changed_fields)])
+
+
+def prune_changes(cur: sqlite3.Cursor):
+    """Sletter ændringer ældre end CHANGELOG_RETENTION_DAYS."""
+    cutoff = (datetime.utcnow() - timedelta(days=CHANGELOG_RETENTION_DAYS)).isoformat()
+    cur.execute("DELETE FROM changes WHERE changed_at < ?", (cutoff,))
+
+
+def table_version(conn: sqlite3.Connection) -> int:
+    """
+    Billig version af servicens data: højeste seq i change loggen. Hver
+    skrivning tæller den op i samme transaktion som mutationen, og den
+    falder aldrig (sqlite_sequence husker den, også når alt er ryddet op).
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+
+def version_endpoint(connect):
+    """Fælles logik bag GET /version. Returnerer (body, status)."""
+    conn = connect()
+    try:
+        return {"version": table_version(conn)}, 200
+    finally:
+        conn.close()
+
+
+def list_changes(conn: sqlite3.Connection, since: int, limit: int):
+    cur = conn.execute(
+        """
+        SELECT seq, entity, entity_id, op, changed_fields, changed_at
+        FROM changes
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+        """,
+        (since, limit + 1),
+    )
+    rows = cur.fetchall()
+    oldest_seq = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+    latest_seq = table_version(conn)
+    if oldest_seq is None:
+        oldest_seq = latest_seq + 1
+
+    changes = [
+        {
+            "seq": r[0],
+            "entity": r[1],
+            "entity_id": r[2],
+            "op": r[3],
+            "changed_fields": json.loads(r[4]),
+            "changed_at": r[5],
+        }
+        for r in rows[:limit]
+    ]
+    # Hul i sekvensen pga. retention (eller en ny DB): forbrugeren har
+    # mistet ændringer og skal genindlæse fuldt
+    reset_required = since < oldest_seq - 1 or since > latest_seq
+
+    return {
+        "changes": changes,
+        "next_since": changes[-1]["seq"] if changes else max(since, 0),
+        "latest_seq": latest_seq,
+        "oldest_seq": oldest_seq,
+        "has_more": len(rows) > limit,
+        "reset_required": reset_required,
+    }
+
+
+def changes_endpoint(connect, args):
+    """
+    Fælles logik bag GET /changes. args er request.args.
+    Returnerer (body, status).
+    """
+    try:
+        since = int(args.get("since", 0))
+        limit = int(args.get("limit", 100))
+        wait = float(args.get("wait", 0))
+    except (TypeError, ValueError):
+        return {"error": "since, limit and wait must be numbers"}, 400
+
+    limit = max(1, min(limit, CHANGES_MAX_LIMIT))
+    wait = max(0.0, min(wait, CHANGES_MAX_WAIT))
+    deadline = time.monotonic() + wait
+
+    while True:
+        conn = connect()
+        try:
+            result = list_changes(conn, since, limit)
+        finally:
+            conn.close()
+        if result["changes"] or result["reset_required"] or time.monotonic() >= deadline:
+            return result, 200
+        time.sleep(CHANGES_POLL_INTERVAL)
@@ -0,0 +1,64 @@
+"""
+Kopierer de fælles moduler i services/common/ ind i de services der bruger dem.
+
+Hver service bygges som sit eget image (build context = servicens mappe),
+så modulerne skal ligge i servicemappen. Ret kun i services/common/ og kør:
+
+    python services/common/vendor.py          # skriv kopierne
+    python services/common/vendor.py --check  # exit 1 hvis en kopi afviger
+"""
+import argparse
+import sys
+from pathlib import Path
+
+COMMON = Path(__file__).resolve().parent
+SERVICES = COMMON.parent
+
+# modul -> services der får en kopi
+MODULES = {
+    "serialization.py": (
+        "auth_service",
+        "damage_service",
+        "fleet_service",
+        "lease_service",
+        "reservation_service",
+    ),
+    "changelog.py": (
+        "damage_service",
+        "fleet_service",
+        "lease_service",
+        "reservation_service",
+    ),
+}
+
+HEADER = "# Genereret fra services/common/{name} af services/common/vendor.py – ret ikke her.\n"
+
+
+def vendored(name: str) -> str:
+    """Indholdet kopien af name skal have."""
+    return HEADER.format(name=name) + (COMMON / name).read_text(encoding="utf-8")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="skriv intet; fejl hvis en kopi afviger")
+    args = parser.parse_args()
+
+    stale = []
+    for name, services in MODULES.items():
+        content = vendored(name)
+        for service in services:
+            target = SERVICES / service / name
+            if target.exists() and target.read_text(encoding="utf-8") == content:
+                continue
+            stale.append(target)
+            if not args.check:
+                target.write_text(content, encoding="utf-8")
+
+    for target in stale:
+        print(f"{'afviger' if args.check else 'skrevet'}: {target.relative_to(SERVICES.parent)}")
+    return 1 if args.check and stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
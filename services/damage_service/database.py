@@ -2,6 +2,9 @@ import sqlite3
 from pathlib import Path
 from datetime import datetime
 
+from serialization import query_json_array, query_json_columns, iter_ndjson
+from changelog import init_changelog, record_change
+
 DB_PATH = Path(__file__).parent / "damage.db"
 
 
@@ -31,6 +34,9 @@ def init_db():
         """
     )
 
+    # Change feed (GET /changes)
+    init_changelog(cur)
+
     conn.commit()
     conn.close()
 
@@ -68,15 +74,14 @@ def create_damage(data: dict):
     )
 
     damage_id = cur.lastrowid
+    cur.execute("SELECT * FROM damages WHERE id = ?", (damage_id,))
+    record_change(cur, "damage", damage_id, "INSERT", dict(cur.fetchone()))
     conn.commit()
     conn.close()
     return damage_id
 
 
-def list_damages(status: str | None = None, lease_id: int | None = None):
-    conn = get_connection()
-    cur = conn.cursor()
-
+def _list_damages_query(status: str | None = None, lease_id: int | None = None):
     query = "SELECT * FROM damages WHERE 1=1"
     params: list = []
 
@@ -89,13 +94,90 @@ def list_damages(status: str | None = None, lease_id: int | None = None):
         params.append(lease_id)
 
     query += " ORDER BY detected_at DESC"
+    return query, params
+
 
-    cur.execute(query, params)
+def list_damages(status: str | None = None, lease_id: int | None = None):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(*_list_damages_query(status, lease_id))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
+def list_damages_json(status: str | None = None, lease_id: int | None = None) -> str:
+    """Som list_damages, men returnerer færdig JSON bygget i SQLite."""
+    conn = get_connection()
+    payload = query_json_array(conn, *_list_damages_query(status, lease_id))
+    conn.close()
+    return payload
+
+
+def list_damages_columns_json(status: str | None = None, lease_id: int | None = None) -> str:
+    """Som list_damages_json, men kolonneorienteret (?format=columns)."""
+    conn = get_connection()
+    payload = query_json_columns(conn, *_list_damages_query(status, lease_id))
+    conn.close()
+    return payload
+
+
+def stream_damages_ndjson(status: str | None = None, lease_id: int | None = None):
+    """Generator med damages som NDJSON (én række pr. linje), hentet med fetchmany."""
+    return iter_ndjson(get_connection, *_list_damages_query(status, lease_id))
+
+
+def damage_stats(recent_n: int = 5) -> dict:
+    """
+    Aggregater til reporting (GET /damages/stats), beregnet i SQL:
+    antal pr. status/kategori, gennemsnitlig omkostning, åbne skader
+    (status != CLOSED) med total omkostning og de seneste recent_n.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT status, COUNT(*) FROM damages GROUP BY status")
+    counts_by_status = {r[0]: r[1] for r in cur.fetchall()}
+
+    cur.execute("SELECT category, COUNT(*) FROM damages GROUP BY category ORDER BY category")
+    counts_by_category = {r[0]: r[1] for r in cur.fetchall()}
+
+    cur.execute("SELECT COUNT(estimated_cost), AVG(estimated_cost) FROM damages")
+    cost_count, avg_cost = cur.fetchone()
+
+    open_filter = "UPPER(COALESCE(status, '')) != 'CLOSED'"
+    cur.execute(f"SELECT COUNT(*), SUM(COALESCE(estimated_cost, 0)) FROM damages WHERE {open_filter}")
+    open_count, open_total = cur.fetchone()
+
+    cur.execute(
+        f"SELECT * FROM damages WHERE {open_filter} ORDER BY detected_at DESC LIMIT ?",
+        (recent_n,),
+    )
+    recent_open = [dict(r) for r in cur.fetchall()]
+
+    conn.close()
+    return {
+        "total": sum(counts_by_status.values()),
+        "counts_by_status": counts_by_status,
+        "counts_by_category": counts_by_category,
+        "cost": {"count": cost_count, "avg": avg_cost or 0.0},
+        "open": {"count": open_count, "total_cost": open_total or 0.0, "recent": recent_open},
+    }
+
+
+def damage_counts_by_lease() -> dict:
+    """
+    Antal skader pr. lease_id ({lease_id: antal}, kun aftaler med skader),
+    beregnet i SQL. Bruges af lease_service til at afstemme damage_count.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT lease_id, COUNT(*) FROM damages WHERE lease_id IS NOT NULL GROUP BY lease_id")
+    counts = {r[0]: r[1] for r in cur.fetchall()}
+    conn.close()
+    return counts
+
+
 def get_damage_by_id(damage_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -112,5 +194,7 @@ def update_damage_status(damage_id: int, new_status: str):
         "UPDATE damages SET status = ? WHERE id = ?",
         (new_status, damage_id),
     )
+    if cur.rowcount:
+        record_change(cur, "damage", damage_id, "UPDATE", {"status": new_status})
     conn.commit()
     conn.close()
@@ -1,10 +1,17 @@
 import os
 import requests
 from flask import Flask, request, jsonify
+from serialization import json_response, ndjson_response, wants_columns, wants_ndjson
+from changelog import changes_endpoint, version_endpoint
 from database import (
     init_db,
+    get_connection,
     create_damage,
-    list_damages,
+    list_damages_json,
+    stream_damages_ndjson,
+    list_damages_columns_json,
+    damage_stats,
+    damage_counts_by_lease,
     get_damage_by_id,
     update_damage_status,
 )
@@ -13,6 +20,8 @@ app = Flask(__name__)
 
 # Fleet-service base URL (overstyres i Docker via FLEET_BASE_URL)
 FLEET_BASE_URL = os.getenv("FLEET_BASE_URL", "http://localhost:5006")
+# Lease-service base URL (overstyres i Docker via LEASE_BASE_URL)
+LEASE_BASE_URL = os.getenv("LEASE_BASE_URL", "http://lease_service:5002")
 
 def call_fleet_update_status(vehicle_id: int, status: str, lease_id: int | None = None):
     """
@@ -38,6 +47,27 @@ def call_fleet_update_status(vehicle_id: int, status: str, lease_id: int | None
     return True, None
 
 
+def call_lease_register_damage(lease_id: int):
+    """
+    Fortæller LeaseService at aftalen har fået en skade (damage_count),
+    så "afsluttede aftaler med skader" kan tælles i SQL dér. Går kaldet
+    tabt, retter LeaseService's periodiske afstemning tallet.
+    Returnerer (ok: bool, error_dict | None)
+    """
+    try:
+        resp = requests.post(f"{LEASE_BASE_URL}/leases/{lease_id}/damages", timeout=5)
+    except Exception as e:
+        return False, {"error": "lease_service unavailable", "details": str(e)}
+
+    if resp.status_code != 200:
+        try:
+            return False, resp.json()
+        except Exception:
+            return False, {"error": f"Invalid response from lease_service (status {resp.status_code})"}
+
+    return True, None
+
+
 
 @app.before_request
 def setup():
@@ -61,9 +91,54 @@ def get_damages():
         except ValueError:
             return jsonify({"error": "lease_id must be an integer"}), 400
 
-    rows = list_damages(status=status, lease_id=lease_id_int)
-    damages = [dict(row) for row in rows]
-    return jsonify(damages)
+    if wants_ndjson():
+        return ndjson_response(stream_damages_ndjson(status=status, lease_id=lease_id_int))
+    if wants_columns():
+        return json_response(list_damages_columns_json(status=status, lease_id=lease_id_int))
+    return json_response(list_damages_json(status=status, lease_id=lease_id_int))
+
+
+@app.get("/damages/stats")
+def get_damage_stats():
+    """
+    GET /damages/stats?recent=5
+    Aggregater til reporting_service (beregnet i SQL).
+    """
+    try:
+        recent_n = int(request.args.get("recent", 5))
+    except ValueError:
+        return jsonify({"error": "recent must be an integer"}), 400
+    return jsonify(damage_stats(recent_n=recent_n))
+
+
+@app.get("/damages/counts-by-lease")
+def get_damage_counts_by_lease():
+    """
+    GET /damages/counts-by-lease
+    Antal skader pr. aftale ({"counts": {"<lease_id>": antal}}), til
+    lease_service's afstemning af damage_count.
+    """
+    return jsonify({"counts": {str(k): v for k, v in damage_counts_by_lease().items()}})
+
+
+@app.get("/changes")
+def get_changes():
+    """
+    GET /changes?since=<seq>&limit=100&wait=0
+    Change feed over damages. wait > 0 long-poller op til så mange sekunder.
+    """
+    body, status = changes_endpoint(get_connection, request.args)
+    return jsonify(body), status
+
+
+@app.get("/version")
+def get_version():
+    """
+    GET /version
+    Tabel-version (højeste change-seq); stiger ved hver skrivning til damages.
+    """
+    body, status = version_endpoint(get_connection)
+    return jsonify(body), status
 
 
 @app.get("/damages/<int:damage_id>")
@@ -120,6 +195,12 @@ def create_damage_endpoint():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+    # Tæl skaden med på lejeaftalen (damage_count i LeaseService)
+    ok, lease_err = call_lease_register_damage(lease_id)
+    if not ok:
+        # Ikke fatalt: LeaseService afstemmer damage_count periodisk mod /damages/counts-by-lease
+        print(f"[damage_service] lease damage_count update failed: {lease_err}")
+
     # ----------------------------------------------------
     # Hvis vehicle_id kendt → Marker bil som DAMAGED i Fleet
     # ----------------------------------------------------
@@ -0,0 +1,109 @@
+# Genereret fra services/common/serialization.py af services/common/vendor.py – ret ikke her.
+"""
+Hurtig JSON-serialisering af SQLite-rækker.
+
+I stedet for sqlite3.Row -> dict -> jsonify lader vi SQLite bygge hele
+payloaden i C med json_object/json_group_array, og sender strengen direkte
+som response. Det sparer en dict pr. række og Flask's encode-pas.
+
+Med "Accept: application/x-ndjson" streames rækkerne i stedet som én
+JSON-linje pr. række (fetchmany over en cursor), så hukommelsen er konstant.
+
+Med "?format=columns" returneres et objekt med ét array pr. kolonne
+({"id": [...], "status": [...]}), som kan lægges direkte i NumPy-arrays
+(reporting_service/columnar.py) uden en dict pr. række.
+
+Kilden ligger i services/common/ og kopieres ind i hver service med
+services/common/vendor.py (hver service bygges som sit eget image).
+"""
+import sqlite3
+
+from flask import Response, request
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 1000
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_names(conn: sqlite3.Connection, sql: str, params=()) -> list[str]:
+    """Kolonnenavne for en forespørgsel, uden at hente rækker."""
+    cur = conn.execute(f"SELECT * FROM ({sql}) LIMIT 0", params)
+    return [d[0] for d in cur.description]
+
+
+def _json_object_expr(columns: list[str]) -> str:
+    return "json_object(" + ", ".join(
+        f"'{c.replace(chr(39), chr(39) * 2)}', {_quote_identifier(c)}" for c in columns
+    ) + ")"
+
+
+def query_json_array(conn: sqlite3.Connection, sql: str, params=()) -> str:
+    """
+    Kører sql og returnerer resultatet som JSON-array (str), bygget i SQLite.
+    Rækkefølgen følger sql's ORDER BY, men det er ikke garanteret af SQL:
+    vi udnytter at SQLite (pt.) aggregerer en subquery i dens rækkefølge.
+    ORDER BY inde i aggregatet kræver SQLite >= 3.44.
+    """
+    columns = _column_names(conn, sql, params)
+    cur = conn.execute(
+        f"SELECT json_group_array({_json_object_expr(columns)}) FROM ({sql})",
+        params,
+    )
+    return cur.fetchone()[0]
+
+
+def query_json_columns(conn: sqlite3.Connection, sql: str, params=()) -> str:
+    """
+    Som query_json_array, men kolonneorienteret: {"kolonne": [værdier], ...}.
+    Alle kolonner har samme rækkefølge (sql's ORDER BY, med samme forbehold
+    som query_json_array).
+    """
+    columns = _column_names(conn, sql, params)
+    expr = "json_object(" + ", ".join(
+        f"'{c.replace(chr(39), chr(39) * 2)}', json_group_array({_quote_identifier(c)})" for c in columns
+    ) + ")"
+    cur = conn.execute(f"SELECT {expr} FROM ({sql})", params)
+    return cur.fetchone()[0]
+
+
+def wants_columns() -> bool:
+    """True hvis klienten har bedt om kolonneformat (?format=columns)."""
+    return request.args.get("format") == "columns"
+
+
+def json_response(payload: str, status: int = 200) -> Response:
+    """Pakker en færdig JSON-streng som Flask-response."""
+    return Response(payload, status=status, mimetype="application/json")
+
+
+def wants_ndjson() -> bool:
+    """True hvis klienten foretrækker NDJSON frem for et almindeligt JSON-array."""
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def iter_ndjson(connect, sql: str, params=(), batch_size: int = NDJSON_BATCH_SIZE):
+    """
+    Generator der yielder NDJSON i bidder af batch_size rækker.
+    Forbindelsen åbnes først når streamen starter og lukkes når den slutter
+    (eller klienten afbryder), da den skal overleve selve view-funktionen.
+    """
+    conn = connect()
+    try:
+        columns = _column_names(conn, sql, params)
+        cur = conn.execute(f"SELECT {_json_object_expr(columns)} FROM ({sql})", params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield "\n".join(r[0] for r in rows) + "\n"
+    finally:
+        conn.close()
+
+
+def ndjson_response(chunks, status: int = 200) -> Response:
+    """Streamer output fra iter_ndjson som application/x-ndjson."""
+    return Response(chunks, status=status, mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,189 @@
+"""
+In-memory indeks over flådens tilgængelighed.
+
+Holder pr. model en sorteret liste af AVAILABLE bil-id'er samt tællere pr.
+status og pr. udleveringssted, så allokering og prisopslag ikke skal scanne
+vehicles-tabellen. Indekset er bundet til fleet_meta.version: hvis en anden
+worker (eller sync) har skrevet til DB'en, genindlæses det. Versionen slås
+højst op hvert VERSION_CHECK_INTERVAL sekund; egne skrivninger lægges ind
+direkte, og allokeringens compare-and-set i DB'en fanger resten.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from database import (
+    load_availability_snapshot,
+    get_fleet_version,
+    allocate_available_vehicle,
+    update_vehicle_status,
+)
+
+VERSION_CHECK_INTERVAL = float(os.getenv("FLEET_VERSION_CHECK_INTERVAL", "0.5"))
+
+_lock = threading.RLock()
+
+_version = None                          # fleet_meta.version indekset svarer til
+_checked_at = 0.0                        # time.monotonic() for seneste versionsopslag
+_claimed = set()                         # id'er som en tråd i processen er ved at allokere
+_vehicles = {}                           # id -> (model_name, status, location, monthly_price)
+_available_by_model = defaultdict(list)  # model_name -> sorteret liste af AVAILABLE id'er
+_status_counts = Counter()               # status -> antal
+_location_counts = defaultdict(Counter)  # delivery_location -> Counter(status)
+
+
+def _add(vehicle_id, model_name, status, location, monthly_price):
+    _vehicles[vehicle_id] = (model_name, status, location, monthly_price)
+    _status_counts[status] += 1
+    _location_counts[location][status] += 1
+    if status == "AVAILABLE":
+        insort(_available_by_model[model_name], vehicle_id)
+
+
+def _remove(vehicle_id):
+    old = _vehicles.pop(vehicle_id, None)
+    if old is None:
+        return
+    model_name, status, location, _ = old
+    _status_counts[status] -= 1
+    _location_counts[location][status] -= 1
+    if status == "AVAILABLE":
+        ids = _available_by_model[model_name]
+        i = bisect_left(ids, vehicle_id)
+        if i < len(ids) and ids[i] == vehicle_id:
+            ids.pop(i)
+
+
+def reload():
+    """Genopbygger hele indekset fra fleet.db."""
+    global _version, _checked_at
+    with _lock:
+        version, rows = load_availability_snapshot()
+        _vehicles.clear()
+        _available_by_model.clear()
+        _status_counts.clear()
+        _location_counts.clear()
+        for r in rows:
+            _add(r["id"], r["model_name"], r["status"], r["delivery_location"], r["monthly_price"])
+        _version = version
+        _checked_at = time.monotonic()
+
+
+def ensure_fresh(force: bool = False):
+    """
+    Versionsopslag højst hvert VERSION_CHECK_INTERVAL sekund (eller med
+    force); genindlæs kun hvis DB'en er ændret udefra.
+    """
+    global _checked_at
+    with _lock:
+        now = time.monotonic()
+        if _version is not None and not force and now - _checked_at < VERSION_CHECK_INTERVAL:
+            return
+        if _version is None or get_fleet_version() != _version:
+            reload()
+        else:
+            _checked_at = now
+
+
+def current_version():
+    """Indeksets fleet_meta.version (fx som cache-nøgle for modelkataloget)."""
+    ensure_fresh()
+    return _version
+
+
+def apply_row(row, version):
+    """
+    Opdaterer indekset med en række vi selv lige har skrevet.
+    Er versionen allerede nået (en genindlæsning har set skrivningen), gøres
+    intet. Er den sprunget mere end én frem, har andre også skrevet, og vi
+    genindlæser i stedet for at gætte.
+    """
+    global _version
+    if row is None or version is None:
+        return
+    with _lock:
+        if _version is not None and version <= _version:
+            return
+        if _version is None or version != _version + 1:
+            reload()
+            return
+        _remove(row["id"])
+        _add(row["id"], row["model_name"], row["status"], row["delivery_location"], row["monthly_price"])
+        _version = version
+
+
+def first_available(model_name: str):
+    """Returnerer (id, monthly_price) for første AVAILABLE bil af modellen, eller None."""
+    ensure_fresh()
+    with _lock:
+        ids = _available_by_model.get(model_name)
+        if not ids:
+            return None
+        vehicle_id = ids[0]
+        return vehicle_id, _vehicles[vehicle_id][3]
+
+
+def _claim(model_name: str):
+    """
+    Første AVAILABLE bil af modellen som ingen anden tråd i processen er ved
+    at allokere; markeres som claimed. Returnerer id eller None.
+    """
+    with _lock:
+        for vehicle_id in _available_by_model.get(model_name, ()):
+            if vehicle_id not in _claimed:
+                _claimed.add(vehicle_id)
+                return vehicle_id
+        return None
+
+
+def allocate(model_name: str, lease_id: int, max_attempts: int = 5):
+    """
+    Allokerer en bil ud fra indekset. Låsen holdes kun mens kandidaten vælges
+    i hukommelsen og mens resultatet lægges ind bagefter; selve statusskiftet
+    er en atomisk compare-and-set i DB'en, som afgør kapløb. Tråde i samme
+    proces vælger aldrig samme kandidat (_claimed); taber vi til en anden
+    worker, tjekkes versionen med det samme og næste kandidat prøves.
+    """
+    ensure_fresh()
+    for _ in range(max_attempts):
+        vehicle_id = _claim(model_name)
+        if vehicle_id is None:
+            return None
+        try:
+            row, version = allocate_available_vehicle(model_name, lease_id, vehicle_id=vehicle_id)
+        finally:
+            with _lock:
+                _claimed.discard(vehicle_id)
+        if row is not None:
+            apply_row(row, version)
+            return row
+        ensure_fresh(force=True)
+
+    # Vedvarende kapløb: lad DB'en vælge bilen direkte
+    row, version = allocate_available_vehicle(model_name, lease_id)
+    apply_row(row, version)
+    return row
+
+
+def set_status(vehicle_id: int, status: str, lease_id: int | None):
+    """update_vehicle_status + opdatering af indekset. Returnerer den nye række."""
+    row, version = update_vehicle_status(vehicle_id=vehicle_id, status=status, lease_id=lease_id)
+    apply_row(row, version)
+    return row
+
+
+def summary():
+    """Tællere til /vehicles/availability."""
+    ensure_fresh()
+    with _lock:
+        return {
+            "version": _version,
+            "status_counts": {s: c for s, c in _status_counts.items() if c},
+            "available_by_model": {m: len(ids) for m, ids in sorted(_available_by_model.items()) if ids},
+            "locations": {
+                loc: {s: c for s, c in counts.items() if c}
+                for loc, counts in sorted(_location_counts.items(), key=lambda kv: str(kv[0]))
+            },
+        }
@@ -2,6 +2,13 @@ import sqlite3
 from pathlib import Path
 from datetime import datetime
 import csv
+import hashlib
+import json
+import statistics
+import time
+
+from serialization import query_json_array, query_json_columns, iter_ndjson
+from changelog import init_changelog, record_change, record_changes
 
 
 
@@ -11,9 +18,13 @@ import csv
 DB_PATH = Path(__file__).parent / "fleet.db"
 CSV_PATH = Path(__file__).parent / "Bilabonnement 2025(Sheet1).csv"
 
+# Hvor længe en forbindelse venter på en skrivelås, før SQLite giver op (sek.)
+BUSY_TIMEOUT = 10.0
+ALLOCATE_RETRIES = 5
+
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -42,10 +53,44 @@ def init_db():
             subscription_years  REAL,
             status              TEXT NOT NULL DEFAULT 'AVAILABLE',
             current_lease_id    INTEGER,
-            updated_at          TEXT NOT NULL
+            updated_at          TEXT NOT NULL,
+            source_key          TEXT,
+            source_hash         TEXT
+        )
+        """
+    )
+
+    # Versionstæller for flåden: tælles op i samme transaktion som hver
+    # skrivning til vehicles, så in-memory indeks i alle workers kan opdage
+    # ændringer med ét billigt opslag.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fleet_meta (
+            id      INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
         )
         """
     )
+    cur.execute("INSERT OR IGNORE INTO fleet_meta (id, version) VALUES (1, 0)")
+
+    # Change feed (GET /changes)
+    init_changelog(cur)
+
+    # Migrering af ældre fleet.db uden sync-nøgle: nøglen udledes af de
+    # gemte værdier (samme felter som i CSV'en, se SOURCE_KEY_COLUMNS).
+    # En tidligere nøgle på rækkens løbenummer (source_row) bruges ikke mere.
+    existing_cols = {r["name"] for r in cur.execute("PRAGMA table_info(vehicles)")}
+    if "source_key" not in existing_cols:
+        cur.execute("ALTER TABLE vehicles ADD COLUMN source_key TEXT")
+        cur.execute("DROP INDEX IF EXISTS idx_vehicles_source_row")
+        cur.execute(f"SELECT id, {', '.join(SOURCE_KEY_COLUMNS)} FROM vehicles ORDER BY id")
+        seen = {}
+        cur.executemany(
+            "UPDATE vehicles SET source_key = ? WHERE id = ?",
+            [(_source_key([r[c] for c in SOURCE_KEY_COLUMNS], seen), r["id"]) for r in cur.fetchall()],
+        )
+    if "source_hash" not in existing_cols:
+        cur.execute("ALTER TABLE vehicles ADD COLUMN source_hash TEXT")
 
     # Evt. simple indeks til hurtigere opslag senere
     cur.execute(
@@ -60,6 +105,37 @@ def init_db():
         ON vehicles(model_name, status)
         """
     )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_vehicles_source_key
+        ON vehicles(source_key)
+        """
+    )
+    # Watermark for inkrementel CSV-eksport (updated_at > sidste kørsel)
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_vehicles_updated_at
+        ON vehicles(updated_at)
+        """
+    )
+
+    # Materialiseret modelkatalog (pris-statistik pr. model, uafhængig af om
+    # der lige nu er en ledig bil). Vedligeholdes pr. model ved hver skrivning.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS model_catalog (
+            model_name      TEXT PRIMARY KEY,
+            vehicle_count   INTEGER NOT NULL,
+            available_count INTEGER NOT NULL,
+            min_price       REAL,
+            median_price    REAL,
+            max_price       REAL,
+            fuel_types      TEXT NOT NULL,      -- JSON-liste
+            locations       TEXT NOT NULL,      -- JSON-liste
+            updated_at      TEXT NOT NULL
+        )
+        """
+    )
 
     conn.commit()
 
@@ -67,8 +143,14 @@ def init_db():
     cur.execute("SELECT COUNT(*) AS c FROM vehicles")
     count = cur.fetchone()["c"]
     if count == 0 and CSV_PATH.exists():
-        seed_from_csv(cur)
-        conn.commit()
+        sync_from_csv(conn)
+    elif count > 0:
+        # Ældre fleet.db uden katalog: byg det én gang
+        cur.execute("SELECT COUNT(*) AS c FROM model_catalog")
+        if cur.fetchone()["c"] == 0:
+            _refresh_model_catalog(cur)
+            _bump_version(cur)
+            conn.commit()
 
     conn.close()
 
@@ -99,12 +181,176 @@ def _parse_int(value):
         return None
 
 
-def seed_from_csv(cur: sqlite3.Cursor):
+# CSV-kolonne -> vehicles-kolonne (+ parser). Rækkefølgen bruges både til
+# INSERT/UPDATE og til content-hash, så den må ikke ændres vilkårligt.
+CSV_COLUMNS = [
+    ("Dato Indkoeb", "purchase_date", None),
+    ("Startdato abonnement", "subscription_start", None),
+    ("Slutdato abonnement", "subscription_end", None),
+    ("Bilmaerke", "model_name", None),
+    ("Indkoebspris", "purchase_price", _parse_float),
+    ("Braendstof", "fuel_type", None),
+    ("Koert Km ved abonnemt start", "odometer_start", _parse_int),
+    ("Abonnement  Km koert", "subscription_km", _parse_int),
+    ("Aftalt kontraktabonnment KM", "contract_km", _parse_int),
+    ("Abonnementsperiode", "subscription_months", _parse_int),
+    ("abonnement pris pr maaned", "monthly_price", _parse_float),
+    ("Udleveringssted", "delivery_location", None),
+    ("Abonnement Varighed (År)", "subscription_years", _parse_float),
+]
+
+MODEL_NAME_INDEX = [db_name for _, db_name, _ in CSV_COLUMNS].index("model_name")
+
+# Felter der identificerer den fysiske bil og ikke ændres i dens levetid
+# (abonnementsfelterne gør). Arket har intet stelnummer/registreringsnummer;
+# kommer der et, er det den oplagte nøgle. Nøglen afhænger ikke af rækkens
+# placering, så rækker kan slettes eller flyttes i arket.
+SOURCE_KEY_COLUMNS = ["purchase_date", "model_name", "purchase_price", "fuel_type", "odometer_start"]
+_SOURCE_KEY_INDEXES = [[db_name for _, db_name, _ in CSV_COLUMNS].index(c) for c in SOURCE_KEY_COLUMNS]
+
+SYNC_CHUNK_SIZE = 500
+
+
+def _bump_version(cur: sqlite3.Cursor) -> int:
+    """Tæller flådens version op i den igangværende transaktion."""
+    cur.execute("UPDATE fleet_meta SET version = version + 1 WHERE id = 1 RETURNING version")
+    return cur.fetchone()[0]
+
+
+def get_fleet_version() -> int:
+    conn = get_connection()
+    row = conn.execute("SELECT version FROM fleet_meta WHERE id = 1").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def load_availability_snapshot():
+    """
+    Læser de felter in-memory indekset har brug for, sammen med versionen,
+    i én læsetransaktion (konsistent snapshot).
+    Returnerer (version, rows).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    cur.execute("SELECT version FROM fleet_meta WHERE id = 1")
+    version = cur.fetchone()[0]
+    cur.execute(
+        """
+        SELECT id, model_name, status, delivery_location, monthly_price
+        FROM vehicles
+        ORDER BY id
+        """
+    )
+    rows = cur.fetchall()
+    conn.commit()
+    conn.close()
+    return version, rows
+
+
+def _refresh_model_catalog(cur: sqlite3.Cursor, model_names=None):
     """
-    Læser Bilabonnement 2025(Sheet1).csv og indsætter biler i vehicles-tabellen.
-    Antager semikolon-separeret CSV.
+    Genberegner model_catalog for de givne modeller (None = alle) i den
+    igangværende transaktion. Modeller uden biler fjernes fra kataloget.
     """
-    with CSV_PATH.open("r", encoding="utf-8") as f:
+    if model_names is None:
+        cur.execute("SELECT DISTINCT model_name FROM vehicles")
+        model_names = [r[0] for r in cur.fetchall()]
+        cur.execute("DELETE FROM model_catalog")
+
+    now = datetime.utcnow().isoformat()
+    for model_name in set(model_names):
+        cur.execute(
+            """
+            SELECT status, monthly_price, fuel_type, delivery_location
+            FROM vehicles
+            WHERE model_name = ?
+            """,
+            (model_name,),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            cur.execute("DELETE FROM model_catalog WHERE model_name = ?", (model_name,))
+            continue
+
+        prices = sorted(r[1] for r in rows if r[1] is not None)
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO model_catalog (
+                model_name, vehicle_count, available_count,
+                min_price, median_price, max_price,
+                fuel_types, locations, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                model_name,
+                len(rows),
+                sum(1 for r in rows if r[0] == "AVAILABLE"),
+                prices[0] if prices else None,
+                statistics.median(prices) if prices else None,
+                prices[-1] if prices else None,
+                json.dumps(sorted({r[2] for r in rows if r[2]})),
+                json.dumps(sorted({r[3] for r in rows if r[3]})),
+                now,
+            ),
+        )
+
+
+def _refresh_model_availability(cur: sqlite3.Cursor, model_name: str):
+    """
+    Statusskift ændrer kun available_count; den tælles direkte på
+    idx_vehicles_model_status i stedet for at genberegne hele modellen.
+    """
+    cur.execute(
+        """
+        UPDATE model_catalog
+        SET available_count = (
+                SELECT COUNT(*) FROM vehicles
+                WHERE model_name = ? AND status = 'AVAILABLE'
+            ),
+            updated_at = ?
+        WHERE model_name = ?
+        """,
+        (model_name, datetime.utcnow().isoformat(), model_name),
+    )
+
+
+def list_model_catalog():
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM model_catalog ORDER BY model_name")
+    rows = cur.fetchall()
+    conn.close()
+
+    catalog = []
+    for r in rows:
+        entry = dict(r)
+        entry["fuel_types"] = json.loads(entry["fuel_types"])
+        entry["locations"] = json.loads(entry["locations"])
+        catalog.append(entry)
+    return catalog
+
+
+def _source_key(key_values, seen: dict) -> str:
+    """
+    source_key ud fra værdierne i SOURCE_KEY_COLUMNS. Helt ens biler (samme
+    nøgle) nummereres i den rækkefølge de mødes: "<nøgle>", "<nøgle>#2", ...
+    seen holder antal forekomster pr. nøgle indtil videre. Værdierne strippes,
+    da ældre seeds gemte tekst uden strip.
+    """
+    key = "|".join("" if v is None else str(v).strip() for v in key_values)
+    seen[key] = seen.get(key, 0) + 1
+    return key if seen[key] == 1 else f"{key}#{seen[key]}"
+
+
+def _iter_csv_rows(csv_path: Path):
+    """
+    Streamer CSV'en række for række.
+    Yielder (source_key, source_hash, values), hvor source_key er bilens
+    nøgle (se SOURCE_KEY_COLUMNS) og values de parsede kolonneværdier.
+    """
+    with csv_path.open("r", encoding="utf-8") as f:
         reader = csv.DictReader(f, delimiter=";")
 
         # FIX: fjern BOM fra første kolonnenavn (fx '\ufeffDato Indkoeb')
@@ -112,71 +358,199 @@ def seed_from_csv(cur: sqlite3.Cursor):
             cleaned = [name.lstrip("\ufeff") for name in reader.fieldnames]
             reader.fieldnames = cleaned
 
-        now = datetime.utcnow().isoformat()
-
+        seen = {}
         for row in reader:
             # Hvis rækken er helt tom, spring videre
             if not any(row.values()):
                 continue
 
+            raw = [(row.get(csv_name) or "").strip() for csv_name, _, _ in CSV_COLUMNS]
+            source_hash = hashlib.sha1("\x1f".join(raw).encode("utf-8")).hexdigest()
+            values = _parse_csv_values(raw)
+            yield _source_key([values[i] for i in _SOURCE_KEY_INDEXES], seen), source_hash, values
+
+
+def _parse_csv_values(raw: list[str]) -> tuple:
+    return tuple(
+        parser(value) if parser else value
+        for value, (_, _, parser) in zip(raw, CSV_COLUMNS)
+    )
+
+
+def _chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def sync_from_csv(conn: sqlite3.Connection, csv_path: Path | None = None, chunk_size: int = SYNC_CHUNK_SIZE):
+    """
+    Inkrementel import af flåde-CSV'en.
+    Læser filen i bidder af chunk_size rækker, sammenligner hver rækkes
+    content-hash med den gemte og upserter kun nye/ændrede biler med
+    executemany. status og current_lease_id røres ikke ved opdatering.
+    model_catalog genberegnes for de berørte modeller én gang til sidst.
+    Returnerer {"inserted": n, "updated": n, "unchanged": n}.
+    """
+    csv_path = csv_path or CSV_PATH
+    columns = [db_name for _, db_name, _ in CSV_COLUMNS]
+
+    insert_sql = f"""
+        INSERT INTO vehicles ({", ".join(columns)}, status, current_lease_id,
+                              updated_at, source_key, source_hash)
+        VALUES ({", ".join("?" for _ in columns)}, 'AVAILABLE', NULL, ?, ?, ?)
+    """
+    update_sql = f"""
+        UPDATE vehicles
+        SET {", ".join(f"{c} = ?" for c in columns)}, updated_at = ?, source_hash = ?
+        WHERE source_key = ?
+    """
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    cur = conn.cursor()
+    touched_models = set()  # kataloget genberegnes én gang efter sidste chunk
+
+    for chunk in _chunked(_iter_csv_rows(csv_path), chunk_size):
+        keys = [source_key for source_key, _, _ in chunk]
+        cur.execute(
+            f"SELECT source_key, source_hash, model_name FROM vehicles "
+            f"WHERE source_key IN ({', '.join('?' for _ in keys)})",
+            keys,
+        )
+        existing = {r["source_key"]: (r["source_hash"], r["model_name"]) for r in cur.fetchall()}
+
+        now = datetime.utcnow().isoformat()
+        inserts = []
+        updates = []
+        written = {}  # source_key -> (op, changed_fields) til change feed
+        for source_key, source_hash, values in chunk:
+            if source_key not in existing:
+                inserts.append((*values, now, source_key, source_hash))
+                written[source_key] = ("INSERT", None)
+                touched_models.add(values[MODEL_NAME_INDEX])
+            elif existing[source_key][0] != source_hash:
+                updates.append((*values, now, source_hash, source_key))
+                written[source_key] = ("UPDATE", dict(zip(columns, values)))
+                touched_models.add(values[MODEL_NAME_INDEX])
+                touched_models.add(existing[source_key][1])  # model kan være ændret
+            else:
+                counts["unchanged"] += 1
+
+        if inserts:
+            cur.executemany(insert_sql, inserts)
+        if updates:
+            cur.executemany(update_sql, updates)
+        if inserts or updates:
+            # Nye biler logges med hele den gemte række (status,
+            # current_lease_id osv.), ændrede kun med de skrevne felter
+            written_keys = list(written)
             cur.execute(
-                """
-                INSERT INTO vehicles (
-                    purchase_date,
-                    subscription_start,
-                    subscription_end,
-                    model_name,
-                    purchase_price,
-                    fuel_type,
-                    odometer_start,
-                    subscription_km,
-                    contract_km,
-                    subscription_months,
-                    monthly_price,
-                    delivery_location,
-                    subscription_years,
-                    status,
-                    current_lease_id,
-                    updated_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    row.get("Dato Indkoeb"),
-                    row.get("Startdato abonnement"),
-                    row.get("Slutdato abonnement"),
-                    row.get("Bilmaerke"),
-                    _parse_float(row.get("Indkoebspris")),
-                    row.get("Braendstof"),
-                    _parse_int(row.get("Koert Km ved abonnemt start")),
-                    _parse_int(row.get("Abonnement  Km koert")),
-                    _parse_int(row.get("Aftalt kontraktabonnment KM")),
-                    _parse_int(row.get("Abonnementsperiode")),
-                    _parse_float(row.get("abonnement pris pr maaned")),
-                    row.get("Udleveringssted"),
-                    _parse_float(row.get("Abonnement Varighed (År)")),
-                    "AVAILABLE",
-                    None,
-                    now,
-                ),
+                f"SELECT * FROM vehicles "
+                f"WHERE source_key IN ({', '.join('?' for _ in written_keys)})",
+                written_keys,
             )
+            record_changes(cur, [
+                ("vehicle", r["id"], written[r["source_key"]][0],
+                 dict(r) if written[r["source_key"]][0] == "INSERT"
+                 else {**written[r["source_key"]][1], "updated_at": now})
+                for r in cur.fetchall()
+            ])
+            _bump_version(cur)
+            conn.commit()
+
+        counts["inserted"] += len(inserts)
+        counts["updated"] += len(updates)
+
+    if touched_models:
+        _refresh_model_catalog(cur, touched_models)
+        _bump_version(cur)
+        conn.commit()
+
+    return counts
+
+
+def _list_vehicles_query(status: str | None = None):
+    if status:
+        return "SELECT * FROM vehicles WHERE status = ? ORDER BY id", (status,)
+    return "SELECT * FROM vehicles ORDER BY id", ()
 
 
 def list_vehicles(status: str | None = None):
     conn = get_connection()
     cur = conn.cursor()
-    if status:
-        cur.execute(
-            "SELECT * FROM vehicles WHERE status = ? ORDER BY id",
-            (status,),
-        )
-    else:
-        cur.execute("SELECT * FROM vehicles ORDER BY id")
+    cur.execute(*_list_vehicles_query(status))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
+def list_vehicles_json(status: str | None = None) -> str:
+    """Som list_vehicles, men returnerer færdig JSON bygget i SQLite."""
+    conn = get_connection()
+    payload = query_json_array(conn, *_list_vehicles_query(status))
+    conn.close()
+    return payload
+
+
+def list_vehicles_columns_json(status: str | None = None) -> str:
+    """Som list_vehicles_json, men kolonneorienteret (?format=columns)."""
+    conn = get_connection()
+    payload = query_json_columns(conn, *_list_vehicles_query(status))
+    conn.close()
+    return payload
+
+
+def stream_vehicles_ndjson(status: str | None = None):
+    """Generator med vehicles som NDJSON (én række pr. linje), hentet med fetchmany."""
+    return iter_ndjson(get_connection, *_list_vehicles_query(status))
+
+
+def vehicle_stats() -> dict:
+    """
+    Aggregater til reporting (GET /vehicles/stats), beregnet i SQL:
+    antal pr. status (NULL/tom = UNKNOWN, som i reporting), samt
+    status fordelt pr. model og pr. udleveringssted.
+    """
+    status_expr = "UPPER(COALESCE(NULLIF(status, ''), 'UNKNOWN'))"
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN")  # ét konsistent snapshot for version og tællinger
+    version = cur.execute("SELECT version FROM fleet_meta WHERE id = 1").fetchone()[0]
+
+    cur.execute(f"SELECT {status_expr} AS s, COUNT(*) FROM vehicles GROUP BY s")
+    status_counts = {r[0]: r[1] for r in cur.fetchall()}
+
+    by_model, by_location = {}, {}
+    cur.execute(
+        f"""
+        SELECT model_name, delivery_location, {status_expr} AS s, COUNT(*)
+        FROM vehicles
+        GROUP BY model_name, delivery_location, s
+        ORDER BY model_name, delivery_location
+        """
+    )
+    for model, location, status, count in cur.fetchall():
+        model_counts = by_model.setdefault(model, {})
+        model_counts[status] = model_counts.get(status, 0) + count
+        location_counts = by_location.setdefault(location, {})
+        location_counts[status] = location_counts.get(status, 0) + count
+
+    conn.rollback()
+    conn.close()
+    return {
+        "version": version,
+        "total": sum(status_counts.values()),
+        "status_counts": status_counts,
+        "by_model": by_model,
+        "by_location": by_location,
+    }
+
+
 def get_vehicle_by_id(vehicle_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -207,7 +581,68 @@ def find_available_by_model(model_name: str):
     return row
 
 
+def allocate_available_vehicle(model_name: str, lease_id: int, vehicle_id: int | None = None):
+    """
+    Allokerer atomisk en AVAILABLE bil af modellen til lease_id.
+    Udvælgelse og statusskift sker i ét UPDATE ... RETURNING (compare-and-set
+    på status = 'AVAILABLE'), så to samtidige kald aldrig får samme bil.
+    Angives vehicle_id (fx fra in-memory indekset), forsøges kun den bil.
+    Returnerer (række, fleet-version); rækken er None hvis ingen bil blev taget.
+    """
+    if vehicle_id is None:
+        target_sql = """
+            SELECT id FROM vehicles
+            WHERE model_name = ? AND status = 'AVAILABLE'
+            ORDER BY id
+            LIMIT 1
+        """
+        target_params = (model_name,)
+    else:
+        target_sql = "SELECT ?"
+        target_params = (vehicle_id,)
+
+    for attempt in range(ALLOCATE_RETRIES):
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            now = datetime.utcnow().isoformat()
+            cur.execute(
+                f"""
+                UPDATE vehicles
+                SET status = 'LEASED', current_lease_id = ?, updated_at = ?
+                WHERE id = ({target_sql})
+                AND model_name = ?
+                AND status = 'AVAILABLE'
+                RETURNING *
+                """,
+                (lease_id, now, *target_params, model_name),
+            )
+            row = cur.fetchone()
+            version = None
+            if row is not None:
+                record_change(cur, "vehicle", row["id"], "UPDATE", {
+                    "status": row["status"],
+                    "current_lease_id": row["current_lease_id"],
+                    "updated_at": row["updated_at"],
+                })
+                _refresh_model_availability(cur, row["model_name"])
+                version = _bump_version(cur)
+            conn.commit()
+            return row, version
+        except sqlite3.OperationalError as e:
+            # "database is locked" efter BUSY_TIMEOUT: prøv igen med lidt backoff
+            if "locked" not in str(e) or attempt == ALLOCATE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (2 ** attempt))
+        finally:
+            conn.close()
+
+
 def update_vehicle_status(vehicle_id: int, status: str, lease_id: int | None):
+    """
+    Opdaterer status/lease på en bil.
+    Returnerer (opdateret række, fleet-version); rækken er None hvis bilen ikke findes.
+    """
     conn = get_connection()
     cur = conn.cursor()
     now = datetime.utcnow().isoformat()
@@ -216,8 +651,20 @@ def update_vehicle_status(vehicle_id: int, status: str, lease_id: int | None):
         UPDATE vehicles
         SET status = ?, current_lease_id = ?, updated_at = ?
         WHERE id = ?
+        RETURNING *
         """,
         (status, lease_id, now, vehicle_id),
     )
+    row = cur.fetchone()
+    version = None
+    if row is not None:
+        record_change(cur, "vehicle", row["id"], "UPDATE", {
+            "status": row["status"],
+            "current_lease_id": row["current_lease_id"],
+            "updated_at": row["updated_at"],
+        })
+        _refresh_model_availability(cur, row["model_name"])
+        version = _bump_version(cur)
     conn.commit()
     conn.close()
+    return row, version
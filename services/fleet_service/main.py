@@ -1,11 +1,20 @@
 from flask import Flask, jsonify, request
+from serialization import json_response, ndjson_response, wants_columns, wants_ndjson
+from changelog import changes_endpoint, version_endpoint
 from database import (
     init_db,
-    list_vehicles,
+    list_vehicles_json,
+    stream_vehicles_ndjson,
+    list_vehicles_columns_json,
+    vehicle_stats,
     get_vehicle_by_id,
-    find_available_by_model,
-    update_vehicle_status,
+    get_connection,
+    sync_from_csv,
+    CSV_PATH,
+    SYNC_CHUNK_SIZE,
+    list_model_catalog,
 )
+import availability
 
 app = Flask(__name__)
 
@@ -19,10 +28,35 @@ def row_to_dict(row):
     return {k: row[k] for k in row.keys()}
 
 
+# Cache af model_catalog; gyldig så længe fleet_meta.version er uændret
+_catalog_cache = {"version": None, "by_model": {}}
+
+
+def get_model_catalog():
+    """
+    Returnerer {model_name: katalog-entry}, genindlæst kun når flåden er
+    ændret. Versionen kommer fra in-memory indekset (ingen DB-tur pr. opslag).
+    """
+    global _catalog_cache
+    version = availability.current_version()
+    if _catalog_cache["version"] != version:
+        by_model = {entry["model_name"]: entry for entry in list_model_catalog()}
+        _catalog_cache = {"version": version, "by_model": by_model}
+    return _catalog_cache["by_model"]
+
+
+_db_ready = False
+
+
 @app.before_request
 def setup_db():
-    # Sørger for at fleet.db og vehicles-tabellen er oprettet og seedet fra CSV
-    init_db()
+    # Sørger for at fleet.db og vehicles-tabellen er oprettet og seedet fra CSV.
+    # Kun første request i processen: init_db skriver (fleet_meta, seed) og
+    # må ikke tage skrivelåsen på hver GET
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
 
 
 @app.route("/health", methods=["GET"])
@@ -35,14 +69,47 @@ def get_vehicles():
     """
     GET /vehicles
     GET /vehicles?status=AVAILABLE
+    Accept: application/x-ndjson -> streames som én JSON-linje pr. bil
+    ?format=columns -> ét JSON-array pr. kolonne
     """
     status = request.args.get("status")
     if status is not None and status not in VALID_STATUSES:
         return jsonify({"error": "Invalid status filter"}), 400
 
-    rows = list_vehicles(status=status)
-    data = [row_to_dict(r) for r in rows]
-    return jsonify(data), 200
+    if wants_ndjson():
+        return ndjson_response(stream_vehicles_ndjson(status=status))
+    if wants_columns():
+        return json_response(list_vehicles_columns_json(status=status))
+    return json_response(list_vehicles_json(status=status))
+
+
+@app.get("/vehicles/stats")
+def get_vehicle_stats():
+    """
+    GET /vehicles/stats
+    Aggregater til reporting_service (beregnet i SQL).
+    """
+    return jsonify(vehicle_stats()), 200
+
+
+@app.get("/changes")
+def get_changes():
+    """
+    GET /changes?since=<seq>&limit=100&wait=0
+    Change feed over vehicles. wait > 0 long-poller op til så mange sekunder.
+    """
+    body, status = changes_endpoint(get_connection, request.args)
+    return jsonify(body), status
+
+
+@app.get("/version")
+def get_version():
+    """
+    GET /version
+    Tabel-version (højeste change-seq); stiger ved hver skrivning til vehicles.
+    """
+    body, status = version_endpoint(get_connection)
+    return jsonify(body), status
 
 
 @app.route("/vehicles/<int:vehicle_id>", methods=["GET"])
@@ -64,7 +131,7 @@ def allocate_vehicle():
     Body: { "model_name": "...", "lease_id": 123 }
 
     Bruges af lease_service til at finde første AVAILABLE bil
-    af en given model og markere den som LEASED.
+    af en given model og markere den som LEASED (atomisk).
     """
     data = request.get_json(silent=True) or {}
     model_name = data.get("model_name")
@@ -73,15 +140,12 @@ def allocate_vehicle():
     if not model_name or lease_id is None:
         return jsonify({"error": "model_name and lease_id are required"}), 400
 
-    row = find_available_by_model(model_name)
-    if row is None:
+    # Find + marker som LEASED i én atomisk operation (sikker ved samtidige kald)
+    # Kandidat findes i in-memory indekset (se availability.py)
+    updated = availability.allocate(model_name, lease_id)
+    if updated is None:
         return jsonify({"error": "No AVAILABLE vehicle for this model"}), 404
 
-    vehicle_id = row["id"]
-    update_vehicle_status(vehicle_id=vehicle_id, status="LEASED", lease_id=lease_id)
-
-    # Hent den opdaterede række
-    updated = get_vehicle_by_id(vehicle_id)
     return jsonify(row_to_dict(updated)), 200
 
 
@@ -105,39 +169,109 @@ def set_vehicle_status(vehicle_id: int):
     if row is None:
         return jsonify({"error": "Vehicle not found"}), 404
 
-    update_vehicle_status(vehicle_id=vehicle_id, status=status, lease_id=lease_id)
-
-    updated = get_vehicle_by_id(vehicle_id)
+    # Opdaterer både DB og in-memory indekset
+    updated = availability.set_status(vehicle_id=vehicle_id, status=status, lease_id=lease_id)
     return jsonify(row_to_dict(updated)), 200
 
 
+@app.route("/vehicles/sync", methods=["POST"])
+def sync_vehicles():
+    """
+    POST /vehicles/sync
+    Body (optional): { "chunk_size": 500 }
+
+    Admin-endpoint: indlæser flåde-CSV'en inkrementelt og returnerer
+    antal nye/opdaterede/uændrede biler.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        chunk_size = int(data.get("chunk_size", SYNC_CHUNK_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({"error": "chunk_size must be an integer"}), 400
+    if chunk_size <= 0:
+        return jsonify({"error": "chunk_size must be positive"}), 400
+
+    if not CSV_PATH.exists():
+        return jsonify({"error": f"CSV not found: {CSV_PATH.name}"}), 404
+
+    conn = get_connection()
+    try:
+        counts = sync_from_csv(conn, chunk_size=chunk_size)
+    finally:
+        conn.close()
+
+    return jsonify(counts), 200
+
+
 @app.get("/vehicles/pricing/by-model")
 def get_pricing_by_model():
     """
     Returnerer månedlig pris for en given bilmodel baseret på flådedata.
-    Vi finder første AVAILABLE bil med den model og bruger dens monthly_price.
+    Prisen er monthly_price på første AVAILABLE bil (in-memory indekset), da
+    det er den bil der allokeres; mangler bilen en pris, bruges modelkatalogets
+    medianpris. Er ingen bil ledig, svares 404 som hidtil, så der ikke
+    oprettes en aftale som allokeringen bagefter ikke kan opfylde.
     """
     model_name = request.args.get("model_name")
     if not model_name:
         return jsonify({"error": "model_name query parameter is required"}), 400
 
-    row = find_available_by_model(model_name)
-    if row is None:
+    entry = get_model_catalog().get(model_name)
+    if entry is None:
+        return jsonify({"error": f"Ukendt bilmodel '{model_name}' i flåden"}), 404
+
+    candidate = availability.first_available(model_name)
+    if candidate is None:
         return jsonify({"error": f"Ingen AVAILABLE biler fundet for modellen '{model_name}'"}), 404
 
-    v = dict(row)
+    vehicle_id, monthly_price = candidate
+    price_source = "vehicle"
+    if monthly_price is None:
+        monthly_price = entry["median_price"]
+        price_source = "catalog"
+
     return jsonify({
-        "model_name": v.get("model_name"),
-        "monthly_price": v.get("monthly_price"),
-        "example_vehicle_id": v.get("id"),
-        "status": v.get("status"),
+        "model_name": model_name,
+        "monthly_price": monthly_price,
+        "price_source": price_source,
+        "example_vehicle_id": vehicle_id,
+        "status": "AVAILABLE",
+        "min_price": entry["min_price"],
+        "median_price": entry["median_price"],
+        "max_price": entry["max_price"],
+        "available_count": entry["available_count"],
     }), 200
 
 
+@app.get("/vehicles/models")
+def get_models():
+    """
+    GET /vehicles/models
+    GET /vehicles/models?available_only=true
+
+    Modelkatalog: antal biler/ledige, min/median/max monthly_price,
+    brændstoftyper og udleveringssteder pr. model.
+    """
+    catalog = list(get_model_catalog().values())
+    if request.args.get("available_only", "").lower() in ("1", "true", "yes"):
+        catalog = [entry for entry in catalog if entry["available_count"] > 0]
+    return jsonify(catalog), 200
+
+
+@app.get("/vehicles/availability")
+def get_availability():
+    """
+    Tællere fra in-memory indekset: status, ledige pr. model og pr. udleveringssted.
+    """
+    return jsonify(availability.summary()), 200
+
+
 
 
 
 
 if __name__ == "__main__":
     # Lokalt debug-run. I Docker køres den typisk via gunicorn eller flask run.
+    init_db()
+    availability.reload()  # varm in-memory indekset op inden første kald
     app.run(host="0.0.0.0", port=5006, debug=True)
@@ -0,0 +1,94 @@
+"""
+Stresstest af atomisk bilallokering (availability.allocate, eller
+allocate_available_vehicle direkte med --direct).
+
+Opretter en midlertidig fleet-DB med syntetiske biler, lader mange tråde
+allokere samtidig og tjekker at ingen bil er tildelt to lejeaftaler.
+Skriver allokeringer pr. sekund.
+
+    python stress_allocate.py --vehicles 2000 --models 5 --workers 32
+"""
+import argparse
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import availability
+import database
+
+
+def seed_synthetic(n_vehicles: int, n_models: int):
+    conn = database.get_connection()
+    now = datetime.utcnow().isoformat()
+    conn.execute("DELETE FROM vehicles")
+    conn.executemany(
+        """
+        INSERT INTO vehicles (model_name, monthly_price, status, updated_at)
+        VALUES (?, ?, 'AVAILABLE', ?)
+        """,
+        [(f"Model {i % n_models}", 4000.0 + i % n_models * 500, now) for i in range(n_vehicles)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stresstest af samtidig bilallokering")
+    parser.add_argument("--vehicles", type=int, default=2000)
+    parser.add_argument("--models", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--extra", type=int, default=200, help="Ekstra kald ud over antal biler")
+    parser.add_argument("--direct", action="store_true", help="Gå uden om in-memory indekset")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp) / "fleet_stress.db"
+        database.CSV_PATH = Path(tmp) / "ingen.csv"  # ingen CSV-seed
+        database.init_db()
+        seed_synthetic(args.vehicles, args.models)
+        availability.reload()
+
+        n_requests = args.vehicles + args.extra
+        jobs = [(f"Model {i % args.models}", i + 1) for i in range(n_requests)]
+
+        def allocate(job):
+            model_name, lease_id = job
+            if args.direct:
+                row, _ = database.allocate_available_vehicle(model_name, lease_id)
+            else:
+                row = availability.allocate(model_name, lease_id)
+            return (lease_id, row["id"] if row else None)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(allocate, jobs))
+        elapsed = time.perf_counter() - start
+
+        allocated = [(lease_id, vid) for lease_id, vid in results if vid is not None]
+        per_vehicle = Counter(vid for _, vid in allocated)
+        doubles = {vid: c for vid, c in per_vehicle.items() if c > 1}
+
+        # Tjek DB'en: hver bil har præcis den lease, der fik den tildelt
+        conn = database.get_connection()
+        db_lease = dict(
+            conn.execute("SELECT id, current_lease_id FROM vehicles WHERE status = 'LEASED'").fetchall()
+        )
+        left = conn.execute("SELECT COUNT(*) FROM vehicles WHERE status = 'AVAILABLE'").fetchone()[0]
+        conn.close()
+        mismatches = [vid for lease_id, vid in allocated if db_lease.get(vid) != lease_id]
+
+        print(f"Kald: {n_requests}, allokeret: {len(allocated)}, ikke-ledig: {n_requests - len(allocated)}")
+        print(f"Tilbage AVAILABLE: {left}")
+        print(f"Dobbelt-allokeringer: {len(doubles)}, DB-uoverensstemmelser: {len(mismatches)}")
+        print(f"Tid: {elapsed:.2f}s  ->  {len(allocated) / elapsed:.0f} allokeringer/s ({args.workers} tråde)")
+
+        ok = not doubles and not mismatches and len(allocated) == args.vehicles and left == 0
+        print("OK" if ok else "FEJL")
+        return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
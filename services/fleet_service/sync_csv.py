@@ -0,0 +1,41 @@
+"""
+CLI til inkrementel re-sync af flåden fra "Bilabonnement 2025(Sheet1).csv".
+
+Eksempler:
+    python sync_csv.py
+    python sync_csv.py --csv /data/ny_flaade.csv --chunk-size 1000
+
+Kun nye/ændrede rækker skrives; status og current_lease_id bevares.
+"""
+import argparse
+from pathlib import Path
+
+from database import init_db, get_connection, sync_from_csv, CSV_PATH, SYNC_CHUNK_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synkroniser fleet.db med flåde-CSV'en")
+    parser.add_argument("--csv", type=Path, default=CSV_PATH, help="Sti til CSV-filen")
+    parser.add_argument("--chunk-size", type=int, default=SYNC_CHUNK_SIZE, help="Rækker pr. batch")
+    args = parser.parse_args()
+
+    if not args.csv.exists():
+        print(f"CSV-filen findes ikke: {args.csv}")
+        return 1
+
+    init_db()
+    conn = get_connection()
+    try:
+        counts = sync_from_csv(conn, csv_path=args.csv, chunk_size=args.chunk_size)
+    finally:
+        conn.close()
+
+    print(
+        f"Sync færdig: {counts['inserted']} nye, "
+        f"{counts['updated']} opdateret, {counts['unchanged']} uændret"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,79 @@
+"""
+Benchmark: sqlite3.Row -> dict -> jsonify  vs.  SQLite json_group_array.
+
+Opretter en midlertidig lease-DB med N rækker og måler begge veje.
+
+    python bench_serialization.py --rows 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from flask import Flask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af JSON-serialisering af leases")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # database læser LEASE_DB_PATH ved import
+        os.environ["LEASE_DB_PATH"] = os.path.join(tmp, "lease_bench.db")
+        import database
+        from serialization import query_json_array
+
+        database.init_db()
+        conn = database.get_connection()
+        now = datetime.utcnow().isoformat()
+        conn.executemany(
+            """
+            INSERT INTO leases (
+                customer_name, customer_cpr, customer_email, customer_phone,
+                car_model, start_date, end_date, monthly_price, status,
+                vehicle_id, rki_status, created_at, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    f"Kunde {i}", f"{i:010d}", f"kunde{i}@example.dk", "12345678",
+                    f"Model {i % 20}", "2025-01-01", "2026-01-01", 4000.0 + i % 7 * 500,
+                    "ACTIVE" if i % 3 else "COMPLETED", i % 500, "APPROVED", now, now,
+                )
+                for i in range(args.rows)
+            ),
+        )
+        conn.commit()
+
+        app = Flask(__name__)
+        sql, params = "SELECT * FROM leases ORDER BY id DESC", ()
+
+        def old_path():
+            rows = conn.execute(sql, params).fetchall()
+            with app.app_context():
+                return app.json.dumps([dict(r) for r in rows])
+
+        def new_path():
+            return query_json_array(conn, sql, params)
+
+        assert json.loads(old_path()) == json.loads(new_path())
+
+        for name, fn in (("dict + jsonify", old_path), ("json_group_array", new_path)):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                payload = fn()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<18} {args.rows} rækker: {best * 1000:8.1f} ms  ({len(payload) / 1e6:.1f} MB)")
+
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import sqlite3
 import os
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, date, timedelta
+
+from serialization import query_json_array, query_json_columns, iter_ndjson
+from changelog import init_changelog, record_change, record_changes
 
 # Standard: filen hedder lease.db i containerens /app
 DB_PATH = os.getenv("LEASE_DB_PATH", "lease.db")
+
+# Statusser hvor aftalen er stoppet (ended_at sættes ved skiftet)
+ENDED_STATUSES = ("COMPLETED", "CANCELLED", "DAMAGED")
 print(f"LEASE_DB_PATH={DB_PATH}")
 
 def get_connection():
@@ -51,11 +57,36 @@ def init_db():
             rki_checked_at TEXT,
             created_by_user_id INTEGER,
             created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL            -- NY: til status/ændringer
+            updated_at TEXT NOT NULL,           -- NY: til status/ændringer
+            damage_count INTEGER DEFAULT 0,     -- antal skader (NULL = ikke synkroniseret endnu)
+            ended_at TEXT                       -- sættes kun ved statusskift til ENDED_STATUSES
         )
         """
     )
 
+    # Migrering af ældre lease.db uden damage_count: eksisterende aftaler
+    # markeres ukendte (NULL) og udfyldes af afstemningsjobbet
+    # (reconcile_damage_counts), som main.py starter ved opstart
+    existing_cols = {r["name"] for r in cur.execute("PRAGMA table_info(leases)")}
+    if "damage_count" not in existing_cols:
+        cur.execute("ALTER TABLE leases ADD COLUMN damage_count INTEGER DEFAULT 0")
+        cur.execute("UPDATE leases SET damage_count = NULL")
+    # ended_at kendes ikke for aftaler afsluttet før kolonnen fandtes
+    # (updated_at kan være rørt siden); reporting bruger da end_date
+    if "ended_at" not in existing_cols:
+        cur.execute("ALTER TABLE leases ADD COLUMN ended_at TEXT")
+
+    # Watermark for inkrementel CSV-eksport (updated_at > sidste kørsel)
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_leases_updated_at
+        ON leases(updated_at)
+        """
+    )
+
+    # Change feed (GET /changes)
+    init_changelog(cur)
+
     conn.commit()
     conn.close()
 
@@ -118,26 +149,122 @@ def create_lease(data: dict) -> int:
     )
 
     lease_id = cur.lastrowid
+    cur.execute("SELECT * FROM leases WHERE id = ?", (lease_id,))
+    record_change(cur, "lease", lease_id, "INSERT", dict(cur.fetchone()))
     conn.commit()
     conn.close()
     return lease_id
 
 
+def _list_leases_query(status: str | None = None):
+    if status:
+        return "SELECT * FROM leases WHERE status = ? ORDER BY id DESC", (status,)
+    return "SELECT * FROM leases ORDER BY id DESC", ()
+
+
 def list_leases(status: str | None = None):
     conn = get_connection()
     cur = conn.cursor()
-    if status:
-        cur.execute(
-            "SELECT * FROM leases WHERE status = ? ORDER BY id DESC",
-            (status,),
-        )
-    else:
-        cur.execute("SELECT * FROM leases ORDER BY id DESC")
+    cur.execute(*_list_leases_query(status))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
+def list_leases_json(status: str | None = None) -> str:
+    """Som list_leases, men returnerer færdig JSON bygget i SQLite."""
+    conn = get_connection()
+    payload = query_json_array(conn, *_list_leases_query(status))
+    conn.close()
+    return payload
+
+
+def list_leases_columns_json(status: str | None = None) -> str:
+    """Som list_leases_json, men kolonneorienteret (?format=columns)."""
+    conn = get_connection()
+    payload = query_json_columns(conn, *_list_leases_query(status))
+    conn.close()
+    return payload
+
+
+def stream_leases_ndjson(status: str | None = None):
+    """Generator med leases som NDJSON (én række pr. linje), hentet med fetchmany."""
+    return iter_ndjson(get_connection, *_list_leases_query(status))
+
+
+def lease_stats(expiring_days: int = 30, top_n: int = 3, today: date | None = None) -> dict:
+    """
+    Aggregater til reporting (GET /leases/stats), beregnet i SQL så svaret
+    er O(grupper) i stedet for O(rækker):
+    antal pr. status, omsætning pr. startmåned, top-modeller, aftaler der
+    udløber inden for expiring_days samt antal afsluttede aftaler med
+    skader (ud fra damage_count, som damage_service tæller op og
+    afstemningsjobbet retter; damage_counts_pending = aftaler der endnu
+    ikke er afstemt efter migrering).
+    """
+    today = today or date.today()
+    limit = today + timedelta(days=expiring_days)
+    conn = get_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT status, COUNT(*) FROM leases GROUP BY status")
+    counts_by_status = {r[0]: r[1] for r in cur.fetchall()}
+
+    cur.execute(
+        """
+        SELECT substr(start_date, 1, 7) AS month, SUM(COALESCE(monthly_price, 0))
+        FROM leases
+        WHERE start_date IS NOT NULL AND start_date != ''
+        GROUP BY month
+        ORDER BY month
+        """
+    )
+    revenue_by_month = [{"month": r[0], "total_revenue": r[1]} for r in cur.fetchall()]
+
+    # Ved lige antal vinder den model der optræder først i listen (nyeste id),
+    # som Counter.most_common over GET /leases
+    cur.execute(
+        """
+        SELECT car_model, COUNT(*) AS cnt
+        FROM leases
+        WHERE car_model IS NOT NULL AND car_model != ''
+        GROUP BY car_model
+        ORDER BY cnt DESC, MAX(id) DESC
+        LIMIT ?
+        """,
+        (top_n,),
+    )
+    top_models = [{"car_model": r[0], "count": r[1]} for r in cur.fetchall()]
+
+    cur.execute(
+        """
+        SELECT *, CAST(julianday(date(end_date)) - julianday(?) AS INTEGER) AS days_to_end
+        FROM leases
+        WHERE date(end_date) BETWEEN ? AND ?
+        ORDER BY end_date, id DESC          -- samme rækkefølge ved lige end_date som GET /leases
+        """,
+        (today.isoformat(), today.isoformat(), limit.isoformat()),
+    )
+    expiring = [dict(r) for r in cur.fetchall()]
+
+    cur.execute("SELECT COUNT(*) FROM leases WHERE status = 'COMPLETED' AND damage_count > 0")
+    completed_with_damage = cur.fetchone()[0]
+
+    cur.execute("SELECT COUNT(*) FROM leases WHERE damage_count IS NULL")
+    damage_counts_pending = cur.fetchone()[0]
+
+    conn.close()
+    return {
+        "total": sum(counts_by_status.values()),
+        "counts_by_status": counts_by_status,
+        "revenue_by_month": revenue_by_month,
+        "top_models": top_models,
+        "expiring": {"days": expiring_days, "count": len(expiring), "leases": expiring},
+        "completed_with_damage": completed_with_damage,
+        "damage_counts_pending": damage_counts_pending,
+    }
+
+
 def get_lease_by_id(lease_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -148,13 +275,32 @@ def get_lease_by_id(lease_id: int):
 
 
 def update_lease_status(lease_id: int, new_status: str):
+    """
+    Skifter status. ended_at sættes første gang aftalen går til en af
+    ENDED_STATUSES og nulstilles hvis den genåbnes; andre skrivninger
+    (RKI, bil, damage_count) rører den ikke.
+    """
     conn = get_connection()
     cur = conn.cursor()
     now = datetime.utcnow().isoformat()
+    ended = new_status in ENDED_STATUSES
     cur.execute(
-        "UPDATE leases SET status = ?, updated_at = ? WHERE id = ?",
-        (new_status, now, lease_id),
+        """
+        UPDATE leases
+        SET status = ?, updated_at = ?,
+            ended_at = CASE WHEN ? THEN COALESCE(ended_at, ?) ELSE NULL END
+        WHERE id = ?
+        RETURNING ended_at
+        """,
+        (new_status, now, ended, now, lease_id),
     )
+    row = cur.fetchone()
+    if row is not None:
+        record_change(cur, "lease", lease_id, "UPDATE", {
+            "status": new_status,
+            "updated_at": now,
+            "ended_at": row[0],
+        })
     conn.commit()
     conn.close()
 
@@ -176,6 +322,13 @@ def update_rki_result(lease_id: int, rki_status: str, rki_score: float | None):
         """,
         (rki_status, rki_score, checked_at, checked_at, lease_id),
     )
+    if cur.rowcount:
+        record_change(cur, "lease", lease_id, "UPDATE", {
+            "rki_status": rki_status,
+            "rki_score": rki_score,
+            "rki_checked_at": checked_at,
+            "updated_at": checked_at,
+        })
 
     conn.commit()
     conn.close()
@@ -197,5 +350,58 @@ def update_lease_vehicle(lease_id: int, vehicle_id: int):
         """,
         (vehicle_id, now, lease_id),
     )
+    if cur.rowcount:
+        record_change(cur, "lease", lease_id, "UPDATE", {"vehicle_id": vehicle_id, "updated_at": now})
+    conn.commit()
+    conn.close()
+
+
+def add_damage(lease_id: int) -> bool:
+    """
+    Kaldes af damage_service når der registreres en skade på aftalen.
+    damage_count er afledt, så updated_at røres ikke.
+    Returnerer False hvis aftalen ikke findes.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        UPDATE leases
+        SET damage_count = COALESCE(damage_count, 0) + 1
+        WHERE id = ?
+        RETURNING damage_count
+        """,
+        (lease_id,),
+    )
+    row = cur.fetchone()
+    if row is not None:
+        record_change(cur, "lease", lease_id, "UPDATE", {"damage_count": row[0]})
+    conn.commit()
+    conn.close()
+    return row is not None
+
+
+def reconcile_damage_counts(counts: dict) -> int:
+    """
+    Afstemmer damage_count med damage_service ({lease_id: antal skader},
+    aftaler uden skader mangler): udfylder NULL efter migrering og retter
+    tællinger hvor et POST /leases/<id>/damages er gået tabt. Kun aftaler
+    hvor tallet afviger skrives, og updated_at røres ikke (afledt kolonne).
+    Returnerer antal rettede aftaler.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id, damage_count FROM leases")
+    updates = [
+        (counts.get(r[0], 0), r[0])
+        for r in cur.fetchall()
+        if r[1] != counts.get(r[0], 0)
+    ]
+    cur.executemany("UPDATE leases SET damage_count = ? WHERE id = ?", updates)
+    record_changes(cur, [
+        ("lease", lease_id, "UPDATE", {"damage_count": count})
+        for count, lease_id in updates
+    ])
     conn.commit()
     conn.close()
+    return len(updates)
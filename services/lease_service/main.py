@@ -1,14 +1,24 @@
 import os
+import threading
+import time
 import requests
 from datetime import datetime
 from flask import Flask, request, jsonify
+from serialization import json_response, ndjson_response, wants_columns, wants_ndjson
+from changelog import changes_endpoint, version_endpoint
 from database import (
     init_db,
     create_lease,
-    list_leases,
+    list_leases_json,
+    stream_leases_ndjson,
+    list_leases_columns_json,
+    lease_stats,
     get_lease_by_id,
     update_lease_status,
     update_lease_vehicle,
+    add_damage,
+    reconcile_damage_counts,
+    get_connection,
 )
 
 # RKI-service kører som egen container på docker-netværket
@@ -16,6 +26,8 @@ RKI_BASE_URL = os.getenv("RKI_BASE_URL", "http://rki_service:5005")
 # Fleet-service kører som egen container på docker-netværket
 FLEET_BASE_URL = os.getenv("FLEET_BASE_URL", "http://fleet_service:5006")
 DAMAGE_BASE_URL = os.getenv("DAMAGE_BASE_URL", "http://damage_service:5003")
+# Sekunder mellem afstemninger af damage_count mod DamageService
+DAMAGE_COUNT_RECONCILE_INTERVAL = float(os.getenv("DAMAGE_COUNT_RECONCILE_INTERVAL", "900"))
 
 
 app = Flask(__name__)
@@ -79,6 +91,51 @@ def has_open_damages(lease_id: int) -> tuple[bool, str | None]:
     return False, None
 
 
+def sync_damage_counts() -> str | None:
+    """
+    Afstemmer damage_count med antal skader pr. aftale i DamageService
+    (GET /damages/counts-by-lease, aggregeret i SQL dér).
+    Returnerer fejlbesked eller None.
+    """
+    try:
+        resp = requests.get(f"{DAMAGE_BASE_URL}/damages/counts-by-lease", timeout=30)
+        resp.raise_for_status()
+        counts = {int(k): v for k, v in resp.json()["counts"].items()}
+    except Exception as e:
+        return f"Kunne ikke hente skadestal fra DamageService: {e}"
+    fixed = reconcile_damage_counts(counts)
+    if fixed:
+        print(f"[lease_service] damage_count afstemt for {fixed} aftale(r)")
+    return None
+
+
+def _reconcile_loop():
+    """
+    Baggrundsjob: afstemmer damage_count ved opstart (udfylder efter
+    migrering) og derefter hvert DAMAGE_COUNT_RECONCILE_INTERVAL sekund, så
+    et tabt POST /leases/<id>/damages (eller en skade registreret mellem
+    hentning og skrivning) højst er forkert indtil næste kørsel.
+    """
+    while True:
+        err = sync_damage_counts()
+        if err:
+            print(f"[lease_service] {err}")
+        time.sleep(DAMAGE_COUNT_RECONCILE_INTERVAL)
+
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+def _ensure_reconciler():
+    """Starter afstemningsjobbet én gang pr. proces."""
+    global _reconciler
+    with _reconciler_lock:
+        if _reconciler is None:
+            _reconciler = threading.Thread(target=_reconcile_loop, name="damage-count-reconcile", daemon=True)
+            _reconciler.start()
+
+
 
 def call_fleet_allocate(car_model: str, lease_id: int):
     """
@@ -135,6 +192,7 @@ def call_fleet_update_status(vehicle_id: int, status: str, lease_id: int | None
 def setup():
     # Sørger for at DB og tabel findes (billig operation i SQLite)
     init_db()
+    _ensure_reconciler()
 
 
 @app.get("/health")
@@ -145,9 +203,57 @@ def health():
 @app.get("/leases")
 def get_leases():
     status = request.args.get("status")
-    rows = list_leases(status=status)
-    leases = [dict(row) for row in rows]
-    return jsonify(leases)
+    if wants_ndjson():
+        return ndjson_response(stream_leases_ndjson(status=status))
+    if wants_columns():
+        return json_response(list_leases_columns_json(status=status))
+    return json_response(list_leases_json(status=status))
+
+
+@app.get("/leases/stats")
+def get_lease_stats():
+    """
+    GET /leases/stats?expiring_days=30&top=3
+    Aggregater til reporting_service (beregnet i SQL).
+    """
+    try:
+        expiring_days = int(request.args.get("expiring_days", 30))
+        top_n = int(request.args.get("top", 3))
+    except ValueError:
+        return jsonify({"error": "expiring_days and top must be integers"}), 400
+    return jsonify(lease_stats(expiring_days=expiring_days, top_n=top_n))
+
+
+@app.post("/leases/<int:lease_id>/damages")
+def register_lease_damage(lease_id: int):
+    """
+    POST /leases/<id>/damages
+    Kaldes af DamageService når en skade registreres på aftalen; tæller
+    damage_count op (bruges til "afsluttede aftaler med skader" i /leases/stats).
+    """
+    if not add_damage(lease_id):
+        return jsonify({"error": "lease not found"}), 404
+    return jsonify({"lease_id": lease_id, "ok": True}), 200
+
+
+@app.get("/changes")
+def get_changes():
+    """
+    GET /changes?since=<seq>&limit=100&wait=0
+    Change feed over leases. wait > 0 long-poller op til så mange sekunder.
+    """
+    body, status = changes_endpoint(get_connection, request.args)
+    return jsonify(body), status
+
+
+@app.get("/version")
+def get_version():
+    """
+    GET /version
+    Tabel-version (højeste change-seq); stiger ved hver skrivning til leases.
+    """
+    body, status = version_endpoint(get_connection)
+    return jsonify(body), status
 
 
 @app.get("/leases/<int:lease_id>")
@@ -207,7 +313,7 @@ def create_lease_endpoint():
 def fetch_monthly_price_from_fleet(model_name: str) -> tuple[float | None, str | None]:
     """
     Henter månedlig pris for en given bilmodel fra FleetService.
-    Strategi: finder første AVAILABLE bil med den model og bruger dens monthly_price.
+    Strategi: første AVAILABLE bil med den model (fejl hvis ingen er ledig).
     Returnerer (price, error_message).
     """
     try:
@@ -443,4 +549,6 @@ def end_lease(lease_id):
 
 
 if __name__ == "__main__":
+    init_db()
+    _ensure_reconciler()
     app.run(host="0.0.0.0", port=5002, debug=True)
@@ -0,0 +1,120 @@
+"""
+Benchmark: compute_*-funktionerne (lister af dicts) vs. columnar.py (NumPy).
+
+Genererer syntetiske leases/skader/reservationer/biler i samme form som
+servicernes list-endpoints og serialiserer dem som række-JSON (GET /leases)
+og kolonne-JSON (GET /leases?format=columns). Måler json.loads + beregning
+for begge veje og tjekker at KPI'erne er de samme.
+
+    python bench_columnar.py --rows 10000 100000 1000000
+"""
+import argparse
+import json
+import math
+import random
+import time
+from datetime import date, timedelta
+
+import columnar
+from main import compute_kpis
+
+STATUSES = ["ACTIVE", "ACTIVE", "ACTIVE", "COMPLETED", "CANCELLED", "DAMAGED"]
+MODELS = [f"Model {i}" for i in range(40)]
+VEHICLE_STATUSES = ["AVAILABLE", "LEASED", "LEASED", "DAMAGED", "REPAIR", None]
+
+
+def generate(rows: int, seed: int = 42):
+    rnd = random.Random(seed)
+    today = date.today()
+
+    def day(offset):
+        return (today + timedelta(days=offset)).isoformat()
+
+    leases = []
+    for i in range(1, rows + 1):
+        start = rnd.randint(-1500, 30)
+        leases.append({
+            "id": i,
+            "customer_email": f"kunde{rnd.randint(1, rows // 2 + 1)}@example.dk",
+            "car_model": rnd.choice(MODELS),
+            "start_date": day(start),
+            "end_date": day(start + rnd.choice([365, 730, 1095])),
+            "monthly_price": rnd.choice([2999.0, 3499.0, 3999.0, 4999.0, 6499.0]),
+            "status": rnd.choice(STATUSES),
+            "vehicle_id": rnd.randint(1, max(rows // 10, 1)),
+        })
+    damages = [
+        {
+            "id": i,
+            "lease_id": rnd.randint(1, rows),
+            "category": rnd.choice(["Ridse", "Bule", "Glas", "Fælg"]),
+            "estimated_cost": round(rnd.uniform(200, 25000), 2),
+            "detected_at": day(-rnd.randint(0, 1500)) + "T12:00:00",
+            "status": rnd.choice(["OPEN", "CLOSED", "CLOSED"]),
+        }
+        for i in range(1, rows // 4 + 1)
+    ]
+    reservations = [
+        {"id": i, "lease_id": rnd.randint(1, rows), "pickup_date": day(rnd.randint(-1500, 60)), "status": "PENDING"}
+        for i in range(1, rows // 2 + 1)
+    ]
+    vehicles = [
+        {"id": i, "model_name": rnd.choice(MODELS), "status": rnd.choice(VEHICLE_STATUSES)}
+        for i in range(1, max(rows // 10, 1) + 1)
+    ]
+    return leases, damages, vehicles, reservations
+
+
+def same_kpis(a: dict, b: dict) -> bool:
+    for key in b:
+        x, y = a[key], b[key]
+        if isinstance(y, float):
+            if not math.isclose(x, y, rel_tol=1e-9):
+                return False
+        elif key == "monthly_revenue":
+            if [m["month"] for m in x] != [m["month"] for m in y] or not all(
+                math.isclose(p["total_revenue"], q["total_revenue"], rel_tol=1e-9) for p, q in zip(x, y)
+            ):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+def best_of(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af KPI-beregning: lister af dicts vs. NumPy")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        data = generate(rows)
+        row_payloads = [json.dumps(source) for source in data]
+        column_payloads = [json.dumps(columnar.columns_from_rows(source)) for source in data]
+        del data
+
+        t_dicts, kpi_dicts = best_of(
+            lambda: compute_kpis(*(json.loads(p) for p in row_payloads)), args.repeat
+        )
+        t_numpy, kpi_numpy = best_of(
+            lambda: columnar.build_kpi_columnar(*(json.loads(p) for p in column_payloads)), args.repeat
+        )
+        assert same_kpis(kpi_numpy, kpi_dicts), f"KPI'er afviger ved {rows} rækker"
+        print(
+            f"{rows:>9} leases: rækker + compute_* {t_dicts * 1000:9.1f} ms   "
+            f"kolonner + columnar {t_numpy * 1000:9.1f} ms   ({t_dicts / t_numpy:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
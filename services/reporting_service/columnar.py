@@ -0,0 +1,304 @@
+"""
+Kolonnebaseret (NumPy) udgave af KPI-beregningerne i main.py.
+
+Kilderne hentes kolonneorienteret (GET /<kilde>?format=columns giver
+{"kolonne": [værdier]}), så der aldrig bygges en dict pr. række. Hver kolonne
+lægges én gang ind i typede arrays: datoer som int64 dagnumre,
+statusser, modeller og måneder som kategorikoder (dictionary encoding),
+beløb som float64 med en gyldigheds-maske. Datoer og måneder parses kun én
+gang pr. unik værdi. Derefter beregnes alle KPI'er med vektoriserede
+operationer (bincount, masker, argsort) i stedet for en Python-løkke med
+try/except, float() og fromisoformat pr. række og pr. KPI.
+
+Resultaterne er de samme som compute_*-funktionerne giver, inkl. rækkefølge
+ved lige antal (top-modeller) og stabil sortering af listerne. Summer af
+skadesbeløb kan afvige i sidste decimal, da NumPy summerer parvist.
+"""
+from datetime import date, datetime
+
+import numpy as np
+
+NAT = np.iinfo(np.int64).min  # "ingen dato"
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# --------- INDLÆSNING TIL KOLONNER ---------
+
+
+def columns_from_rows(rows):
+    """Lister af dicts -> kolonneformat (til kilder der kun har række-JSON)."""
+    keys = list(dict.fromkeys(k for r in rows for k in r))
+    return {k: [r.get(k) for r in rows] for k in keys}
+
+
+def _length(cols):
+    return len(next(iter(cols.values()), []))
+
+
+def _column(cols, key, default=None):
+    values = cols.get(key)
+    return values if values is not None else [default] * _length(cols)
+
+
+def _row(cols, i):
+    """Rekonstruerer række i som dict (kun for de få rækker der returneres i lister)."""
+    return {k: v[i] for k, v in cols.items()}
+
+
+def _encode(values):
+    """
+    Dictionary encoding: (koder, nøgler), hvor nøglerne står i rækkefølge for
+    første forekomst og koder[i] er indekset i nøglerne for values[i].
+    """
+    keys = list(dict.fromkeys(values))
+    index = {k: i for i, k in enumerate(keys)}
+    codes = np.fromiter(map(index.__getitem__, values), dtype=np.int64, count=len(values))
+    return codes, keys
+
+
+def _sort_ranks(keys):
+    """Rang pr. nøgle efter strengsortering (None/manglende sorteres som "")."""
+    order = sorted(range(len(keys)), key=lambda j: keys[j] or "")
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[order] = np.arange(len(keys))
+    return ranks
+
+
+def _parse_day(value):
+    """Dagnummer for datetime.fromisoformat(value).date(), NAT hvis det fejler."""
+    if not value:
+        return NAT
+    try:
+        return datetime.fromisoformat(value).date().toordinal() - _EPOCH_ORDINAL
+    except Exception:
+        return NAT
+
+
+def _date_column(values):
+    """(dagnumre, sorteringsrang) for en kolonne af ISO-datostrenge."""
+    codes, keys = _encode(values)
+    key_days = np.array([_parse_day(k) for k in keys], dtype=np.int64)
+    return key_days[codes], _sort_ranks(keys)[codes]
+
+
+def _float_column(values, or_zero=True):
+    """
+    float(v or 0) (eller float(v) med or_zero=False) pr. værdi. Returnerer
+    (array, valid) hvor valid=False markerer værdier hvor float() ville
+    fejle (dem springer main.py over).
+    """
+    cleaned = [v or 0 for v in values] if or_zero else values
+    try:
+        arr = np.array(cleaned, dtype=np.float64)
+        valid = np.ones(len(arr), dtype=bool)
+        if not or_zero and None in cleaned:
+            # NumPy laver None om til nan, hvor float(None) fejler
+            valid = np.fromiter((v is not None for v in cleaned), dtype=bool, count=len(cleaned))
+        return arr, valid
+    except (TypeError, ValueError):
+        pass
+    arr = np.zeros(len(cleaned), dtype=np.float64)
+    valid = np.ones(len(cleaned), dtype=bool)
+    for i, v in enumerate(cleaned):
+        try:
+            arr[i] = float(v)
+        except Exception:
+            valid[i] = False
+    return arr, valid
+
+
+def _day_number(d: date) -> int:
+    return d.toordinal() - _EPOCH_ORDINAL
+
+
+def _code_of(keys, value):
+    try:
+        return keys.index(value)
+    except ValueError:
+        return -1
+
+
+def leases_table(leases):
+    status, statuses = _encode(_column(leases, "status"))
+    model, models = _encode(_column(leases, "car_model"))
+    price, price_valid = _float_column(_column(leases, "monthly_price", 0))
+
+    # Måned = start_date[:7], udledt én gang pr. unik startdato
+    start_codes, start_keys = _encode(_column(leases, "start_date"))
+    month_codes, months = _encode([k[:7] if k else None for k in start_keys])
+    month = month_codes[start_codes]
+
+    end_day, end_rank = _date_column(_column(leases, "end_date"))
+    return {
+        "cols": leases,
+        "id": _column(leases, "id"),
+        "status": status,
+        "statuses": statuses,
+        "model": model,
+        "models": models,
+        "price": price,
+        "price_valid": price_valid,
+        "month": month,
+        "months": months,
+        "end_day": end_day,
+        "end_rank": end_rank,
+    }
+
+
+def damages_table(damages):
+    status, statuses = _encode(_column(damages, "status"))
+    # compute_avg_damage_cost bruger float(v) (None fejler), de øvrige float(v or 0)
+    raw_cost = _column(damages, "estimated_cost", 0)
+    avg_cost, avg_valid = _float_column(raw_cost, or_zero=False)
+    cost, cost_valid = _float_column(raw_cost)
+    detected_codes, detected_keys = _encode(_column(damages, "detected_at", ""))
+    return {
+        "cols": damages,
+        "lease_id": damages.get("lease_id", []),
+        "status": status,
+        "statuses": statuses,
+        "avg_cost": avg_cost,
+        "avg_valid": avg_valid,
+        "cost": cost,
+        "cost_valid": cost_valid,
+        "detected_rank": _sort_ranks(detected_keys)[detected_codes],
+    }
+
+
+def vehicles_table(vehicles):
+    status, statuses = _encode(_column(vehicles, "status"))
+    return {"status": status, "statuses": statuses}
+
+
+def reservations_table(reservations):
+    pickup_day, pickup_rank = _date_column(_column(reservations, "pickup_date"))
+    return {"cols": reservations, "pickup_day": pickup_day, "pickup_rank": pickup_rank}
+
+
+# --------- KPI'ER ---------
+
+
+def active_leases(t):
+    return int(np.count_nonzero(t["status"] == _code_of(t["statuses"], "ACTIVE")))
+
+
+def monthly_revenue(t):
+    has_month = np.array([bool(m) for m in t["months"]], dtype=bool)
+    keep = has_month[t["month"]] & t["price_valid"]
+    # bincount lægger sammen i rækkefølge, som "+=" i compute_monthly_revenue
+    totals = np.bincount(t["month"][keep], weights=t["price"][keep], minlength=len(t["months"]))
+    used = np.bincount(t["month"][keep], minlength=len(t["months"]))
+    return [
+        {"month": t["months"][j], "total_revenue": float(totals[j])}
+        for j in sorted((j for j in range(len(t["months"])) if used[j]), key=lambda j: t["months"][j])
+    ]
+
+
+def completed_with_damage(lt, dt):
+    completed = np.flatnonzero(lt["status"] == _code_of(lt["statuses"], "COMPLETED"))
+    completed_ids = {lt["id"][i] for i in completed}
+    return len(completed_ids.intersection(dt["lease_id"]))
+
+
+def avg_damage_cost(dt):
+    costs = dt["avg_cost"][dt["avg_valid"]]
+    if costs.size == 0:
+        return 0.0
+    return float(costs.sum() / costs.size)
+
+
+def top_models(t, top_n=3):
+    # None og "" tæller ikke med (som "if l.get('car_model')")
+    counts = np.bincount(t["model"], minlength=len(t["models"]))
+    candidates = np.array([j for j, m in enumerate(t["models"]) if m], dtype=np.int64)
+    # Nøglerne står i rækkefølge for første forekomst, så stabil sortering på
+    # -count giver samme rækkefølge som Counter.most_common
+    order = candidates[np.argsort(-counts[candidates], kind="stable")][:top_n]
+    return [{"car_model": t["models"][j], "count": int(counts[j])} for j in order]
+
+
+def fleet_status_counts(t):
+    counts = np.bincount(t["status"], minlength=len(t["statuses"]))
+    result = {}
+    for status, count in zip(t["statuses"], counts):
+        key = (status or "UNKNOWN").upper()
+        result[key] = result.get(key, 0) + int(count)
+    return result
+
+
+def pickup_kpis(t, today, days=7):
+    day = _day_number(today)
+    pickup = t["pickup_day"]
+    valid = pickup != NAT
+    pickups_today = int(np.count_nonzero(valid & (pickup == day)))
+    window = np.flatnonzero(valid & (pickup >= day) & (pickup <= day + days))
+    window = window[np.argsort(t["pickup_rank"][window], kind="stable")]
+    upcoming = [_row(t["cols"], i) for i in window]
+    return pickups_today, len(upcoming), upcoming
+
+
+def expiring_leases(t, today, days=30):
+    day = _day_number(today)
+    end = t["end_day"]
+    hits = np.flatnonzero((end != NAT) & (end >= day) & (end <= day + days))
+    hits = hits[np.argsort(t["end_rank"][hits], kind="stable")]
+    expiring = []
+    for i in hits:
+        item = _row(t["cols"], i)
+        item["days_to_end"] = int(end[i] - day)
+        expiring.append(item)
+    return len(expiring), expiring
+
+
+def open_damages(t, limit=5):
+    closed = [j for j, s in enumerate(t["statuses"]) if (s or "").upper() == "CLOSED"]
+    is_open = ~np.isin(t["status"], closed)
+    open_idx = np.flatnonzero(is_open)
+    total_cost = float(t["cost"][is_open & t["cost_valid"]].sum())
+
+    # Seneste først; ved samme detected_at bevares listens rækkefølge, som
+    # list.sort(reverse=True). Nøgle: høj rang først, derefter lavt indeks.
+    n = len(t["status"])
+    key = t["detected_rank"][open_idx] * n + (n - 1 - open_idx)
+    if key.size > limit:
+        top = np.argpartition(-key, limit)[:limit]
+    else:
+        top = np.arange(key.size)
+    top = top[np.argsort(-key[top])]
+    return int(open_idx.size), total_cost, [_row(t["cols"], i) for i in open_idx[top]]
+
+
+def build_kpi_columnar(leases, damages, vehicles, reservations, today=None):
+    """
+    Samme KPI-dokument som compute_kpis i main.py, beregnet kolonnevis.
+    Hver kilde er i kolonneformat ({"kolonne": [værdier]}).
+    """
+    today = today or date.today()
+    lt = leases_table(leases)
+    dt = damages_table(damages)
+    vt = vehicles_table(vehicles)
+    rt = reservations_table(reservations)
+
+    kpi = {}
+    kpi["active_leases"] = active_leases(lt)
+    kpi["monthly_revenue"] = monthly_revenue(lt)
+    kpi["completed_leases_with_damage"] = completed_with_damage(lt, dt)
+    kpi["avg_damage_cost"] = avg_damage_cost(dt)
+    kpi["top_models"] = top_models(lt)
+
+    kpi["fleet_status_counts"] = fleet_status_counts(vt)
+
+    pickups_today, pickups_next_7, upcoming = pickup_kpis(rt, today)
+    kpi["pickups_today"] = pickups_today
+    kpi["pickups_next_7_days"] = pickups_next_7
+    kpi["upcoming_pickups"] = upcoming
+
+    expiring_count, expiring = expiring_leases(lt, today, days=30)
+    kpi["leases_expiring_soon_count"] = expiring_count
+    kpi["expiring_leases"] = expiring
+
+    open_count, total_cost, recent = open_damages(dt)
+    kpi["open_damages_count"] = open_count
+    kpi["open_damages_total_cost"] = total_cost
+    kpi["recent_damages"] = recent
+    return kpi
@@ -0,0 +1,133 @@
+"""
+Approksimative kunde-KPI'er: unikke kunder og andel genkommende kunder.
+
+Pr. måned (start_date) og pr. bilmodel holdes en HyperLogLog-sketch
+(sketches.py) over kunde-id'et (CPR, ellers e-mail). Sketches opdateres fra
+kpi_state, efterhånden som aftaler kommer ind (kpi_state.subscribe). Unikke
+kunder i en periode er foreningen af månedernes sketches. Genkommende kunder
+er dem i perioden, der også havde en aftale før periodens start:
+|A ∩ B| = |A| + |B| - |A ∪ B|.
+
+Som i distributions.py kan en sketch ikke trække en kunde fra. Ændres en
+aftales kunde, måned eller model, genopbygges de berørte sketches fra de
+lokale rækker ved næste opslag.
+"""
+import threading
+from collections import Counter
+
+import kpi_state
+import sketches
+
+_lock = threading.Lock()
+_sketches = {}         # ("month"|"model", nøgle) -> HLL
+_dirty = set()
+_leases_by_month = Counter()   # præcist antal aftaler pr. måned
+
+
+def customer_key(lease):
+    """Kunde-id: CPR (kun cifre) hvis udfyldt, ellers e-mail i små bogstaver."""
+    cpr = "".join(ch for ch in (lease.get("customer_cpr") or "") if ch.isdigit())
+    if cpr:
+        return f"cpr:{cpr}"
+    email = (lease.get("customer_email") or "").strip().lower()
+    return f"email:{email}" if email else None
+
+
+def _buckets(lease):
+    """{(dimension, nøgle): kunde-id} som aftalen bidrager med."""
+    if lease is None:
+        return {}
+    customer = customer_key(lease)
+    start = lease.get("start_date") or ""
+    if customer is None or not start:
+        return {}
+    return {("month", start[:7]): customer, ("model", lease.get("car_model") or "UNKNOWN"): customer}
+
+
+def _on_change(kind, old, new):
+    """Lytter på kpi_state (kaldes under kpi_state's lås)."""
+    if kind != "leases":
+        return
+    with _lock:
+        if old is None and new is None:
+            _sketches.clear()
+            _dirty.clear()
+            _leases_by_month.clear()
+            return
+
+        before, after = _buckets(old), _buckets(new)
+        if before == after:
+            return
+        for dimension, key in before:
+            if dimension == "month":
+                _leases_by_month[key] -= 1
+        for dimension, key in after:
+            if dimension == "month":
+                _leases_by_month[key] += 1
+
+        _dirty.update(before)
+        for bucket, customer in after.items():
+            if bucket in _dirty:
+                continue
+            if bucket not in _sketches:
+                _sketches[bucket] = sketches.hll_new()
+            sketches.hll_add(_sketches[bucket], customer)
+
+
+def _rebuild_dirty(rows):
+    """Genopbygger dirty sketches fra kpi_state's aftaler (kaldes via read_rows)."""
+    with _lock:
+        if not _dirty:
+            return
+        rebuilt = {bucket: None for bucket in _dirty}
+        for lease in rows["leases"].values():
+            for bucket, customer in _buckets(lease).items():
+                if bucket in rebuilt:
+                    if rebuilt[bucket] is None:
+                        rebuilt[bucket] = sketches.hll_new()
+                    sketches.hll_add(rebuilt[bucket], customer)
+        for bucket, hll in rebuilt.items():
+            if hll is None:
+                _sketches.pop(bucket, None)
+            else:
+                _sketches[bucket] = hll
+        _dirty.clear()
+
+
+def query(first, last):
+    """
+    Unikke og genkommende kunder for måneder first..last ("YYYY-MM") samt
+    unikke kunder pr. model (hele historikken).
+    """
+    kpi_state.sync(kinds=("leases",))
+    kpi_state.read_rows(_rebuild_dirty, ("leases",))
+
+    with _lock:
+        months = {key: hll for (dimension, key), hll in _sketches.items() if dimension == "month"}
+        in_range = [hll for key, hll in months.items() if first <= key <= last]
+        before = [hll for key, hll in months.items() if key < first]
+        leases = sum(c for key, c in _leases_by_month.items() if first <= key <= last)
+        by_model = sorted(
+            ({"car_model": key, "unique_customers": sketches.hll_count(hll)}
+             for (dimension, key), hll in _sketches.items() if dimension == "model"),
+            key=lambda m: -m["unique_customers"],
+        )
+
+    current = sketches.hll_merge(in_range)
+    earlier = sketches.hll_merge(before)
+    unique = sketches.hll_count(current)
+    union = sketches.hll_count(sketches.hll_merge([current, earlier]))
+    returning = min(max(unique + sketches.hll_count(earlier) - union, 0), unique)
+    return {
+        "from": first,
+        "to": last,
+        "leases": leases,
+        "unique_customers": unique,
+        "returning_customers": returning,
+        "repeat_share": round(returning / unique, 4) if unique else 0.0,
+        "by_model": by_model,
+        "relative_error": round(sketches.hll_error(), 4),
+    }
+
+
+kpi_state.subscribe(_on_change)
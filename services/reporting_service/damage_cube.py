@@ -0,0 +1,189 @@
+"""
+Forudberegnet skadeskube (OLAP-stil) til analyser uden at joine rå rækker.
+
+Hver skade joines skade -> lease -> bil (vehicle_id fra aftalen, ellers
+skadens eget vehicle_id) og lægges i en celle pr. kombination af
+dimensionerne category, model, fuel_type, delivery_location og month
+(detected_at[:7]). Cellen holder antal og sum af estimated_cost; gennemsnit
+beregnes ved opslag.
+
+Alle 2^5 rollups (fx kun (model, month) eller kun (category,)) holdes
+forudberegnet, så en forespørgsel er et opslag i én dict. Kuben vedligeholdes
+inkrementelt fra kpi_state (kpi_state.subscribe): en ændret skade, en aftale
+hvis bil/model skifter eller en bil hvis model/brændstof/lokation skifter,
+mærker de berørte skader dirty. Ved næste opslag flyttes kun de skader fra
+deres gamle celle til den nye i alle rollups.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import combinations
+
+import kpi_state
+
+DIMENSIONS = ("category", "model", "fuel_type", "delivery_location", "month")
+CUBE_SOURCES = ("leases", "damages", "vehicles")
+
+# Felter der indgår i en skades celle (ændringer i andre felter ignoreres)
+LEASE_FIELDS = ("vehicle_id", "car_model")
+VEHICLE_FIELDS = ("model_name", "fuel_type", "delivery_location")
+
+# Alle delmængder af dimensionerne som index-tupler
+_ROLLUP_DIMS = [
+    dims for size in range(len(DIMENSIONS) + 1) for dims in combinations(range(len(DIMENSIONS)), size)
+]
+
+_lock = threading.Lock()
+_rollups = {tuple(DIMENSIONS[i] for i in dims): {} for dims in _ROLLUP_DIMS}   # dimensioner -> {værdier: [antal, sum]}
+_contrib = {}                         # damage_id -> (celle, omkostning, lease_id, vehicle_id)
+_damages_by_lease = defaultdict(set)  # lease_id (fra skaden) -> damage_id'er
+_damages_by_vehicle = defaultdict(set)  # opløst vehicle_id -> damage_id'er
+_dirty = set()                        # damage_id'er der skal placeres igen
+_version = None      # seq pr. kilde som kuben er bygget af
+_built_at = None
+
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except Exception:
+        return None
+
+
+def _resolve(damage, rows):
+    """(celle, omkostning, vehicle_id) for en skade joinet skade -> lease -> bil."""
+    lease = rows["leases"].get(damage.get("lease_id")) or {}
+    vehicle_id = lease.get("vehicle_id") or damage.get("vehicle_id")
+    vehicle = rows["vehicles"].get(vehicle_id) or {}
+    detected = damage.get("detected_at") or ""
+    key = (
+        damage.get("category") or "UNKNOWN",
+        vehicle.get("model_name") or lease.get("car_model") or "UNKNOWN",
+        vehicle.get("fuel_type") or "UNKNOWN",
+        vehicle.get("delivery_location") or "UNKNOWN",
+        detected[:7] or "UNKNOWN",
+    )
+    cost = _to_float(damage.get("estimated_cost"))
+    return key, cost or 0.0, vehicle_id
+
+
+def _add_cell(key, cost, sign):
+    """Lægger en skade til (sign=+1) eller trækker den fra (sign=-1) i alle rollups."""
+    for dims in _ROLLUP_DIMS:
+        rollup = _rollups[tuple(DIMENSIONS[i] for i in dims)]
+        sub = tuple(key[i] for i in dims)
+        cell = rollup.get(sub)
+        if cell is None:
+            cell = rollup[sub] = [0, 0.0]
+        cell[0] += sign
+        cell[1] += sign * cost
+        if cell[0] == 0:
+            del rollup[sub]
+
+
+def _changed(old, new, fields):
+    return old is None or new is None or any(old.get(f) != new.get(f) for f in fields)
+
+
+def _on_change(kind, old, new):
+    """Lytter på kpi_state (kaldes under kpi_state's lås); mærker berørte skader dirty."""
+    with _lock:
+        if old is None and new is None:
+            # Fuld genindlæsning: forsvundne rækker meldes ikke, så alt placeres igen
+            _dirty.update(_contrib)
+        elif kind == "damages":
+            _dirty.add((new or old)["id"])
+        elif kind == "leases" and _changed(old, new, LEASE_FIELDS):
+            _dirty.update(_damages_by_lease.get((new or old)["id"], ()))
+        elif kind == "vehicles" and _changed(old, new, VEHICLE_FIELDS):
+            _dirty.update(_damages_by_vehicle.get((new or old)["id"], ()))
+
+
+def _apply_dirty(rows):
+    """Flytter dirty skader til deres nuværende celle (kaldes via read_rows). Returnerer antal flyttede."""
+    moved = 0
+    with _lock:
+        for damage_id in _dirty:
+            previous = _contrib.get(damage_id)
+            damage = rows["damages"].get(damage_id)
+            current = None
+            if damage is not None:
+                key, cost, vehicle_id = _resolve(damage, rows)
+                current = (key, cost, damage.get("lease_id"), vehicle_id)
+            if current == previous:
+                continue
+            moved += 1
+            if previous is not None:
+                key, cost, lease_id, vehicle_id = previous
+                _add_cell(key, cost, -1)
+                _damages_by_lease[lease_id].discard(damage_id)
+                _damages_by_vehicle[vehicle_id].discard(damage_id)
+                del _contrib[damage_id]
+            if current is not None:
+                key, cost, lease_id, vehicle_id = current
+                _add_cell(key, cost, +1)
+                _damages_by_lease[lease_id].add(damage_id)
+                _damages_by_vehicle[vehicle_id].add(damage_id)
+                _contrib[damage_id] = current
+        _dirty.clear()
+    return moved
+
+
+def refresh():
+    """Synkroniserer kpi_state og placerer de skader der er berørt af nye ændringer."""
+    global _version, _built_at
+    kpi_state.sync(kinds=CUBE_SOURCES)
+    moved, version = kpi_state.read_rows(_apply_dirty, CUBE_SOURCES)
+    with _lock:
+        if version == _version and not moved:
+            return False
+        _version = version
+        _built_at = datetime.utcnow().isoformat()
+        return True
+
+
+def query(group_by, filters=None):
+    """
+    Celler for rollup'en group_by (liste af DIMENSIONS), evt. filtreret på
+    {dimension: værdi}. Filtrerede dimensioner indgår i opslaget, men kun
+    group_by-dimensionerne returneres.
+    """
+    filters = filters or {}
+    wanted = set(group_by) | set(filters)
+    dims = tuple(d for d in DIMENSIONS if d in wanted)
+
+    started = time.perf_counter()
+    with _lock:
+        # Kopi: rollups opdateres på stedet af _apply_dirty
+        rollup = {key: tuple(cell) for key, cell in _rollups.get(dims, {}).items()}
+        built_at = _built_at
+
+    merged = defaultdict(lambda: [0, 0.0])
+    for key, (count, total) in rollup.items():
+        values = dict(zip(dims, key))
+        if any(values[d] != v for d, v in filters.items()):
+            continue
+        target = merged[tuple(values[d] for d in group_by)]
+        target[0] += count
+        target[1] += total
+
+    cells = [
+        {
+            **dict(zip(group_by, key)),
+            "count": count,
+            "cost_sum": round(total, 2),
+            "cost_mean": round(total / count, 2) if count else 0.0,
+        }
+        for key, (count, total) in sorted(merged.items())
+    ]
+    return {
+        "group_by": list(group_by),
+        "filters": filters,
+        "cells": cells,
+        "built_at": built_at,
+        "query_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+kpi_state.subscribe(_on_change)
@@ -0,0 +1,162 @@
+"""
+Fordelings-KPI'er (p50/p90/p99 m.fl.) for skadesomkostninger, månedspriser
+og kontraktlængde.
+
+Et gennemsnit alene forvrides af enkelte store afskrivninger, så vi holder et
+t-digest (sketches.py) pr. metrik og tidsspand (måned) samt pr. kategori.
+Digests opdateres løbende fra kpi_state, efterhånden som rækker kommer ind
+via change feeds (kpi_state.subscribe). Nye rækker lægges direkte i deres
+digests. Et digest kan ikke trække en værdi fra, så ændres en række, mærkes
+de berørte spande dirty og genopbygges fra de lokale rækker ved næste
+opslag. Perioder besvares ved at flette månedernes digests.
+"""
+import threading
+from datetime import datetime
+
+import kpi_state
+import sketches
+
+DIMENSIONS = ("month", "category")
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+_lock = threading.Lock()
+_digests = {}     # (metric, dimension, nøgle) -> digest
+_dirty = set()    # (metric, dimension, nøgle) der skal genopbygges
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def _contract_days(lease):
+    try:
+        start = datetime.fromisoformat(lease["start_date"]).date()
+        end = datetime.fromisoformat(lease["end_date"]).date()
+    except Exception:
+        return None
+    return (end - start).days
+
+
+def _lease_buckets(lease):
+    start = lease.get("start_date") or ""
+    return {
+        "month": start[:7] or "UNKNOWN",
+        "category": lease.get("car_segment") or lease.get("car_model") or "UNKNOWN",
+    }
+
+
+def _damage_buckets(damage):
+    detected = damage.get("detected_at") or ""
+    return {"month": detected[:7] or "UNKNOWN", "category": damage.get("category") or "UNKNOWN"}
+
+
+# Metrik -> (kilde, værdi(række), spande(række))
+METRICS = {
+    "damage_cost": ("damages", lambda d: _to_float(d.get("estimated_cost")), _damage_buckets),
+    "monthly_price": ("leases", lambda l: _to_float(l.get("monthly_price")), _lease_buckets),
+    "contract_days": ("leases", _contract_days, _lease_buckets),
+}
+SOURCES = ("leases", "damages")     # kilderne METRICS læser
+
+
+def _contributions(kind, row):
+    """{(metric, dimension, nøgle): værdi} som rækken bidrager med."""
+    result = {}
+    if row is None:
+        return result
+    for metric, (source, value_of, buckets_of) in METRICS.items():
+        if source != kind:
+            continue
+        value = value_of(row)
+        if value is None:
+            continue
+        for dimension, key in buckets_of(row).items():
+            result[(metric, dimension, key)] = value
+    return result
+
+
+def _on_change(kind, old, new):
+    """Lytter på kpi_state (kaldes under kpi_state's lås)."""
+    with _lock:
+        if old is None and new is None:
+            # Fuld genindlæsning: kildens digests bygges op igen fra bunden
+            for bucket in [b for b in _digests if METRICS[b[0]][0] == kind]:
+                del _digests[bucket]
+                _dirty.discard(bucket)
+            return
+
+        before = _contributions(kind, old)
+        after = _contributions(kind, new)
+        if before == after:
+            return
+        _dirty.update(before)
+        for bucket, value in after.items():
+            if bucket in _dirty:
+                continue
+            if bucket not in _digests:
+                _digests[bucket] = sketches.digest_new()
+            sketches.digest_add(_digests[bucket], value)
+
+
+def _rebuild_dirty(rows):
+    """Genopbygger dirty spande fra kpi_state's rækker (kaldes via read_rows)."""
+    with _lock:
+        if not _dirty:
+            return
+        rebuilt = {bucket: sketches.digest_new() for bucket in _dirty}
+        for kind in {METRICS[metric][0] for metric, _, _ in _dirty}:
+            for row in rows[kind].values():
+                for bucket, value in _contributions(kind, row).items():
+                    if bucket in rebuilt:
+                        sketches.digest_add(rebuilt[bucket], value)
+        for bucket, digest in rebuilt.items():
+            if digest["count"]:
+                _digests[bucket] = digest
+            else:
+                _digests.pop(bucket, None)
+        _dirty.clear()
+
+
+def _summary(digest, quantiles):
+    return {
+        "count": digest["count"],
+        "min": digest["min"],
+        "max": digest["max"],
+        "quantiles": {f"p{round(q * 100, 1):g}": sketches.digest_quantile(digest, q) for q in quantiles},
+    }
+
+
+def _in_period(month, first, last):
+    """True hvis month ligger i [first, last]; UNKNOWN kun uden afgrænsning."""
+    if first is None and last is None:
+        return True
+    if month == "UNKNOWN":
+        return False
+    return (first is None or month >= first) and (last is None or month <= last)
+
+
+def query(metric, dimension="month", first=None, last=None, quantiles=DEFAULT_QUANTILES):
+    """
+    Kvantiler pr. spand for metric langs dimension (month/category) samt for
+    alle spandene flettet. first/last ("YYYY-MM") afgrænser måneder; spanden
+    UNKNOWN (manglende dato) er kun med når perioden ikke er afgrænset.
+    """
+    kpi_state.sync(kinds=SOURCES)
+    kpi_state.read_rows(_rebuild_dirty, SOURCES)
+
+    with _lock:
+        selected = sorted(
+            (key, digest)
+            for (m, d, key), digest in _digests.items()
+            if m == metric and d == dimension
+            and (dimension != "month" or _in_period(key, first, last))
+        )
+        buckets = [{"bucket": key, **_summary(digest, quantiles)} for key, digest in selected]
+        total = _summary(sketches.digest_merge(d for _, d in selected), quantiles)
+    return {"metric": metric, "by": dimension, "buckets": buckets, "total": total}
+
+
+kpi_state.subscribe(_on_change)
@@ -0,0 +1,299 @@
+"""
+Single-pass KPI-beregning som folds over streamede rækker.
+
+Hver KPI registrerer en akkumulator pr. kilde: init(ctx) -> tilstand,
+step(tilstand, række, parsed) -> tilstand og finish(tilstand) -> {kpi: værdi}.
+run_source() læser kildens rækker én gang (NDJSON direkte fra servicen) og
+fodrer alle akkumulatorer; felterne parses kun én gang pr. række (PARSERS).
+
+Hukommelsen er konstant bortset fra de begrænsede lister (top-N, kommende
+afhentninger/udløb i vinduet) og grupperinger (måneder, modeller). Eneste
+undtagelse er "afsluttede aftaler med skader", der kræver id-mængder fra to
+kilder og samles i combine().
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+_FOLDS = defaultdict(list)   # kilde -> [(navn, init, step, finish)]
+
+
+def fold(source, name, init, step, finish):
+    """Registrerer en akkumulator for en kilde."""
+    _FOLDS[source].append((name, init, step, finish))
+
+
+# --------- PARSING (én gang pr. række) ---------
+
+
+def _to_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except Exception:
+        return None
+
+
+def _try_float(value):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def _parse_lease(row):
+    start = row.get("start_date")
+    return {
+        "status": row.get("status"),
+        "month": start[:7] if start else None,
+        "price": _try_float(row.get("monthly_price", 0) or 0),
+        "end": _to_date(row.get("end_date")),
+    }
+
+
+def _parse_damage(row):
+    return {
+        "open": (row.get("status") or "").upper() != "CLOSED",
+        "avg_cost": _try_float(row.get("estimated_cost", 0)),
+        "cost": _try_float(row.get("estimated_cost", 0) or 0),
+    }
+
+
+def _parse_vehicle(row):
+    return {"status": (row.get("status") or "UNKNOWN").upper()}
+
+
+def _parse_reservation(row):
+    return {"pickup": _to_date(row.get("pickup_date"))}
+
+
+PARSERS = {
+    "leases": _parse_lease,
+    "damages": _parse_damage,
+    "vehicles": _parse_vehicle,
+    "reservations": _parse_reservation,
+}
+
+
+# --------- LEASES ---------
+
+
+def _count_step(predicate):
+    def step(acc, row, p):
+        return acc + 1 if predicate(row, p) else acc
+    return step
+
+
+fold(
+    "leases", "active_leases",
+    lambda ctx: 0,
+    _count_step(lambda row, p: p["status"] == "ACTIVE"),
+    lambda acc: {"active_leases": acc},
+)
+
+
+def _revenue_step(acc, row, p):
+    if p["month"] and p["price"] is not None:
+        acc[p["month"]] += p["price"]
+    return acc
+
+
+fold(
+    "leases", "monthly_revenue",
+    lambda ctx: defaultdict(float),
+    _revenue_step,
+    lambda acc: {"monthly_revenue": [{"month": m, "total_revenue": t} for m, t in sorted(acc.items())]},
+)
+
+
+def _models_step(acc, row, p):
+    if row.get("car_model"):
+        acc["counts"][row["car_model"]] += 1
+    return acc
+
+
+fold(
+    "leases", "top_models",
+    lambda ctx: {"n": ctx["top_models"], "counts": Counter()},
+    _models_step,
+    lambda acc: {"top_models": [{"car_model": m, "count": c} for m, c in acc["counts"].most_common(acc["n"])]},
+)
+
+
+def _expiring_init(ctx):
+    return {"today": ctx["today"], "limit": ctx["today"] + timedelta(days=ctx["expiring_days"]), "items": []}
+
+
+def _expiring_step(acc, row, p):
+    end = p["end"]
+    if end is not None and acc["today"] <= end <= acc["limit"]:
+        item = dict(row)
+        item["days_to_end"] = (end - acc["today"]).days
+        acc["items"].append(item)
+    return acc
+
+
+def _expiring_finish(acc):
+    items = sorted(acc["items"], key=lambda x: x.get("end_date", ""))
+    return {"leases_expiring_soon_count": len(items), "expiring_leases": items}
+
+
+fold("leases", "expiring", _expiring_init, _expiring_step, _expiring_finish)
+
+
+def _completed_step(acc, row, p):
+    if p["status"] == "COMPLETED":
+        acc.add(row["id"])
+    return acc
+
+
+fold("leases", "completed_ids", lambda ctx: set(), _completed_step, lambda acc: {"_completed_ids": acc})
+
+
+# --------- DAMAGES ---------
+
+
+def _avg_step(acc, row, p):
+    if p["avg_cost"] is not None:
+        acc[0] += p["avg_cost"]
+        acc[1] += 1
+    return acc
+
+
+fold(
+    "damages", "avg_damage_cost",
+    lambda ctx: [0.0, 0],
+    _avg_step,
+    lambda acc: {"avg_damage_cost": acc[0] / acc[1] if acc[1] else 0.0},
+)
+
+
+def _open_init(ctx):
+    return {"count": 0, "cost": 0.0, "seen": 0, "heap": [], "limit": ctx["recent_damages"]}
+
+
+def _open_step(acc, row, p):
+    acc["seen"] += 1
+    if not p["open"]:
+        return acc
+    acc["count"] += 1
+    if p["cost"] is not None:
+        acc["cost"] += p["cost"]
+    # Min-heap med de `limit` seneste; ved samme detected_at vinder den
+    # tidligste række (som list.sort(reverse=True), der er stabil)
+    entry = (row.get("detected_at", ""), -acc["seen"], row)
+    if len(acc["heap"]) < acc["limit"]:
+        heapq.heappush(acc["heap"], entry)
+    elif entry[:2] > acc["heap"][0][:2]:
+        heapq.heapreplace(acc["heap"], entry)
+    return acc
+
+
+def _open_finish(acc):
+    recent = [e[2] for e in sorted(acc["heap"], key=lambda e: e[:2], reverse=True)]
+    return {"open_damages_count": acc["count"], "open_damages_total_cost": acc["cost"], "recent_damages": recent}
+
+
+fold("damages", "open_damages", _open_init, _open_step, _open_finish)
+
+
+def _damaged_step(acc, row, p):
+    if "lease_id" in row:
+        acc.add(row["lease_id"])
+    return acc
+
+
+fold("damages", "damaged_lease_ids", lambda ctx: set(), _damaged_step, lambda acc: {"_damaged_lease_ids": acc})
+
+
+# --------- VEHICLES ---------
+
+
+def _fleet_step(acc, row, p):
+    acc[p["status"]] += 1
+    return acc
+
+
+fold(
+    "vehicles", "fleet_status_counts",
+    lambda ctx: defaultdict(int),
+    _fleet_step,
+    lambda acc: {"fleet_status_counts": dict(acc)},
+)
+
+
+# --------- RESERVATIONS ---------
+
+
+def _pickups_init(ctx):
+    today = ctx["today"]
+    return {"today": today, "limit": today + timedelta(days=ctx["pickup_days"]), "count_today": 0, "items": []}
+
+
+def _pickups_step(acc, row, p):
+    pickup = p["pickup"]
+    if pickup is None:
+        return acc
+    if pickup == acc["today"]:
+        acc["count_today"] += 1
+    if acc["today"] <= pickup <= acc["limit"]:
+        acc["items"].append(row)
+    return acc
+
+
+def _pickups_finish(acc):
+    items = sorted(acc["items"], key=lambda r: r.get("pickup_date", ""))
+    return {"pickups_today": acc["count_today"], "pickups_next_7_days": len(items), "upcoming_pickups": items}
+
+
+fold("reservations", "pickups", _pickups_init, _pickups_step, _pickups_finish)
+
+
+# --------- KØRSEL ---------
+
+
+def make_context(today=None, expiring_days=30, pickup_days=7, recent_damages=5, top_models=3):
+    return {
+        "today": today or date.today(),
+        "top_models": top_models,
+        "expiring_days": expiring_days,
+        "pickup_days": pickup_days,
+        "recent_damages": recent_damages,
+    }
+
+
+def run_source(source, rows, ctx):
+    """Én passage over rows; returnerer de delresultater kildens folds giver."""
+    folds = _FOLDS[source]
+    parse = PARSERS[source]
+    states = [init(ctx) for _, init, _, _ in folds]
+    steps = [step for _, _, step, _ in folds]
+    for row in rows:
+        parsed = parse(row)
+        for i, step in enumerate(steps):
+            states[i] = step(states[i], row, parsed)
+
+    partial = {}
+    for (_, _, _, finish), state in zip(folds, states):
+        partial.update(finish(state))
+    return partial
+
+
+def combine(partials):
+    """
+    Samler delresultaterne fra alle kilder til KPI-dokumentet. Kilder der
+    mangler (fejl/timeout) giver samme værdier som en tom kilde.
+    """
+    empty_ctx = make_context()
+    kpi = {}
+    for source in _FOLDS:
+        part = partials.get(source)
+        if part is None:
+            part = run_source(source, [], empty_ctx)
+        kpi.update(part)
+
+    completed = kpi.pop("_completed_ids")
+    damaged = kpi.pop("_damaged_lease_ids")
+    kpi["completed_leases_with_damage"] = len(completed.intersection(damaged))
+    return kpi
@@ -0,0 +1,243 @@
+"""
+Historik over KPI'erne, så trends ikke kræver genafspilning af servicernes DB'er.
+
+Hver skrivning gemmer alle tal-KPI'er fra snapshottet som kompakte rækker
+(metric, ts, value); dict-KPI'er som fleet_status_counts flades ud til fx
+"fleet_status_counts.AVAILABLE". Der skrives automatisk én gang i døgnet
+(efter første snapshot-genberegning på en ny dag) og ellers på forespørgsel.
+
+Lagringen er tidspartitioneret: rå punkter ligger i én tabel pr. måned
+(kpi_raw_YYYYMM) med primærnøgle (metric, ts) WITHOUT ROWID, så et
+metric+periode-opslag er et range scan i de måneder perioden rammer. Når
+en hel måned er ældre end KPI_HISTORY_RAW_DAYS, nedsamples den til én række
+pr. metrik og dag i kpi_daily (avg/min/max/n), og månedstabellen droppes.
+"""
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+DB_PATH = os.getenv("REPORTING_DB_PATH", "reporting.db")
+RAW_RETENTION_DAYS = int(os.getenv("KPI_HISTORY_RAW_DAYS", "90"))
+
+_PARTITION = re.compile(r"^kpi_raw_(\d{6})$")
+_write_lock = threading.Lock()
+_last_daily = None   # dato for seneste automatiske skrivning
+
+
+def get_connection():
+    db_path = Path(DB_PATH)
+    if db_path.parent != Path("."):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_db():
+    """Opretter tabellen til nedsamplede dagsværdier (rå partitioner oprettes ved behov)."""
+    conn = get_connection()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kpi_daily (
+            metric TEXT NOT NULL,
+            day    TEXT NOT NULL,          -- YYYY-MM-DD
+            avg    REAL NOT NULL,
+            min    REAL NOT NULL,
+            max    REAL NOT NULL,
+            n      INTEGER NOT NULL,
+            PRIMARY KEY (metric, day)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+def _partition_name(ts: str) -> str:
+    return f"kpi_raw_{ts[:4]}{ts[5:7]}"
+
+
+def _ensure_partition(cur, name):
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            metric TEXT NOT NULL,
+            ts     TEXT NOT NULL,          -- ISO-tidsstempel (UTC)
+            value  REAL NOT NULL,
+            PRIMARY KEY (metric, ts)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _partitions(conn):
+    """[(måned "YYYY-MM", tabelnavn)] sorteret."""
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'kpi_raw_%'")
+    result = []
+    for row in rows:
+        match = _PARTITION.match(row["name"])
+        if match:
+            result.append((f"{match.group(1)[:4]}-{match.group(1)[4:]}", row["name"]))
+    return sorted(result)
+
+
+def flatten_kpi(kpi, keys=None):
+    """{metric: tal} for tal-KPI'er og dicts af tal; lister springes over."""
+    points = {}
+    for key, value in kpi.items():
+        if keys is not None and key not in keys:
+            continue
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            points[key] = float(value)
+        elif isinstance(value, dict):
+            for sub, sub_value in value.items():
+                if isinstance(sub_value, (int, float)) and not isinstance(sub_value, bool):
+                    points[f"{key}.{sub}"] = float(sub_value)
+    return points
+
+
+def record(points, ts=None):
+    """Skriver {metric: værdi} med tidsstempel ts (default: nu). Returnerer antal rækker."""
+    ts = ts or datetime.utcnow().isoformat(timespec="seconds")
+    if not points:
+        return 0
+    name = _partition_name(ts)
+    with _write_lock:
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            _ensure_partition(cur, name)
+            cur.executemany(
+                f"INSERT OR REPLACE INTO {name} (metric, ts, value) VALUES (?, ?, ?)",
+                [(metric, ts, value) for metric, value in points.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    return len(points)
+
+
+def record_snapshot(doc, sections):
+    """
+    Gemmer KPI'erne fra et snapshot-dokument. Sektioner der er stale (kilden
+    fejlede) springes over, så historikken ikke får gentagne gamle værdier.
+    sections: sektion -> (kilder, KPI-nøgler) som snapshot.SECTIONS.
+    """
+    keys = set()
+    for name, (_, section_keys) in sections.items():
+        if not doc["sections"].get(name, {}).get("stale"):
+            keys.update(section_keys)
+    return record(flatten_kpi(doc["kpi"], keys))
+
+
+def downsample(today=None):
+    """
+    Nedsampler rå månedspartitioner der ligger helt før
+    today - RAW_RETENTION_DAYS til kpi_daily og dropper dem.
+    Returnerer de nedsamplede måneder.
+    """
+    today = today or date.today()
+    cutoff = (today - timedelta(days=RAW_RETENTION_DAYS)).isoformat()[:7]
+    done = []
+    with _write_lock:
+        conn = get_connection()
+        try:
+            for month, name in _partitions(conn):
+                if month >= cutoff:
+                    continue
+                conn.execute("BEGIN")
+                conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO kpi_daily (metric, day, avg, min, max, n)
+                    SELECT metric, substr(ts, 1, 10), AVG(value), MIN(value), MAX(value), COUNT(*)
+                    FROM {name}
+                    GROUP BY metric, substr(ts, 1, 10)
+                    """
+                )
+                conn.execute(f"DROP TABLE {name}")
+                conn.commit()
+                done.append(month)
+        finally:
+            conn.close()
+    return done
+
+
+def record_daily(doc, sections, build_missing=None):
+    """
+    Skriver snapshottet hvis der ikke er skrevet automatisk i dag, og
+    nedsampler gamle data. Der skrives først når dokumentet har alle
+    sektioner; mangler nogen, kaldes build_missing(manglende) (som bør
+    beregne dem i baggrunden), og skrivningen sker ved en senere
+    genberegning. Dagen markeres først som skrevet når skrivningen er lykkedes.
+    """
+    global _last_daily
+    today = date.today()
+    if _last_daily == today:
+        return False
+    missing = [name for name in sections if name not in doc["sections"]]
+    if missing:
+        if build_missing is not None:
+            build_missing(missing)
+        return False
+    record_snapshot(doc, sections)
+    _last_daily = today
+    downsample(today)
+    return True
+
+
+def query(metric, first: date, last: date, step="day"):
+    """
+    Punkter for metric i [first, last] aggregeret pr. dag eller måned:
+    [{"t", "avg", "min", "max", "n"}]. Kun rå partitioner der overlapper
+    perioden læses; ældre data kommer fra kpi_daily.
+    """
+    lo, hi = first.isoformat(), (last + timedelta(days=1)).isoformat()
+    width = 10 if step == "day" else 7
+
+    conn = get_connection()
+    try:
+        # Dagsrækker (avg, min, max, n) fra de rå partitioner + kpi_daily
+        parts = [
+            f"""
+            SELECT substr(ts, 1, 10) AS day, AVG(value) AS avg, MIN(value) AS min,
+                   MAX(value) AS max, COUNT(*) AS n
+            FROM {name}
+            WHERE metric = ? AND ts >= ? AND ts < ?
+            GROUP BY day
+            """
+            for month, name in _partitions(conn)
+            if lo[:7] <= month <= last.isoformat()[:7]
+        ]
+        params = [metric, lo, hi] * len(parts)
+        parts.append("SELECT day, avg, min, max, n FROM kpi_daily WHERE metric = ? AND day >= ? AND day < ?")
+        params += [metric, lo, hi]
+
+        rows = conn.execute(
+            f"""
+            SELECT substr(day, 1, {width}) AS t,
+                   SUM(avg * n) / SUM(n) AS avg, MIN(min) AS min, MAX(max) AS max, SUM(n) AS n
+            FROM ({" UNION ALL ".join(parts)})
+            GROUP BY t
+            ORDER BY t
+            """,
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def metrics():
+    """Metrikker med historik (til at udfylde dropdowns o.l.)."""
+    conn = get_connection()
+    try:
+        parts = [f"SELECT DISTINCT metric FROM {name}" for _, name in _partitions(conn)]
+        parts.append("SELECT DISTINCT metric FROM kpi_daily")
+        return [row["metric"] for row in conn.execute(" UNION ".join(parts) + " ORDER BY metric")]
+    finally:
+        conn.close()
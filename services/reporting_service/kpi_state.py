@@ -0,0 +1,419 @@
+"""
+Inkrementelt vedligeholdte KPI'er.
+
+I stedet for at hente alle tabeller og regne alt forfra ved hvert dashboard-
+kald holder vi akkumulatorer (aktive aftaler, omsætning pr. måned,
+statusoptællinger, åbne skader, afhentninger pr. dag osv.). De opdateres fra
+servicernes change feed (GET /changes?since=), så et kald kun koster de
+ændringer der er sket siden sidst. En periodisk fuld genindlæsning
+(reconcile) retter evt. drift; tilstanden gemmes ikke, så en genstart
+svarer til en reconcile.
+
+Hver række bidrager til akkumulatorerne via _contribute(kind, row, sign):
+en ændring er "træk gammel version fra (sign=-1), læg ny til (sign=+1)".
+For at kunne trække fra gemmes pr. id kun felterne i FIELDS (de felter
+akkumulatorerne og abonnenterne bruger). Hele rækker gemmes kun for de
+rækker der kan komme på dashboardets lister: aftaler der endnu ikke er
+udløbet, fremtidige afhentninger og åbne skader.
+"""
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, date, timedelta
+
+from upstream import SOURCES, fan_out, fetch_source, fetch_changes
+
+# Højst én delta-sync pr. interval (sek.), fuld reconcile hvert RECONCILE_INTERVAL
+SYNC_MIN_INTERVAL = 2.0
+RECONCILE_INTERVAL = 15 * 60
+CHANGES_PAGE_SIZE = 1000
+
+# Felter der gemmes pr. id: dem _contribute, listerne og abonnenterne
+# (damage_cube, distributions, customers) læser. Nye felter skal med her.
+FIELDS = {
+    "leases": (
+        "id", "status", "start_date", "end_date", "monthly_price", "car_model",
+        "car_segment", "vehicle_id", "customer_cpr", "customer_email",
+    ),
+    "damages": ("id", "lease_id", "vehicle_id", "status", "estimated_cost", "category", "detected_at"),
+    "vehicles": ("id", "status", "model_name", "fuel_type", "delivery_location"),
+    "reservations": ("id", "pickup_date"),
+}
+
+_lock = threading.RLock()          # beskytter rækker, cursors og akkumulatorer
+_sync_lock = threading.Lock()      # højst én sync ad gangen (holdes under netværkskald)
+
+# Kilde -> {id: række med kun FIELDS}
+_rows = {name: {} for name in SOURCES}
+# Kilde -> {id: hel række} for rækker der kan stå på dashboardets lister (_listed)
+_full = {name: {} for name in SOURCES}
+_refetch = set()                             # kilder hvor en listet række mangler felter
+_cursor = {name: None for name in SOURCES}   # seneste change-seq pr. kilde (None = aldrig læst)
+_errors = {name: None for name in SOURCES}
+_last_sync = {name: 0.0 for name in SOURCES}
+_last_reconcile = {name: 0.0 for name in SOURCES}
+_listeners = []                              # fn(kind, old, new) ved hver ændret række
+
+# ---- Akkumulatorer ----
+_lease_status = Counter()                    # status -> antal
+_revenue_by_month = defaultdict(float)       # "YYYY-MM" -> sum af monthly_price
+_revenue_leases_by_month = Counter()         # "YYYY-MM" -> antal aftaler (tomme måneder skjules)
+_model_counts = Counter()                    # car_model -> antal aftaler
+_model_ids = defaultdict(set)                # car_model -> lease-id'er (tie-break på nyeste id)
+_model_max_id = {}                           # car_model -> højeste lease-id
+_leases_by_end_day = defaultdict(set)        # end_date (date, ikke passeret) -> lease-id'er
+_completed_ids = set()
+_damages_by_lease = Counter()                # lease_id -> antal skader
+_completed_with_damage = 0
+_damage_cost = [0.0, 0]                      # [sum, antal] til gennemsnit
+_open_damage = [0, 0.0]                      # [antal, total estimeret omkostning]
+_fleet_status = Counter()
+_pickups_by_day = defaultdict(set)           # pickup-dato (ikke passeret) -> reservation-id'er
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except Exception:
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except Exception:
+        return None
+
+
+def _listed(kind, row, today):
+    """True hvis rækken kan komme på en af dashboardets lister (hel række gemmes)."""
+    if kind == "leases":
+        end_day = _parse_date(row.get("end_date"))
+        return end_day is not None and end_day >= today
+    if kind == "reservations":
+        pickup_day = _parse_date(row.get("pickup_date"))
+        return pickup_day is not None and pickup_day >= today
+    if kind == "damages":
+        return (row.get("status") or "").upper() != "CLOSED"
+    return False
+
+
+def _add_model(model, lease_id, sign):
+    """Tæller og højeste id pr. model (top_models: antal, derefter nyeste id)."""
+    _model_counts[model] += sign
+    ids = _model_ids[model]
+    if sign > 0:
+        ids.add(lease_id)
+        if lease_id > _model_max_id.get(model, -1):
+            _model_max_id[model] = lease_id
+    else:
+        ids.discard(lease_id)
+        if not ids:
+            del _model_ids[model]
+            _model_max_id.pop(model, None)
+        # Fjernes det højeste id, genberegnes maks først i _top_models, da en
+        # opdatering straks lægger samme id til igen
+
+
+def _top_models(n):
+    """Som lease_stats: flest aftaler først, ved lighed modellen med nyeste aftale."""
+    for model, ids in _model_ids.items():
+        if _model_max_id.get(model) not in ids:
+            _model_max_id[model] = max(ids)
+    top = heapq.nsmallest(
+        n,
+        ((m, c) for m, c in _model_counts.items() if c > 0),
+        key=lambda mc: (-mc[1], -_model_max_id[mc[0]]),
+    )
+    return [{"car_model": m, "count": c} for m, c in top]
+
+
+def _contribute(kind, row, sign):
+    """Lægger rækkens bidrag til (sign=+1) eller trækker det fra (sign=-1)."""
+    global _completed_with_damage
+    row_id = row.get("id")
+    today = date.today()
+
+    if kind == "leases":
+        status = row.get("status")
+        _lease_status[status] += sign
+
+        start = row.get("start_date")
+        price = _to_float(row.get("monthly_price"))
+        if start and price is not None:
+            _revenue_by_month[start[:7]] += sign * price
+            _revenue_leases_by_month[start[:7]] += sign
+
+        if row.get("car_model"):
+            _add_model(row["car_model"], row_id, sign)
+
+        end_day = _parse_date(row.get("end_date"))
+        if end_day is not None:
+            if sign > 0:
+                if end_day >= today:
+                    _leases_by_end_day[end_day].add(row_id)
+            elif end_day in _leases_by_end_day:
+                _leases_by_end_day[end_day].discard(row_id)
+
+        if status == "COMPLETED":
+            if sign > 0:
+                _completed_ids.add(row_id)
+            else:
+                _completed_ids.discard(row_id)
+            if _damages_by_lease[row_id] > 0:
+                _completed_with_damage += sign
+
+    elif kind == "damages":
+        lease_id = row.get("lease_id")
+        if lease_id is not None:
+            before = _damages_by_lease[lease_id]
+            _damages_by_lease[lease_id] += sign
+            after = _damages_by_lease[lease_id]
+            if lease_id in _completed_ids and (before > 0) != (after > 0):
+                _completed_with_damage += 1 if after > 0 else -1
+
+        try:
+            avg_cost = float(row.get("estimated_cost", 0))
+        except Exception:
+            avg_cost = None
+        if avg_cost is not None:
+            _damage_cost[0] += sign * avg_cost
+            _damage_cost[1] += sign
+
+        cost = _to_float(row.get("estimated_cost"))
+
+        if (row.get("status") or "").upper() != "CLOSED":
+            _open_damage[0] += sign
+            _open_damage[1] += sign * (cost or 0.0)
+
+    elif kind == "vehicles":
+        _fleet_status[(row.get("status") or "UNKNOWN").upper()] += sign
+
+    elif kind == "reservations":
+        pickup_day = _parse_date(row.get("pickup_date"))
+        if pickup_day is not None:
+            if sign > 0:
+                if pickup_day >= today:
+                    _pickups_by_day[pickup_day].add(row_id)
+            elif pickup_day in _pickups_by_day:
+                _pickups_by_day[pickup_day].discard(row_id)
+
+
+def subscribe(fn):
+    """
+    Registrerer fn(kind, old, new), der kaldes (under _lock) for hver række
+    der indsættes (old=None) eller ændres. Rækkerne har kun felterne i
+    FIELDS. Ved fuld genindlæsning af en kilde
+    kaldes fn(kind, None, None) først. Allerede indlæste rækker afspilles
+    straks som indsættelser.
+    """
+    with _lock:
+        _listeners.append(fn)
+        for kind, rows in _rows.items():
+            for row in rows.values():
+                fn(kind, None, row)
+
+
+def _notify(kind, old, new):
+    for fn in _listeners:
+        fn(kind, old, new)
+
+
+def _upsert(kind, row_id, fields):
+    rows = _rows[kind]
+    keep = FIELDS[kind]
+    old = rows.get(row_id)
+    projected = {k: v for k, v in fields.items() if k in keep}
+    if old is not None:
+        _contribute(kind, old, -1)
+        new = {**old, **projected}
+    else:
+        new = {"id": row_id, **projected}
+    rows[row_id] = new
+    _contribute(kind, new, +1)
+
+    full_old = _full[kind].pop(row_id, None)
+    if _listed(kind, new, date.today()):
+        if full_old is not None:
+            _full[kind][row_id] = {**full_old, **fields}
+        else:
+            # Ny række har alle felter; en gammel række der først nu bliver
+            # listet, har kun FIELDS, så kilden hentes fuldt ved næste sync
+            _full[kind][row_id] = {**new, **fields}
+            if old is not None:
+                _refetch.add(kind)
+    _notify(kind, old, new)
+
+
+def _fetch_full(kind, deadline):
+    """Henter en kilde helt. Returnerer ("full", latest_seq, rows)."""
+    # Seq hentes før data, så intet tabes; ændringer der overlapper
+    # genafspilles bare (upsert er idempotent).
+    latest_seq = fetch_changes(kind, since=0, limit=1, deadline=deadline)["latest_seq"]
+    return "full", latest_seq, fetch_source(kind, deadline=deadline)
+
+
+def _fetch_delta(kind, cursor, deadline):
+    """
+    Læser change feedet siden cursor. Returnerer ("changes", next_since, changes),
+    eller en fuld genindlæsning hvis feedet svarer reset_required.
+    """
+    changes = []
+    while True:
+        page = fetch_changes(kind, since=cursor, limit=CHANGES_PAGE_SIZE, deadline=deadline)
+        if page.get("reset_required"):
+            return _fetch_full(kind, deadline)
+        changes.extend(page["changes"])
+        cursor = page["next_since"]
+        if not page.get("has_more"):
+            return "changes", cursor, changes
+
+
+def _apply(kind, fetched):
+    """Anvender resultatet af _fetch_full/_fetch_delta (kaldes under _lock)."""
+    mode, seq, rows = fetched
+    if mode == "full":
+        for old in _rows[kind].values():
+            _contribute(kind, old, -1)
+        _rows[kind] = {}
+        _full[kind] = {}
+        _refetch.discard(kind)
+        _notify(kind, None, None)
+        for row in rows:
+            _upsert(kind, row["id"], row)
+    else:
+        for change in rows:
+            _upsert(kind, change["entity_id"], change["changed_fields"])
+    _cursor[kind] = seq
+
+
+def sync(force_reconcile=False, kinds=None):
+    """
+    Bringer kilderne kinds (default: alle) ajour. Kilder der aldrig er læst
+    (eller ved reconcile) genindlæses fuldt; ellers anvendes kun nye
+    ændringer. Throttling og reconcile-interval gælder pr. kilde, så et
+    kald for én sektion ikke udskyder de andre kilders sync.
+
+    Netværkskaldene for de fire kilder kører parallelt (upstream.fan_out)
+    uden _lock, så læsere (source_status, read_rows, build_kpi) ikke venter
+    på en langsom upstream; _sync_lock sikrer at to syncs ikke henter fra
+    samme cursors og anvender deltas i forkert rækkefølge. Selve
+    akkumulatorerne opdateres bagefter under _lock, da lease- og
+    skadesdata deler tællere.
+    """
+    kinds = SOURCES if kinds is None else kinds
+    with _sync_lock:
+        with _lock:
+            now = time.monotonic()
+            reconcile = {
+                kind for kind in kinds if force_reconcile or now - _last_reconcile[kind] >= RECONCILE_INTERVAL
+            }
+            due = [kind for kind in kinds if kind in reconcile or now - _last_sync[kind] >= SYNC_MIN_INTERVAL]
+            if not due:
+                return
+            cursors = dict(_cursor)
+            refetch = set(_refetch)
+
+        def fetch(kind, deadline):
+            if kind in reconcile or cursors[kind] is None or kind in refetch:
+                return _fetch_full(kind, deadline)
+            return _fetch_delta(kind, cursors[kind], deadline)
+
+        results, status = fan_out(fetch, names=due)
+
+        with _lock:
+            for kind in due:
+                if kind in results:
+                    _apply(kind, results[kind])
+                    _errors[kind] = None
+                else:
+                    print(f"[REPORTING] KPI-sync af {kind} fejlede: {status[kind]['error']}")
+                    _errors[kind] = status[kind]["error"]
+
+                _last_sync[kind] = now
+                if kind in reconcile:
+                    _last_reconcile[kind] = now
+
+
+def source_status(kinds=SOURCES):
+    with _lock:
+        return {
+            kind: {
+                "ok": _errors[kind] is None,
+                "error": _errors[kind],
+                "seq": _cursor[kind],
+                "rows": len(_rows[kind]),
+            }
+            for kind in kinds
+        }
+
+
+def read_rows(fn, kinds=SOURCES):
+    """
+    Kalder fn({kilde: {id: række}}) under låsen, så andre moduler kan bygge
+    afledte strukturer på den lokale kopi. Returnerer (fn's resultat,
+    seq pr. kilde) så kaldet kan se om data har ændret sig siden sidst.
+    """
+    with _lock:
+        return fn({kind: _rows[kind] for kind in kinds}), {kind: _cursor[kind] for kind in kinds}
+
+
+def _prune(today):
+    """Fjerner passerede dage og de hele rækker der ikke længere kan listes (under _lock)."""
+    for by_day, kind in ((_leases_by_end_day, "leases"), (_pickups_by_day, "reservations")):
+        for day in [d for d in by_day if d < today]:
+            for row_id in by_day.pop(day):
+                _full[kind].pop(row_id, None)
+
+
+def build_kpi(today=None):
+    """Samler KPI-dokumentet (samme form som /reporting/kpi/overview) fra akkumulatorerne."""
+    today = today or date.today()
+    with _lock:
+        _prune(today)
+        kpi = {}
+
+        kpi["active_leases"] = _lease_status["ACTIVE"]
+        kpi["monthly_revenue"] = [
+            {"month": month, "total_revenue": total}
+            for month, total in sorted(_revenue_by_month.items())
+            if _revenue_leases_by_month[month] > 0
+        ]
+        kpi["completed_leases_with_damage"] = _completed_with_damage
+        kpi["avg_damage_cost"] = _damage_cost[0] / _damage_cost[1] if _damage_cost[1] else 0.0
+        kpi["top_models"] = _top_models(3)
+
+        kpi["fleet_status_counts"] = {s: c for s, c in _fleet_status.items() if c > 0}
+
+        reservations = _full["reservations"]
+        upcoming = []
+        for offset in range(8):
+            upcoming.extend(reservations[rid] for rid in _pickups_by_day.get(today + timedelta(days=offset), ()))
+        upcoming.sort(key=lambda r: (r.get("pickup_date", ""), r["id"]))
+        kpi["pickups_today"] = len(_pickups_by_day.get(today, ()))
+        kpi["pickups_next_7_days"] = len(upcoming)
+        kpi["upcoming_pickups"] = upcoming
+
+        leases = _full["leases"]
+        expiring = []
+        for offset in range(31):
+            for lid in _leases_by_end_day.get(today + timedelta(days=offset), ()):
+                item = dict(leases[lid])
+                item["days_to_end"] = offset
+                expiring.append(item)
+        expiring.sort(key=lambda x: (x.get("end_date", ""), -x["id"]))  # som lease_stats
+        kpi["leases_expiring_soon_count"] = len(expiring)
+        kpi["expiring_leases"] = expiring
+
+        kpi["open_damages_count"] = _open_damage[0]
+        kpi["open_damages_total_cost"] = _open_damage[1]
+        kpi["recent_damages"] = heapq.nlargest(
+            5,
+            _full["damages"].values(),
+            key=lambda d: d.get("detected_at", ""),
+        )
+
+        return kpi
@@ -1,46 +1,39 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 import os
-import requests
+import threading
+import time
 from collections import Counter, defaultdict
 from datetime import datetime, date, timedelta
 
-app = Flask(__name__)
-
-# ---- Base-URL'er til mikrotjenester (via Docker-netværk) ----
-LEASE_BASE = os.getenv("LEASE_BASE_URL", "http://lease_service:5002")
-DAMAGE_BASE = os.getenv("DAMAGE_BASE_URL", "http://damage_service:5003")
-FLEET_BASE = os.getenv("FLEET_BASE_URL", "http://fleet_service:5006")
-RESERVATION_BASE = os.getenv("RESERVATION_BASE_URL", "http://reservation_service:5007")
-
-
-# --------- HJÆLPE-FUNKTIONER TIL FETCH ---------
-
-
-def safe_get(url, params=None):
-    """Wrapper om requests.get med simpel fejl-håndtering."""
-    try:
-        resp = requests.get(url, params=params, timeout=5)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        print(f"[REPORTING] Error fetching {url}: {e}")
-        return []
+import columnar
+import customers
+import damage_cube
+import distributions
+import history
+import folds
+import kpi_state
+import snapshot
+import timeseries
+from upstream import fan_out, fetch_columns, fetch_source, fetch_stats, fetch_versions, stream_rows
 
+app = Flask(__name__)
 
-def fetch_leases():
-    return safe_get(f"{LEASE_BASE}/leases")
-
-
-def fetch_damages():
-    return safe_get(f"{DAMAGE_BASE}/damages")
-
-
-def fetch_fleet():
-    return safe_get(f"{FLEET_BASE}/vehicles")
-
+# "stats": servicernes aggregat-endpoints (GET /<kilde>/stats), O(grupper) over nettet
+# "incremental": KPI'er vedligeholdes fra servicernes change feeds (kpi_state.py)
+# "live": hent alle tabeller og beregn forfra ved hvert kald (oprindelig adfærd)
+# "columnar": som live, men beregnet vektoriseret med NumPy (store historikker)
+# "stream": én passage pr. kilde over NDJSON med registrerede folds (folds.py)
+KPI_MODE = os.getenv("KPI_MODE", "incremental")
 
-def fetch_reservations():
-    return safe_get(f"{RESERVATION_BASE}/reservations")
+EXPIRING_DAYS = 30
+PICKUP_WINDOW_DAYS = 7
+RECENT_DAMAGES = 5
+TOP_MODELS = 3
+MRR_HORIZON_MONTHS = 12
+UTILIZATION_DEFAULT_DAYS = 365
+CUSTOMER_DEFAULT_MONTHS = 12
+# Hvor ofte historikjobbet tjekker om dagens KPI-række er skrevet (sek.)
+KPI_HISTORY_INTERVAL = float(os.getenv("KPI_HISTORY_INTERVAL", "3600"))
 
 
 # --------- KPI-BEREGNINGER ---------
@@ -206,50 +199,516 @@ def health():
     return {"status": "ok", "service": "reporting_service"}
 
 
-@app.get("/reporting/kpi/overview")
-def kpi_overview():
+def fetch_all_rows(sources=None):
     """
-    Samlet endpoint til ledelsesdashboardet.
-    Henter data fra de andre mikrotjenester og beregner KPI'er.
+    Henter tabellerne fra de andre mikrotjenester (parallelt), default alle.
+    Returnerer (leases, damages, vehicles, reservations, status pr. kilde);
+    en kilde der fejlede eller ikke blev hentet tæller som tom.
+    """
+    results, status = fan_out(fetch_source, names=sources)
+    return (
+        results.get("leases", []),
+        results.get("damages", []),
+        results.get("vehicles", []),
+        results.get("reservations", []),
+        status,
+    )
+
+
+def compute_kpis(leases, damages, vehicles, reservations, sections=None):
+    """
+    Beregner KPI-dokumentet ud fra rå rækker (compute_*-funktionerne).
+    Med sections køres kun beregningerne for de sektioner (snapshot.SECTIONS).
+    """
+    sections = snapshot.SECTIONS if sections is None else sections
+    kpi = {}
+
+    # Grund-KPI'er
+    if "leases" in sections:
+        kpi["active_leases"] = compute_active_leases(leases)
+        kpi["top_models"] = compute_top_models(leases)
+    if "revenue" in sections:
+        kpi["monthly_revenue"] = compute_monthly_revenue(leases)
+
+    # Flåde
+    if "fleet" in sections:
+        kpi["fleet_status_counts"] = compute_fleet_status_counts(vehicles)
+
+    # Afhentninger
+    if "pickups" in sections:
+        pickups_today, pickups_next_7, upcoming_pickups = compute_pickup_kpis(reservations)
+        kpi["pickups_today"] = pickups_today
+        kpi["pickups_next_7_days"] = pickups_next_7
+        kpi["upcoming_pickups"] = upcoming_pickups
+
+    # Leases der udløber snart
+    if "expiring" in sections:
+        expiring_count, expiring_leases = compute_expiring_leases(leases, days=30)
+        kpi["leases_expiring_soon_count"] = expiring_count
+        kpi["expiring_leases"] = expiring_leases
+
+    # Skader
+    if "damages" in sections:
+        kpi["completed_leases_with_damage"] = compute_completed_with_damage(leases, damages)
+        kpi["avg_damage_cost"] = compute_avg_damage_cost(damages)
+        open_count, total_cost, recent_open = compute_open_damages(damages)
+        kpi["open_damages_count"] = open_count
+        kpi["open_damages_total_cost"] = total_cost
+        kpi["recent_damages"] = recent_open[:5]  # begræns til fx 5
+
+    return kpi
+
+
+def build_kpi_live(sections=None):
+    """Henter rækkerne og beregner KPI'er forfra. Returnerer (kpi, status pr. kilde)."""
+    leases, damages, vehicles, reservations, status = fetch_all_rows(_sources(sections))
+    return compute_kpis(leases, damages, vehicles, reservations, sections), status
+
+
+def _sources(sections):
+    """Kilderne sektionerne kræver; None (alle) hvis der ikke er valgt sektioner."""
+    return snapshot.sources_for(sections) if sections is not None else None
+
+
+def build_kpi_columnar(sections=None):
     """
+    Som build_kpi_live, men kilderne hentes i kolonneformat (?format=columns)
+    og KPI'erne beregnes vektoriseret med NumPy (columnar.py). Kilder der
+    ikke hentes, indgår som tomme tabeller.
+    """
+    results, status = fan_out(fetch_columns, names=_sources(sections))
+    empty = {}
+    return columnar.build_kpi_columnar(
+        results.get("leases", empty),
+        results.get("damages", empty),
+        results.get("vehicles", empty),
+        results.get("reservations", empty),
+    ), status
+
 
-    leases = fetch_leases()
-    damages = fetch_damages()
-    vehicles = fetch_fleet()
-    reservations = fetch_reservations()
+def build_kpi_stream(sections=None):
+    """
+    Streamer de nødvendige kilder som NDJSON (parallelt) og fodrer alle
+    KPI-folds i én passage pr. kilde. Returnerer (kpi, status pr. kilde).
+    """
+    ctx = folds.make_context(
+        expiring_days=EXPIRING_DAYS,
+        pickup_days=PICKUP_WINDOW_DAYS,
+        recent_damages=RECENT_DAMAGES,
+        top_models=TOP_MODELS,
+    )
+    partials, status = fan_out(
+        lambda name, deadline: folds.run_source(name, stream_rows(name, deadline), ctx),
+        names=_sources(sections),
+    )
+    return folds.combine(partials), status
+
+
+def build_kpi_stats(sections=None):
+    """
+    Henter færdige aggregater fra de nødvendige servicers /stats-endpoints
+    (parallelt) og samler KPI-dokumentet. Returnerer (kpi, status pr. kilde).
+    """
+    params = {
+        "leases": {"expiring_days": EXPIRING_DAYS, "top": TOP_MODELS},
+        "damages": {"recent": RECENT_DAMAGES},
+        "vehicles": None,
+        "reservations": {"window": PICKUP_WINDOW_DAYS},
+    }
+    results, status = fan_out(
+        lambda name, deadline: fetch_stats(name, params[name], deadline=deadline),
+        names=_sources(sections),
+    )
+    lease_stats = results.get("leases", {})
+    damage_stats = results.get("damages", {})
+    vehicle_stats = results.get("vehicles", {})
+    reservation_stats = results.get("reservations", {})
 
     kpi = {}
 
     # Grund-KPI'er
-    kpi["active_leases"] = compute_active_leases(leases)
-    kpi["monthly_revenue"] = compute_monthly_revenue(leases)
-    kpi["completed_leases_with_damage"] = compute_completed_with_damage(leases, damages)
-    kpi["avg_damage_cost"] = compute_avg_damage_cost(damages)
-    kpi["top_models"] = compute_top_models(leases)
+    kpi["active_leases"] = lease_stats.get("counts_by_status", {}).get("ACTIVE", 0)
+    kpi["monthly_revenue"] = lease_stats.get("revenue_by_month", [])
+    kpi["completed_leases_with_damage"] = lease_stats.get("completed_with_damage", 0)
+    kpi["avg_damage_cost"] = damage_stats.get("cost", {}).get("avg", 0.0)
+    kpi["top_models"] = lease_stats.get("top_models", [])
 
     # Flåde
-    kpi["fleet_status_counts"] = compute_fleet_status_counts(vehicles)
+    kpi["fleet_status_counts"] = vehicle_stats.get("status_counts", {})
 
     # Afhentninger
-    pickups_today, pickups_next_7, upcoming_pickups = compute_pickup_kpis(reservations)
-    kpi["pickups_today"] = pickups_today
-    kpi["pickups_next_7_days"] = pickups_next_7
-    kpi["upcoming_pickups"] = upcoming_pickups
+    kpi["pickups_today"] = reservation_stats.get("pickups_today", 0)
+    kpi["pickups_next_7_days"] = reservation_stats.get("pickups_in_window", 0)
+    kpi["upcoming_pickups"] = reservation_stats.get("upcoming", [])
 
     # Leases der udløber snart
-    expiring_count, expiring_leases = compute_expiring_leases(leases, days=30)
-    kpi["leases_expiring_soon_count"] = expiring_count
-    kpi["expiring_leases"] = expiring_leases
+    expiring = lease_stats.get("expiring", {})
+    kpi["leases_expiring_soon_count"] = expiring.get("count", 0)
+    kpi["expiring_leases"] = expiring.get("leases", [])
 
     # Skader
-    open_count, total_cost, recent_open = compute_open_damages(damages)
-    kpi["open_damages_count"] = open_count
-    kpi["open_damages_total_cost"] = total_cost
-    kpi["recent_damages"] = recent_open[:5]  # begræns til fx 5
+    open_damages = damage_stats.get("open", {})
+    kpi["open_damages_count"] = open_damages.get("count", 0)
+    kpi["open_damages_total_cost"] = open_damages.get("total_cost", 0.0)
+    kpi["recent_damages"] = open_damages.get("recent", [])
+
+    return kpi, status
+
+
+def build_kpi_incremental(sections=None):
+    """
+    Synkroniserer kun de kilder sektionerne kræver og læser KPI'erne fra
+    kpi_states akkumulatorer. Returnerer (kpi, status pr. kilde).
+    """
+    if sections is None:
+        kpi_state.sync()
+        return kpi_state.build_kpi(), kpi_state.source_status()
+    kinds = snapshot.sources_for(sections)
+    kpi_state.sync(kinds=kinds)
+    keys = snapshot.keys_for(sections)
+    kpi = {k: v for k, v in kpi_state.build_kpi().items() if k in keys}
+    return kpi, kpi_state.source_status(kinds)
+
+
+def build_kpi(sections=None):
+    """
+    Beregner KPI'erne for sections (default: alle) efter KPI_MODE.
+    Returnerer (kpi, status pr. kilde).
+    """
+    if KPI_MODE == "stats":
+        return build_kpi_stats(sections)
+    if KPI_MODE == "live":
+        return build_kpi_live(sections)
+    if KPI_MODE == "columnar":
+        return build_kpi_columnar(sections)
+    if KPI_MODE == "stream":
+        return build_kpi_stream(sections)
+    return build_kpi_incremental(sections)
+
+
+def _build_sections_async(names):
+    """Beregner manglende sektioner i baggrunden (til den daglige historik)."""
+    threading.Thread(target=snapshot.get_snapshot, args=(names,), daemon=True).start()
 
-    generated_at = datetime.utcnow().isoformat()
-    return jsonify({"generated_at": generated_at, "kpi": kpi})
+
+snapshot.configure(
+    build_kpi,
+    after_refresh=lambda doc: history.record_daily(doc, snapshot.SECTIONS, _build_sections_async),
+    versions=fetch_versions,
+)
+
+def _history_loop():
+    # Genberegner alle sektioner, så after_refresh skriver dagens historik
+    # uanset om dashboardet er i brug (record_daily skriver højst én gang i døgnet)
+    while True:
+        snapshot.refresh(list(snapshot.SECTIONS), block=True)
+        time.sleep(KPI_HISTORY_INTERVAL)
+
+
+_history_writer = None
+_history_writer_lock = threading.Lock()
+
+
+def _ensure_history_writer():
+    """Starter historikjobbet én gang pr. proces."""
+    global _history_writer
+    with _history_writer_lock:
+        if _history_writer is None:
+            _history_writer = threading.Thread(target=_history_loop, name="kpi-history", daemon=True)
+            _history_writer.start()
+
+
+_db_ready = False
+
+
+@app.before_request
+def setup_db():
+    # Opretter reporting.db (KPI-historik) ved første request i processen,
+    # ikke ved import, så fx bench-scripts ikke efterlader en DB-fil
+    global _db_ready
+    if not _db_ready:
+        history.init_db()
+        _ensure_history_writer()
+        _db_ready = True
+
+
+@app.get("/reporting/kpi/overview")
+def kpi_overview():
+    """
+    Samlet endpoint til ledelsesdashboardet.
+    Svarer altid straks med seneste snapshot (se snapshot.py); er det ældre
+    end TTL, genberegnes det i baggrunden. Sektioner hvis kilder fejlede ved
+    seneste genberegning er markeret stale.
+
+    Query:
+      sections=fleet,pickups  (default: alle; se snapshot.SECTIONS)
+    Kun de valgte sektioners kilder hentes og beregnes, og hver sektion
+    caches for sig.
+    """
+    sections = [name for name in request.args.get("sections", "").split(",") if name]
+    unknown = [name for name in sections if name not in snapshot.SECTIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown sections {unknown}; valid: {list(snapshot.SECTIONS)}"}), 400
+
+    doc, age = snapshot.get_snapshot(sections or None)
+    if doc is None:
+        return jsonify({"error": "KPI snapshot not available yet"}), 503
+    return jsonify({**doc, "age_seconds": round(age, 3)})
+
+
+@app.post("/reporting/kpi/reconcile")
+def kpi_reconcile():
+    """Tvinger en fuld genindlæsning af alle kilder (retter evt. drift) og et nyt snapshot."""
+    kpi_state.sync(force_reconcile=True)
+    snapshot.refresh(block=True, force=True)
+    return jsonify({"sources": kpi_state.source_status()})
+
+
+
+@app.get("/reporting/revenue/mrr")
+def revenue_mrr():
+    """
+    Månedlig tilbagevendende omsætning: hver aftales monthly_price fordelt over
+    alle måneder i kontraktperioden (delvise måneder pro rata, afsluttede og
+    annullerede aftaler stopper ved ended_at). Beregnet med differens-array
+    + prefix-sum (timeseries.py).
+
+    Query:
+      from=YYYY-MM  (default: første måned med omsætning)
+      to=YYYY-MM    (default: indeværende måned + horizon)
+      horizon=12    (antal måneder frem fra i dag, markeres forecast)
+    """
+    try:
+        horizon = int(request.args.get("horizon", MRR_HORIZON_MONTHS))
+        first = request.args.get("from")
+        last = request.args.get("to")
+        first = timeseries.parse_month(first) if first else None
+        last = timeseries.parse_month(last) if last else None
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM and horizon an integer"}), 400
+    if horizon < 0:
+        return jsonify({"error": "horizon must be >= 0"}), 400
+
+    current = timeseries.month_index(date.today())
+    if last is None:
+        last = current + horizon
+    if first is not None and first > last:
+        return jsonify({"error": "from must be before to"}), 400
+
+    results, status = fan_out(
+        lambda name, deadline: timeseries.mrr_diff(stream_rows(name, deadline)), names=["leases"]
+    )
+    if "leases" not in results:
+        return jsonify({"error": "Lease service unavailable", "sources": status}), 503
+
+    revenue_diff, count_diff = results["leases"]
+    series = timeseries.mrr_series(revenue_diff, count_diff, first=first, last=last, current=current)
+    return jsonify({
+        "current_month": timeseries.month_key(current),
+        "horizon": horizon,
+        "series": series,
+        "sources": status,
+    })
+
+
+
+@app.get("/reporting/fleet/utilization")
+def fleet_utilization():
+    """
+    Andel af flåden der var udlejet pr. dag eller måned, ud fra aftalernes
+    intervaller (vehicle_id, start_date, end_date) og antal biler. Beregnet
+    med en sweep line over sorterede start/slut-hændelser (timeseries.py).
+
+    Query:
+      from=YYYY-MM-DD   (default: to - 365 dage)
+      to=YYYY-MM-DD     (default: i dag)
+      step=day|month    (default: month)
+      group_by=model|fuel_type|delivery_location (default: hele flåden)
+    """
+    step = request.args.get("step", "month")
+    group_by = request.args.get("group_by") or None
+    if step not in ("day", "month"):
+        return jsonify({"error": "step must be day or month"}), 400
+    if group_by is not None and group_by not in timeseries.UTILIZATION_DIMENSIONS:
+        return jsonify({"error": f"group_by must be one of {sorted(timeseries.UTILIZATION_DIMENSIONS)}"}), 400
+    try:
+        last = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today()
+        first = (
+            date.fromisoformat(request.args["from"])
+            if request.args.get("from")
+            else last - timedelta(days=UTILIZATION_DEFAULT_DAYS)
+        )
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if first > last:
+        return jsonify({"error": "from must be before to"}), 400
+
+    def fetch(name, deadline):
+        if name == "leases":
+            return timeseries.lease_intervals(stream_rows(name, deadline))
+        return fetch_source(name, deadline=deadline)
+
+    results, status = fan_out(fetch, names=["leases", "vehicles"])
+    if len(results) < 2:
+        return jsonify({"error": "Lease or fleet service unavailable", "sources": status}), 503
+
+    groups, unmatched = timeseries.utilization_series(
+        results["leases"], results["vehicles"], first, last, step=step, group_by=group_by
+    )
+    return jsonify({
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "step": step,
+        "group_by": group_by,
+        "groups": groups,
+        "unmatched_leases": unmatched,
+        "sources": status,
+    })
+
+
+
+@app.get("/reporting/damage-cube")
+def damage_cube_query():
+    """
+    Skadesantal, sum og gennemsnit af estimated_cost fra den forudberegnede
+    skadeskube (damage_cube.py), joinet skade -> lease -> bil.
+
+    Query:
+      group_by=model,month  (kommasepareret; category, model, fuel_type,
+                             delivery_location, month)
+      <dimension>=<værdi>   (valgfrit filter, fx category=Bule)
+    """
+    group_by = [d for d in request.args.get("group_by", "").split(",") if d]
+    unknown = [d for d in group_by if d not in damage_cube.DIMENSIONS]
+    if unknown or len(set(group_by)) != len(group_by):
+        return jsonify({"error": f"group_by must be distinct values of {list(damage_cube.DIMENSIONS)}"}), 400
+    filters = {d: request.args[d] for d in damage_cube.DIMENSIONS if request.args.get(d)}
+
+    damage_cube.refresh()
+    result = damage_cube.query(group_by, filters)
+    result["sources"] = kpi_state.source_status(damage_cube.CUBE_SOURCES)
+    return jsonify(result)
+
+
+
+@app.get("/reporting/distributions")
+def distribution_kpis():
+    """
+    Kvantiler (t-digest, distributions.py) for damage_cost, monthly_price
+    eller contract_days pr. måned eller kategori, plus alle spand flettet.
+
+    Query:
+      metric=damage_cost|monthly_price|contract_days
+      by=month|category        (default: month)
+      from=YYYY-MM, to=YYYY-MM (kun for by=month)
+      q=0.5,0.9,0.99
+    """
+    metric = request.args.get("metric", "damage_cost")
+    dimension = request.args.get("by", "month")
+    if metric not in distributions.METRICS:
+        return jsonify({"error": f"metric must be one of {sorted(distributions.METRICS)}"}), 400
+    if dimension not in distributions.DIMENSIONS:
+        return jsonify({"error": f"by must be one of {list(distributions.DIMENSIONS)}"}), 400
+    try:
+        quantiles = tuple(float(q) for q in request.args.get("q", "0.5,0.9,0.99").split(","))
+    except ValueError:
+        return jsonify({"error": "q must be comma separated numbers"}), 400
+    if not all(0 <= q <= 1 for q in quantiles):
+        return jsonify({"error": "q must be between 0 and 1"}), 400
+    try:
+        # Normaliseres til "YYYY-MM", da spandene sammenlignes som strenge
+        first, last = (
+            timeseries.month_key(timeseries.parse_month(request.args[arg])) if request.args.get(arg) else None
+            for arg in ("from", "to")
+        )
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM"}), 400
+    if first is not None and last is not None and first > last:
+        return jsonify({"error": "from must be before to"}), 400
+
+    result = distributions.query(metric, dimension, first=first, last=last, quantiles=quantiles)
+    result["sources"] = kpi_state.source_status(distributions.SOURCES)
+    return jsonify(result)
+
+
+
+@app.get("/reporting/customers")
+def customer_kpis():
+    """
+    Unikke kunder og andel genkommende kunder (havde en aftale før perioden)
+    i en periode, estimeret med HyperLogLog-sketches pr. måned (customers.py).
+
+    Query:
+      from=YYYY-MM  (default: 11 måneder før to)
+      to=YYYY-MM    (default: indeværende måned)
+    """
+    try:
+        last = timeseries.parse_month(request.args["to"]) if request.args.get("to") else timeseries.month_index(date.today())
+        first = (
+            timeseries.parse_month(request.args["from"])
+            if request.args.get("from")
+            else last - (CUSTOMER_DEFAULT_MONTHS - 1)
+        )
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM"}), 400
+    if first > last:
+        return jsonify({"error": "from must be before to"}), 400
+
+    result = customers.query(timeseries.month_key(first), timeseries.month_key(last))
+    result["sources"] = kpi_state.source_status(("leases",))
+    return jsonify(result)
+
+
+
+@app.get("/reporting/kpi/history")
+def kpi_history():
+    """
+    Historik for én KPI (history.py), aggregeret pr. dag eller måned.
+
+    Query:
+      metric=open_damages_count  (uden metric: liste over metrikker)
+      from=YYYY-MM-DD            (default: to - 90 dage)
+      to=YYYY-MM-DD              (default: i dag)
+      step=day|month             (default: day)
+    """
+    metric = request.args.get("metric")
+    if not metric:
+        return jsonify({"metrics": history.metrics()})
+    step = request.args.get("step", "day")
+    if step not in ("day", "month"):
+        return jsonify({"error": "step must be day or month"}), 400
+    try:
+        last = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today()
+        first = (
+            date.fromisoformat(request.args["from"])
+            if request.args.get("from")
+            else last - timedelta(days=history.RAW_RETENTION_DAYS)
+        )
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if first > last:
+        return jsonify({"error": "from must be before to"}), 400
+
+    return jsonify({
+        "metric": metric,
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "step": step,
+        "points": history.query(metric, first, last, step),
+    })
+
+
+@app.post("/reporting/kpi/history")
+def kpi_history_record():
+    """Skriver det aktuelle snapshot til historikken med det samme (ud over den daglige skrivning)."""
+    doc, _ = snapshot.get_snapshot()
+    if doc is None:
+        return jsonify({"error": "KPI snapshot not available yet"}), 503
+    written = history.record_snapshot(doc, snapshot.SECTIONS)
+    return jsonify({"written": written, "generated_at": doc["generated_at"]}), 201
 
 
 if __name__ == "__main__":
+    history.init_db()
+    _ensure_history_writer()
     app.run(host="0.0.0.0", port=5004, debug=True)
@@ -0,0 +1,154 @@
+"""
+Sammenflettelige sketches til approksimative KPI'er i konstant hukommelse.
+
+t-digest (kvantiler): værdier samles i centroider (middelværdi, vægt), hvor
+centroider nær halerne holdes små og dem i midten må blive store. Det giver
+god præcision på fx p99 med ~COMPRESSION centroider uanset antal værdier.
+To digests flettes ved at komprimere deres centroider sammen, så månedlige
+digests kan lægges sammen til vilkårlige perioder uden rå data.
+
+HyperLogLog (distinkte antal): hver værdi hashes; de første p bits vælger
+et register, og registeret gemmer den længste række af nul-bits set i
+resten. Ud fra 2^p registre (4 KB ved p=12) estimeres antallet af
+forskellige værdier med ca. 1.04/sqrt(2^p) relativ fejl (1.6%). Flettes med
+max pr. register, så fx måneder kan lægges sammen til en periode.
+
+Sketches er almindelige dicts/lister, så de kan gemmes og flettes frit.
+"""
+import hashlib
+import math
+
+DEFAULT_COMPRESSION = 100
+BUFFER_FACTOR = 5   # nye værdier bufferes og komprimeres samlet
+HLL_PRECISION = 12
+
+
+# --------- T-DIGEST ---------
+
+
+def digest_new(compression=DEFAULT_COMPRESSION):
+    return {"compression": compression, "centroids": [], "buffer": [], "count": 0, "min": None, "max": None}
+
+
+def digest_add(digest, value, weight=1):
+    digest["buffer"].append((value, weight))
+    digest["count"] += weight
+    if digest["min"] is None or value < digest["min"]:
+        digest["min"] = value
+    if digest["max"] is None or value > digest["max"]:
+        digest["max"] = value
+    if len(digest["buffer"]) >= BUFFER_FACTOR * digest["compression"]:
+        _compress(digest)
+
+
+def _compress(digest):
+    """Fletter buffer og centroider; en centroid ved kvantil q må veje højst 4·N·q(1-q)/δ."""
+    if not digest["buffer"]:
+        return
+    items = sorted(digest["centroids"] + digest["buffer"])
+    digest["buffer"] = []
+    total = digest["count"]
+    compression = digest["compression"]
+
+    merged = []
+    cumulative = 0.0
+    mean, weight = items[0]
+    for m, w in items[1:]:
+        q = (cumulative + (weight + w) / 2) / total
+        limit = 4 * total * q * (1 - q) / compression
+        if weight + w <= max(limit, 1):
+            weight += w
+            mean += (m - mean) * w / weight
+        else:
+            merged.append((mean, weight))
+            cumulative += weight
+            mean, weight = m, w
+    merged.append((mean, weight))
+    digest["centroids"] = merged
+
+
+def digest_merge(digests, compression=DEFAULT_COMPRESSION):
+    """Nyt digest der svarer til alle værdierne i digests."""
+    result = digest_new(compression)
+    for digest in digests:
+        if not digest["count"]:
+            continue
+        result["buffer"].extend(digest["centroids"])
+        result["buffer"].extend(digest["buffer"])
+        result["count"] += digest["count"]
+        for bound, better in (("min", min), ("max", max)):
+            result[bound] = digest[bound] if result[bound] is None else better(result[bound], digest[bound])
+    _compress(result)
+    return result
+
+
+def digest_quantile(digest, q):
+    """Approksimativ q-kvantil (0 <= q <= 1); None for et tomt digest."""
+    _compress(digest)
+    centroids = digest["centroids"]
+    if not centroids:
+        return None
+    if q <= 0:
+        return digest["min"]
+    if q >= 1:
+        return digest["max"]
+
+    target = q * digest["count"]
+    cumulative = 0.0
+    prev_center, prev_mean = 0.0, digest["min"]
+    for mean, weight in centroids:
+        center = cumulative + weight / 2
+        if target < center:
+            # Lineær interpolation mellem nabo-centroidernes midtpunkter
+            span = center - prev_center
+            return prev_mean + (mean - prev_mean) * (target - prev_center) / span if span else mean
+        cumulative += weight
+        prev_center, prev_mean = center, mean
+    span = digest["count"] - prev_center
+    return prev_mean + (digest["max"] - prev_mean) * (target - prev_center) / span if span else prev_mean
+
+
+# --------- HYPERLOGLOG ---------
+
+
+def hll_new(precision=HLL_PRECISION):
+    return {"p": precision, "registers": bytearray(1 << precision)}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def hll_add(hll, value: str):
+    p = hll["p"]
+    x = _hash64(value)
+    index = x >> (64 - p)
+    rest = x & ((1 << (64 - p)) - 1)
+    rank = (64 - p) - rest.bit_length() + 1
+    if rank > hll["registers"][index]:
+        hll["registers"][index] = rank
+
+
+def hll_merge(hlls, precision=HLL_PRECISION):
+    """Union af sketches (samme præcision): max pr. register."""
+    registers = bytearray(1 << precision)
+    for hll in hlls:
+        registers = bytearray(map(max, registers, hll["registers"]))
+    return {"p": precision, "registers": registers}
+
+
+def hll_count(hll) -> int:
+    """Estimeret antal forskellige værdier (med linear counting for små antal)."""
+    registers = hll["registers"]
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def hll_error(precision=HLL_PRECISION) -> float:
+    """Typisk relativ standardfejl for en sketch med den præcision."""
+    return 1.04 / math.sqrt(1 << precision)
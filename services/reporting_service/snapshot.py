@@ -0,0 +1,226 @@
+"""
+Stale-while-revalidate cache af KPI-dokumentet, pr. sektion.
+
+Dokumentet er delt i sektioner efter hvilke kilder de afhænger af, og hver
+sektion caches for sig. Et kald kan bede om udvalgte sektioner
+(?sections=fleet,pickups); kun de kilder og beregninger de kræver køres.
+Sektioner beregnes først når nogen beder om dem: første kald for en sektion
+venter på beregningen, derefter svares altid straks med den cachede værdi.
+Er en sektion ældre end KPI_SNAPSHOT_TTL, genberegnes den i baggrunden
+(højst én genberegning ad gangen), og en baggrundstråd genberegner desuden
+alle brugte sektioner hvert KPI_REFRESH_INTERVAL.
+
+Hver sektion husker versionsvektoren (GET /version pr. kilde) den blev
+beregnet ud fra. Et refresh starter med at hente de aktuelle versioner;
+sektioner hvis kilder ikke har ændret sig, markeres blot som kontrolleret,
+og kun de øvrige genberegnes. Sektioner der regner ud fra dags dato
+(DATED_SECTIONS) har desuden pseudo-kilden "today" i vektoren, så de
+genberegnes efter midnat, også selvom ingen kilde er skrevet til.
+
+Fejler en kilde under genberegningen, beholdes sektionens sidste gode
+værdier, og sektionen markeres stale med tidspunktet for de data den viser.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime
+
+KPI_SNAPSHOT_TTL = float(os.getenv("KPI_SNAPSHOT_TTL", "30"))
+KPI_REFRESH_INTERVAL = float(os.getenv("KPI_REFRESH_INTERVAL", "60"))
+
+# Sektion -> (kilder den afhænger af, KPI-nøgler)
+SECTIONS = {
+    "leases": (("leases",), ("active_leases", "top_models")),
+    "revenue": (("leases",), ("monthly_revenue",)),
+    "expiring": (("leases",), ("leases_expiring_soon_count", "expiring_leases")),
+    "damages": (
+        ("leases", "damages"),
+        (
+            "completed_leases_with_damage",
+            "avg_damage_cost",
+            "open_damages_count",
+            "open_damages_total_cost",
+            "recent_damages",
+        ),
+    ),
+    "fleet": (("vehicles",), ("fleet_status_counts",)),
+    "pickups": (("reservations",), ("pickups_today", "pickups_next_7_days", "upcoming_pickups")),
+}
+
+# Sektioner der afhænger af date.today() (pickups_today, days_to_end m.fl.)
+DATED_SECTIONS = ("expiring", "pickups")
+
+_builder = None                 # (sektioner) -> (kpi, status pr. kilde)
+_after_refresh = None           # (dokument) -> None, fx historik
+_versions = None                # (kilder) -> {kilde: version} for kilder der svarede
+_sections = {}                  # sektion -> {"kpi", "sources", "versions", "generated_at", "built_at", "stale"}
+_lock = threading.Lock()        # beskytter _sections
+_refresh_lock = threading.Lock()  # højst én genberegning ad gangen
+_refresher = None
+
+
+def configure(builder, after_refresh=None, versions=None):
+    """
+    Sætter funktionen der beregner (kpi, sources) for en liste af sektioner,
+    evt. en funktion der kaldes med dokumentet efter hver genberegning og
+    evt. en funktion der henter kildernes versioner; kaldes fra main.py.
+    """
+    global _builder, _after_refresh, _versions
+    _builder = builder
+    _after_refresh = after_refresh
+    _versions = versions
+
+
+def sources_for(sections):
+    """De kilder sektionerne afhænger af (i fast rækkefølge)."""
+    needed = {dep for name in sections for dep in SECTIONS[name][0]}
+    return [source for source in ("leases", "damages", "vehicles", "reservations") if source in needed]
+
+
+def keys_for(sections):
+    """KPI-nøglerne sektionerne udgør."""
+    return {key for name in sections for key in SECTIONS[name][1]}
+
+
+def _version_deps(name):
+    """Nøglerne i sektionens versionsvektor: dens kilder, evt. + "today"."""
+    deps = SECTIONS[name][0]
+    return deps + ("today",) if name in DATED_SECTIONS else deps
+
+
+def _unchanged(name, versions):
+    """True hvis sektionen er beregnet (ikke stale) ud fra de samme kildeversioner (under _lock)."""
+    section = _sections.get(name)
+    if section is None or section["stale"]:
+        return False
+    deps = _version_deps(name)
+    return all(versions.get(dep) is not None for dep in deps) and section["versions"] == {
+        dep: versions[dep] for dep in deps
+    }
+
+
+def _update(names, kpi, sources, versions, generated_at, built_at):
+    """Opdaterer sektionerne; dem med fejlende kilder beholder sidste gode værdier (under _lock)."""
+    for name in names:
+        deps, keys = SECTIONS[name]
+        ok = all(sources.get(dep, {}).get("ok", False) for dep in deps)
+        section_sources = {dep: sources.get(dep) for dep in deps}
+        previous = _sections.get(name)
+        if ok or previous is None:
+            _sections[name] = {
+                "kpi": {k: kpi.get(k) for k in keys},
+                "sources": section_sources,
+                "versions": {dep: versions.get(dep) for dep in _version_deps(name)},
+                "generated_at": generated_at,
+                "built_at": built_at,
+                "stale": not ok,
+            }
+        else:
+            # Ny built_at, så den fejlende kilde ikke prøves igen ved hvert kald
+            _sections[name] = {**previous, "sources": section_sources, "built_at": built_at, "stale": True}
+
+
+def _document(names, now):
+    """Samler de cachede sektioner til ét dokument (under _lock)."""
+    present = [name for name in names if name in _sections]
+    kpi, sources, sections = {}, {}, {}
+    for name in sorted(present, key=lambda n: _sections[n]["built_at"]):
+        section = _sections[name]
+        kpi.update(section["kpi"])
+        sources.update(section["sources"])
+        sections[name] = {
+            "generated_at": section["generated_at"],
+            "stale": section["stale"],
+            "versions": section["versions"],
+            "age_seconds": round(now - section["built_at"], 3),
+        }
+    return {
+        "generated_at": min((s["generated_at"] for s in sections.values()), default=None),
+        "kpi": kpi,
+        "sources": sources,
+        "sections": sections,
+        "stale": any(s["stale"] for s in sections.values()),
+    }
+
+
+def refresh(names=None, block=True, force=False):
+    """
+    Genberegner sektionerne names (default: alle der er i brug), hvis deres
+    kilders versioner har ændret sig (eller force). Med block=False
+    returneres straks hvis en anden tråd allerede er i gang. Returnerer True
+    hvis refreshet blev gennemført.
+    """
+    if not _refresh_lock.acquire(blocking=block):
+        return False
+    try:
+        with _lock:
+            names = [n for n in SECTIONS if n in (names if names is not None else _sections)]
+        if not names:
+            return False
+
+        # Versionerne læses før data, så en skrivning under beregningen
+        # giver en ny version og dermed en genberegning næste gang
+        versions = _versions(sources_for(names)) if _versions is not None else {}
+        versions = {**versions, "today": date.today().isoformat()}
+        with _lock:
+            changed = [n for n in names if force or not _unchanged(n, versions)]
+            for name in names:
+                if name not in changed:
+                    _sections[name]["built_at"] = time.monotonic()
+
+        if changed:
+            kpi, sources = _builder(changed)
+            generated_at = datetime.utcnow().isoformat()
+            with _lock:
+                _update(changed, kpi, sources, versions, generated_at, time.monotonic())
+        with _lock:
+            doc = _document(list(_sections), time.monotonic())
+        if _after_refresh is not None:
+            _after_refresh(doc)
+        return True
+    except Exception as e:
+        print(f"[REPORTING] KPI-snapshot kunne ikke genberegnes: {e}")
+        return False
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(KPI_REFRESH_INTERVAL)
+        refresh(block=False)
+
+
+def _ensure_refresher():
+    global _refresher
+    with _lock:
+        if _refresher is not None:
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name="kpi-refresher", daemon=True)
+        _refresher.start()
+
+
+def get_snapshot(names=None):
+    """
+    Returnerer (dokument, alder i sek.) for sektionerne names (default: alle).
+    Sektioner der aldrig er beregnet, beregnes før svaret; for gamle
+    sektioner genberegnes i baggrunden.
+    """
+    names = list(names or SECTIONS)
+    _ensure_refresher()
+    with _lock:
+        missing = [n for n in names if n not in _sections]
+    if missing:
+        refresh(missing, block=True)
+
+    now = time.monotonic()
+    with _lock:
+        expired = [n for n in names if n in _sections and now - _sections[n]["built_at"] > KPI_SNAPSHOT_TTL]
+    if expired:
+        threading.Thread(target=refresh, args=(expired,), kwargs={"block": False}, daemon=True).start()
+
+    with _lock:
+        if not any(n in _sections for n in names):
+            return None, None
+        doc = _document(names, now)
+    return doc, max(s["age_seconds"] for s in doc["sections"].values())
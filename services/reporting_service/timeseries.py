@@ -0,0 +1,266 @@
+"""
+Tidsserie-KPI'er beregnet med sweeps over intervaller.
+
+MRR (månedlig tilbagevendende omsætning): hver aftale fordeles over alle
+måneder fra start_date til end_date i stedet for kun at blive bogført i
+startmåneden. I stedet for at løbe hver aftales måneder igennem
+(O(aftaler × måneder)) lægges hver aftale ind i et differens-array med
+konstant antal opdateringer, og serien fås ved én prefix-sum over
+månederne: O(aftaler + måneder).
+
+Flådeudnyttelse: aftalernes intervaller (vehicle_id, start, slut) bliver
+til +1/-1-hændelser, som sorteres og gennemløbes med en sweep line over
+perioden, så antallet af udlejede biler pr. dag kendes uden at tjekke hver
+aftale for hver dag.
+
+Måneder repræsenteres som indeks år * 12 + (måned - 1).
+"""
+import calendar
+from collections import defaultdict
+from datetime import date, datetime
+from functools import lru_cache
+
+# Statusser hvor aftalen er stoppet; omsætningen løber kun til ended_at
+ENDED_STATUSES = ("COMPLETED", "CANCELLED", "DAMAGED")
+
+
+def _to_date(value):
+    # Kun datodelen bruges, så tidsstempler deler cache-opslag pr. dag
+    if not value:
+        return None
+    return _parse_day(value[:10])
+
+
+@lru_cache(maxsize=65536)
+def _parse_day(value):
+    try:
+        return datetime.fromisoformat(value).date()
+    except Exception:
+        return None
+
+
+def month_index(d: date) -> int:
+    return d.year * 12 + d.month - 1
+
+
+def month_key(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def parse_month(value: str) -> int:
+    """"YYYY-MM" -> månedsindeks. ValueError ved ugyldigt format."""
+    return month_index(datetime.strptime(value, "%Y-%m").date())
+
+
+@lru_cache(maxsize=None)
+def _days_in_month(index: int) -> int:
+    return calendar.monthrange(index // 12, index % 12 + 1)[1]
+
+
+def lease_span(lease):
+    """
+    (start, slut, månedspris) for en aftale, hvor slut er eksklusiv.
+    Aftaler der er afsluttet/annulleret før end_date stopper ved ended_at
+    (sat af lease_service ved statusskiftet). updated_at bruges ikke, da den
+    også flyttes af skrivninger der ikke har med afslutningen at gøre; uden
+    ended_at (aftaler afsluttet før feltet fandtes) løber aftalen til end_date.
+    None hvis aftalen ikke giver omsætning (manglende data eller tomt interval).
+    """
+    start = _to_date(lease.get("start_date"))
+    end = _to_date(lease.get("end_date"))
+    try:
+        price = float(lease.get("monthly_price", 0) or 0)
+    except Exception:
+        return None
+    if start is None or end is None:
+        return None
+
+    if lease.get("status") in ENDED_STATUSES:
+        stopped = _to_date(lease.get("ended_at"))
+        if stopped is not None and stopped < end:
+            end = stopped
+    if end <= start:
+        return None
+    return start, end, price
+
+
+def mrr_diff(leases):
+    """
+    Differens-arrays for omsætning og antal aftaler pr. måned.
+
+    En aftale [start, slut) giver:
+      - første måned: pris * dækkede dage / dage i måneden
+      - hele måneder imellem: pris (ét +/- par i differens-arrayet)
+      - sidste måned: pris * dækkede dage / dage i måneden
+    Ligger start og slut i samme måned, bruges kun de dækkede dage.
+    Returnerer (revenue_diff, count_diff) som dicts månedsindeks -> delta.
+    """
+    revenue = defaultdict(float)
+    count = defaultdict(int)
+
+    def add(first, last, amount):
+        # amount i månederne first..last (inklusiv)
+        revenue[first] += amount
+        revenue[last + 1] -= amount
+
+    for lease in leases:
+        span = lease_span(lease)
+        if span is None:
+            continue
+        start, end, price = span
+        s = month_index(start)
+        # Sidste dag med omsætning er dagen før slut
+        e = month_index(end) if end.day > 1 else month_index(end) - 1
+        last_day = end.day - 1 if end.day > 1 else _days_in_month(e)
+
+        if s == e:
+            add(s, s, price * (last_day - start.day + 1) / _days_in_month(s))
+        else:
+            add(s, s, price * (_days_in_month(s) - start.day + 1) / _days_in_month(s))
+            if e > s + 1:
+                add(s + 1, e - 1, price)
+            add(e, e, price * last_day / _days_in_month(e))
+
+        count[s] += 1
+        count[e + 1] -= 1
+
+    return revenue, count
+
+
+def mrr_series(revenue_diff, count_diff, first=None, last=None, current=None):
+    """
+    Prefix-sum over differens-arrayerne for månederne first..last.
+    first er som default første måned med omsætning, last sidste måned med
+    en aftale. Måneder efter current markeres forecast (kun kendte aftaler,
+    ingen fornyelser).
+    """
+    if not revenue_diff:
+        return []
+    lo = min(revenue_diff)
+    first = lo if first is None else first
+    last = max(revenue_diff) - 1 if last is None else last
+
+    series = []
+    mrr, active = 0.0, 0
+    for index in range(min(lo, first), last + 1):
+        mrr += revenue_diff.get(index, 0.0)
+        active += count_diff.get(index, 0)
+        if index >= first:
+            series.append({
+                "month": month_key(index),
+                "mrr": round(mrr, 2),
+                "active_contracts": active,
+                "forecast": current is not None and index > current,
+            })
+    return series
+
+
+# --------- FLÅDEUDNYTTELSE ---------
+
+# group_by-parameter -> felt på bilen (fleet_service)
+UTILIZATION_DIMENSIONS = {
+    "model": "model_name",
+    "fuel_type": "fuel_type",
+    "delivery_location": "delivery_location",
+}
+
+
+def lease_intervals(leases):
+    """(vehicle_id, start, slut) for aftaler med bil; slut eksklusiv (som lease_span)."""
+    intervals = []
+    for lease in leases:
+        vehicle_id = lease.get("vehicle_id")
+        if vehicle_id is None:
+            continue
+        span = lease_span(lease)
+        if span is not None:
+            intervals.append((vehicle_id, span[0], span[1]))
+    return intervals
+
+
+def _merged_by_vehicle(intervals):
+    """Slår overlappende aftaler på samme bil sammen, så en bil højst tæller én gang pr. dag."""
+    by_vehicle = defaultdict(list)
+    for vehicle_id, start, end in intervals:
+        by_vehicle[vehicle_id].append((start.toordinal(), end.toordinal()))
+
+    for vehicle_id, spans in by_vehicle.items():
+        spans.sort()
+        cur_start, cur_end = spans[0]
+        for start, end in spans[1:]:
+            if start <= cur_end:
+                cur_end = max(cur_end, end)
+            else:
+                yield vehicle_id, cur_start, cur_end
+                cur_start, cur_end = start, end
+        yield vehicle_id, cur_start, cur_end
+
+
+def utilization_series(intervals, vehicles, first: date, last: date, step="month", group_by=None):
+    """
+    Andel af flåden der var udlejet pr. dag/måned i [first, last], evt. pr.
+    model/brændstof/leveringssted.
+
+    Hver (sammenlagt) aftale giver to hændelser (+1 ved start, -1 ved slut),
+    der sorteres pr. gruppe; en sweep over dagene i perioden holder antallet
+    af udlejede biler ajour: O(aftaler log aftaler + grupper × dage).
+    Nævneren er biler i flåden pr. gruppe (flådens nuværende sammensætning).
+
+    Returnerer (grupper, unmatched), hvor grupper er gruppe -> {vehicles, series}
+    og unmatched er antal aftaler på biler der ikke findes i flåden.
+    """
+    field = UTILIZATION_DIMENSIONS.get(group_by)
+    group_of = {v["id"]: (v.get(field) or "UNKNOWN") if field else "ALL" for v in vehicles}
+    fleet_size = defaultdict(int)
+    for group in group_of.values():
+        fleet_size[group] += 1
+
+    lo, hi = first.toordinal(), last.toordinal() + 1   # hi eksklusiv
+    events = defaultdict(list)
+    unmatched = 0
+    for vehicle_id, start, end in _merged_by_vehicle(intervals):
+        group = group_of.get(vehicle_id)
+        if group is None:
+            unmatched += 1
+            continue
+        start, end = max(start, lo), min(end, hi)
+        if start < end:
+            events[group].append((start, 1))
+            events[group].append((end, -1))
+
+    # Periode pr. dag beregnes én gang og deles af alle grupper
+    periods, day_period = [], []
+    for ordinal in range(lo, hi):
+        d = date.fromordinal(ordinal)
+        key = d.isoformat() if step == "day" else month_key(month_index(d))
+        if not periods or periods[-1] != key:
+            periods.append(key)
+        day_period.append(len(periods) - 1)
+
+    result = {}
+    for group in sorted(fleet_size):
+        group_events = sorted(events.get(group, ()))
+        leased_days = [0] * len(periods)
+        days = [0] * len(periods)
+        i, leased = 0, 0
+        for offset, period in enumerate(day_period):
+            ordinal = lo + offset
+            while i < len(group_events) and group_events[i][0] <= ordinal:
+                leased += group_events[i][1]
+                i += 1
+            leased_days[period] += leased
+            days[period] += 1
+
+        size = fleet_size[group]
+        result[group] = {
+            "vehicles": size,
+            "series": [
+                {
+                    "period": key,
+                    "avg_leased": round(leased_days[p] / days[p], 2),
+                    "utilization": round(leased_days[p] / (days[p] * size), 4) if size else 0.0,
+                }
+                for p, key in enumerate(periods)
+            ],
+        }
+    return result, unmatched
@@ -0,0 +1,169 @@
+"""
+Kald til de andre mikrotjenester (lease, damage, fleet, reservation).
+
+Kilderne hentes parallelt (fan_out) på en fast trådpulje med genbrugte
+HTTP-forbindelser, så et dashboard-kald tager max() af servicernes svartid
+og ikke summen. En samlet deadline pr. kald sikrer at én langsom service
+ikke trækker hele svaret ud; kilder der fejler eller når deadline
+markeres i status i stedet for stille at blive til [].
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---- Base-URL'er til mikrotjenester (via Docker-netværk) ----
+LEASE_BASE = os.getenv("LEASE_BASE_URL", "http://lease_service:5002")
+DAMAGE_BASE = os.getenv("DAMAGE_BASE_URL", "http://damage_service:5003")
+FLEET_BASE = os.getenv("FLEET_BASE_URL", "http://fleet_service:5006")
+RESERVATION_BASE = os.getenv("RESERVATION_BASE_URL", "http://reservation_service:5007")
+
+# Kilde -> (base-URL, list-endpoint)
+SOURCES = {
+    "leases": (LEASE_BASE, "/leases"),
+    "damages": (DAMAGE_BASE, "/damages"),
+    "vehicles": (FLEET_BASE, "/vehicles"),
+    "reservations": (RESERVATION_BASE, "/reservations"),
+}
+
+# Kilde -> aggregat-endpoint (GET .../stats), beregnet i SQL i servicen
+STATS_PATHS = {
+    "leases": "/leases/stats",
+    "damages": "/damages/stats",
+    "vehicles": "/vehicles/stats",
+    "reservations": "/reservations/stats",
+}
+
+REQUEST_TIMEOUT = 5
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Samlet deadline (sek.) for en hel fan-out, uanset antal kald pr. kilde
+FANOUT_DEADLINE = float(os.getenv("REPORTING_FANOUT_DEADLINE", "6"))
+FANOUT_WORKERS = 8
+# Deadline (sek.) for versionstjek; de er små og skal ikke forsinke et refresh
+VERSION_CHECK_DEADLINE = float(os.getenv("REPORTING_VERSION_DEADLINE", "1"))
+
+# Én session med forbindelsespulje pr. host, delt mellem trådene
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=len(SOURCES), pool_maxsize=FANOUT_WORKERS))
+_session.mount("https://", HTTPAdapter(pool_connections=len(SOURCES), pool_maxsize=FANOUT_WORKERS))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="upstream")
+
+
+def get_json(url, params=None, timeout=REQUEST_TIMEOUT, deadline=None):
+    """
+    GET + raise_for_status + json(). Fejl kastes videre.
+    deadline (time.monotonic()) begrænser timeout til den resterende tid.
+    """
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"deadline exceeded before GET {url}")
+        timeout = min(timeout, remaining)
+    resp = _session.get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def fetch_source(name, deadline=None):
+    """Henter hele list-endpointet for en kilde. Fejl kastes videre."""
+    base, path = SOURCES[name]
+    return get_json(f"{base}{path}", deadline=deadline)
+
+
+def stream_rows(name, deadline=None):
+    """
+    Generator over kildens rækker, læst som NDJSON direkte fra forbindelsen
+    (én dict ad gangen, hele listen ligger aldrig i hukommelsen).
+    Overskrides deadline undervejs, kastes TimeoutError.
+    """
+    base, path = SOURCES[name]
+    timeout = REQUEST_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, max(deadline - time.monotonic(), 0.001))
+    with _session.get(
+        f"{base}{path}", headers={"Accept": NDJSON_MIMETYPE}, stream=True, timeout=timeout
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(chunk_size=64 * 1024):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"deadline exceeded while streaming {name}")
+            if line:
+                yield json.loads(line)
+
+
+def fetch_columns(name, deadline=None):
+    """Henter list-endpointet i kolonneformat ({"kolonne": [værdier]}). Fejl kastes videre."""
+    base, path = SOURCES[name]
+    return get_json(f"{base}{path}", params={"format": "columns"}, deadline=deadline)
+
+
+def fetch_stats(name, params=None, deadline=None):
+    """GET <service>/<kilde>/stats for en kilde. Fejl kastes videre."""
+    base, _ = SOURCES[name]
+    return get_json(f"{base}{STATS_PATHS[name]}", params=params, deadline=deadline)
+
+
+def fetch_version(name, deadline=None):
+    """GET <service>/version: kildens tabel-version (stiger ved hver skrivning). Fejl kastes videre."""
+    base, _ = SOURCES[name]
+    return get_json(f"{base}/version", deadline=deadline)["version"]
+
+
+def fetch_changes(name, since, limit=1000, deadline=None):
+    """GET <service>/changes?since=&limit= for en kilde. Fejl kastes videre."""
+    base, _ = SOURCES[name]
+    return get_json(f"{base}/changes", params={"since": since, "limit": limit}, deadline=deadline)
+
+
+def fan_out(fn, names=None, deadline_s=FANOUT_DEADLINE):
+    """
+    Kører fn(name, deadline) for hver kilde parallelt.
+
+    Returnerer (results, status):
+      results: name -> fn's returværdi (kun for kilder der lykkedes)
+      status:  name -> {"ok": bool, "error": str|None, "elapsed_ms": int|None}
+    Kilder der ikke er færdige ved deadline får error = "timeout"; deres
+    tråd får lov at løbe færdig i baggrunden, men resultatet bruges ikke.
+    """
+    names = list(names or SOURCES)
+    started = time.monotonic()
+    deadline = started + deadline_s
+
+    def _timed(name):
+        t0 = time.monotonic()
+        value = fn(name, deadline)
+        return value, int((time.monotonic() - t0) * 1000)
+
+    futures = {name: _executor.submit(_timed, name) for name in names}
+    wait(futures.values(), timeout=deadline_s)
+
+    results, status = {}, {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            status[name] = {"ok": False, "error": "timeout", "elapsed_ms": None}
+            print(f"[REPORTING] {name}: no answer within {deadline_s}s")
+            continue
+        try:
+            value, elapsed_ms = future.result()
+        except (requests.Timeout, TimeoutError) as e:
+            status[name] = {"ok": False, "error": "timeout", "elapsed_ms": int((time.monotonic() - started) * 1000)}
+            print(f"[REPORTING] Timeout fetching {name}: {e}")
+            continue
+        except Exception as e:
+            status[name] = {"ok": False, "error": str(e), "elapsed_ms": int((time.monotonic() - started) * 1000)}
+            print(f"[REPORTING] Error fetching {name}: {e}")
+            continue
+        results[name] = value
+        status[name] = {"ok": True, "error": None, "elapsed_ms": elapsed_ms}
+    return results, status
+
+
+def fetch_versions(names=None):
+    """{kilde: version} for de kilder der svarede på GET /version inden for VERSION_CHECK_DEADLINE."""
+    results, _ = fan_out(fetch_version, names=names, deadline_s=VERSION_CHECK_DEADLINE)
+    return results
@@ -1,6 +1,9 @@
 import sqlite3
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, date, timedelta
+
+from serialization import query_json_array, query_json_columns, iter_ndjson
+from changelog import init_changelog, record_change
 
 DB_PATH = Path(__file__).parent / "reservation.db"
 
@@ -28,6 +31,18 @@ def init_db():
         )
         """
     )
+
+    # Watermark for inkrementel CSV-eksport (updated_at > sidste kørsel)
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservations_updated_at
+        ON reservations(updated_at)
+        """
+    )
+
+    # Change feed (GET /changes)
+    init_changelog(cur)
+
     conn.commit()
     conn.close()
 
@@ -59,26 +74,87 @@ def create_reservation(data: dict) -> int:
         ),
     )
     rid = cur.lastrowid
+    cur.execute("SELECT * FROM reservations WHERE id = ?", (rid,))
+    record_change(cur, "reservation", rid, "INSERT", dict(cur.fetchone()))
     conn.commit()
     conn.close()
     return rid
 
 
+def _list_reservations_query(status: str | None = None):
+    if status:
+        return "SELECT * FROM reservations WHERE status = ? ORDER BY pickup_date", (status,)
+    return "SELECT * FROM reservations ORDER BY pickup_date", ()
+
+
 def list_reservations(status: str | None = None):
     conn = get_connection()
     cur = conn.cursor()
-    if status:
-        cur.execute(
-            "SELECT * FROM reservations WHERE status = ? ORDER BY pickup_date",
-            (status,),
-        )
-    else:
-        cur.execute("SELECT * FROM reservations ORDER BY pickup_date")
+    cur.execute(*_list_reservations_query(status))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
+def list_reservations_json(status: str | None = None) -> str:
+    """Som list_reservations, men returnerer færdig JSON bygget i SQLite."""
+    conn = get_connection()
+    payload = query_json_array(conn, *_list_reservations_query(status))
+    conn.close()
+    return payload
+
+
+def list_reservations_columns_json(status: str | None = None) -> str:
+    """Som list_reservations_json, men kolonneorienteret (?format=columns)."""
+    conn = get_connection()
+    payload = query_json_columns(conn, *_list_reservations_query(status))
+    conn.close()
+    return payload
+
+
+def stream_reservations_ndjson(status: str | None = None):
+    """Generator med reservations som NDJSON (én række pr. linje), hentet med fetchmany."""
+    return iter_ndjson(get_connection, *_list_reservations_query(status))
+
+
+def reservation_stats(window_days: int = 7, today: date | None = None) -> dict:
+    """
+    Aggregater til reporting (GET /reservations/stats), beregnet i SQL:
+    antal pr. status, afhentninger i dag og afhentninger inden for
+    window_days (inkl. listen, sorteret efter pickup_date).
+    """
+    today = today or date.today()
+    limit = today + timedelta(days=window_days)
+    conn = get_connection()
+    cur = conn.cursor()
+
+    cur.execute("SELECT status, COUNT(*) FROM reservations GROUP BY status")
+    counts_by_status = {r[0]: r[1] for r in cur.fetchall()}
+
+    cur.execute("SELECT COUNT(*) FROM reservations WHERE date(pickup_date) = ?", (today.isoformat(),))
+    pickups_today = cur.fetchone()[0]
+
+    cur.execute(
+        """
+        SELECT * FROM reservations
+        WHERE date(pickup_date) BETWEEN ? AND ?
+        ORDER BY pickup_date
+        """,
+        (today.isoformat(), limit.isoformat()),
+    )
+    upcoming = [dict(r) for r in cur.fetchall()]
+
+    conn.close()
+    return {
+        "total": sum(counts_by_status.values()),
+        "counts_by_status": counts_by_status,
+        "window_days": window_days,
+        "pickups_today": pickups_today,
+        "pickups_in_window": len(upcoming),
+        "upcoming": upcoming,
+    }
+
+
 def get_reservation_by_id(reservation_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -105,6 +181,11 @@ def update_reservation_status(reservation_id: int, new_status: str):
         """,
         (new_status, now, actual_pickup_at, reservation_id),
     )
+    if cur.rowcount:
+        fields = {"status": new_status, "updated_at": now}
+        if actual_pickup_at:
+            fields["actual_pickup_at"] = actual_pickup_at
+        record_change(cur, "reservation", reservation_id, "UPDATE", fields)
     conn.commit()
     conn.close()
 
@@ -2,10 +2,16 @@ import os
 import requests
 from datetime import datetime
 from flask import Flask, request, jsonify
+from serialization import json_response, ndjson_response, wants_columns, wants_ndjson
+from changelog import changes_endpoint, version_endpoint
 from database import (
     init_db,
+    get_connection,
     create_reservation,
-    list_reservations,
+    list_reservations_json,
+    stream_reservations_ndjson,
+    list_reservations_columns_json,
+    reservation_stats,
     get_reservation_by_id,
     update_reservation_status,
 )
@@ -28,8 +34,44 @@ def health():
 @app.get("/reservations")
 def get_reservations():
     status = request.args.get("status")
-    rows = list_reservations(status=status)
-    return jsonify([dict(r) for r in rows])
+    if wants_ndjson():
+        return ndjson_response(stream_reservations_ndjson(status=status))
+    if wants_columns():
+        return json_response(list_reservations_columns_json(status=status))
+    return json_response(list_reservations_json(status=status))
+
+
+@app.get("/reservations/stats")
+def get_reservation_stats():
+    """
+    GET /reservations/stats?window=7
+    Aggregater til reporting_service (beregnet i SQL).
+    """
+    try:
+        window_days = int(request.args.get("window", 7))
+    except ValueError:
+        return jsonify({"error": "window must be an integer"}), 400
+    return jsonify(reservation_stats(window_days=window_days))
+
+
+@app.get("/changes")
+def get_changes():
+    """
+    GET /changes?since=<seq>&limit=100&wait=0
+    Change feed over reservations. wait > 0 long-poller op til så mange sekunder.
+    """
+    body, status = changes_endpoint(get_connection, request.args)
+    return jsonify(body), status
+
+
+@app.get("/version")
+def get_version():
+    """
+    GET /version
+    Tabel-version (højeste change-seq); stiger ved hver skrivning til reservations.
+    """
+    body, status = version_endpoint(get_connection)
+    return jsonify(body), status
 
 
 @app.get("/reservations/<int:reservation_id>")
@@ -0,0 +1,88 @@
+"""
+Fælles fixtures: data-servicerne startes som rigtige processer på kopier af
+deres mapper (og dermed af seed-DB'erne), så testene kan skrive via API'erne
+uden at røre de DB-filer der ligger i repoet.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVICES = ROOT / "services"
+
+# Service -> DB-fil i servicemappen
+DATA_SERVICES = {
+    "lease_service": "lease.db",
+    "damage_service": "damage.db",
+    "fleet_service": "fleet.db",
+    "reservation_service": "reservation.db",
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(url, proc, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url}: processen stoppede (exit {proc.returncode})")
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url}: svarede ikke på /health inden {timeout} sek.")
+
+
+@pytest.fixture(scope="session")
+def services(tmp_path_factory):
+    """
+    Starter lease, damage, fleet og reservation_service på ledige porte.
+    Returnerer {"urls": {service: base-URL}, "dbs": {service: DB-sti}}.
+    """
+    root = tmp_path_factory.mktemp("services")
+    ports = {name: _free_port() for name in DATA_SERVICES}
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    env = {
+        **os.environ,
+        "LEASE_BASE_URL": urls["lease_service"],
+        "DAMAGE_BASE_URL": urls["damage_service"],
+        "FLEET_BASE_URL": urls["fleet_service"],
+        "RKI_BASE_URL": f"http://127.0.0.1:{_free_port()}",   # ingen RKI: aftaler får PENDING
+        "LEASE_DB_PATH": str(root / "lease_service" / "lease.db"),
+        "PYTHONUNBUFFERED": "1",
+    }
+
+    procs = []
+    try:
+        for name in DATA_SERVICES:
+            workdir = root / name
+            shutil.copytree(SERVICES / name, workdir, ignore=shutil.ignore_patterns("__pycache__"))
+            log = (root / f"{name}.log").open("w")
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "flask", "--app", "main", "run", "--port", str(ports[name])],
+                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ))
+        for name, proc in zip(DATA_SERVICES, procs):
+            _wait_healthy(urls[name], proc)
+        yield {
+            "urls": urls,
+            "dbs": {name: root / name / db for name, db in DATA_SERVICES.items()},
+        }
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=10)
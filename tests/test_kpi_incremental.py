@@ -0,0 +1,121 @@
+"""
+KPI_MODE=incremental (kpi_state.py) skal give samme dokument som
+KPI_MODE=stats, både efter første fulde indlæsning og efter en række
+ændringer der kun når kpi_state via change feeds.
+"""
+import importlib
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+import requests
+
+from conftest import SERVICES
+
+
+@pytest.fixture(scope="module")
+def reporting(services):
+    """reporting_service's main-modul, peget mod test-servicerne."""
+    urls = services["urls"]
+    os.environ.update({
+        "LEASE_BASE_URL": urls["lease_service"],
+        "DAMAGE_BASE_URL": urls["damage_service"],
+        "FLEET_BASE_URL": urls["fleet_service"],
+        "RESERVATION_BASE_URL": urls["reservation_service"],
+    })
+    sys.path.insert(0, str(SERVICES / "reporting_service"))
+    try:
+        main = importlib.import_module("main")
+        main.kpi_state.SYNC_MIN_INTERVAL = 0
+        yield main
+    finally:
+        sys.path.remove(str(SERVICES / "reporting_service"))
+
+
+def _assert_same_kpi(main):
+    stats, stats_status = main.build_kpi_stats()
+    incremental, incremental_status = main.build_kpi_incremental()
+    assert all(s["ok"] for s in stats_status.values()), stats_status
+    assert all(s["ok"] for s in incremental_status.values()), incremental_status
+    assert incremental.keys() == stats.keys()
+    for key, expected in stats.items():
+        if isinstance(expected, float):
+            expected = pytest.approx(expected)
+        assert incremental[key] == expected, key
+
+
+def _post(url, path, body, status=201):
+    resp = requests.post(f"{url}{path}", json=body, timeout=10)
+    assert resp.status_code == status, resp.text
+    return resp.json()
+
+
+def _patch(url, path, body):
+    resp = requests.patch(f"{url}{path}", json=body, timeout=10)
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def _available_model(fleet_url):
+    vehicles = requests.get(f"{fleet_url}/vehicles", timeout=10).json()
+    return next(v["model_name"] for v in vehicles if v["status"] == "AVAILABLE" and v.get("monthly_price"))
+
+
+def test_incremental_matches_stats_after_changes(services, reporting):
+    urls = services["urls"]
+    lease_url, damage_url = urls["lease_service"], urls["damage_service"]
+    today = date.today()
+
+    reporting.kpi_state.sync(force_reconcile=True)
+    _assert_same_kpi(reporting)
+
+    # Nye aftaler: én der udløber inden for vinduet, én der afsluttes med skade
+    expiring = _post(lease_url, "/leases", {
+        "customer_name": "Test Udløb",
+        "customer_email": "udloeb@example.com",
+        "car_model": _available_model(urls["fleet_service"]),
+        "start_date": (today - timedelta(days=60)).isoformat(),
+        "end_date": (today + timedelta(days=3)).isoformat(),
+    })
+    completed = _post(lease_url, "/leases", {
+        "customer_name": "Test Afsluttet",
+        "customer_email": "afsluttet@example.com",
+        "car_model": _available_model(urls["fleet_service"]),
+        "start_date": (today - timedelta(days=400)).isoformat(),
+        "end_date": (today + timedelta(days=10)).isoformat(),
+    })
+    _patch(lease_url, f"/leases/{completed['id']}/status", {"status": "COMPLETED"})
+
+    # Skader: én forbliver åben, én lukkes igen
+    _post(damage_url, "/damages", {
+        "lease_id": completed["id"], "category": "Lak", "description": "Ridse", "estimated_cost": 1250.5,
+    })
+    closed = _post(damage_url, "/damages", {
+        "lease_id": expiring["id"], "category": "Glas", "description": "Stenslag", "estimated_cost": 800,
+    })
+    _patch(damage_url, f"/damages/{closed['id']}/status", {"status": "CLOSED"})
+
+    # Afhentninger i vinduet
+    for offset in (0, 2):
+        _post(urls["reservation_service"], "/reservations", {
+            "lease_id": expiring["id"],
+            "vehicle_id": expiring["vehicle_id"] or 1,
+            "pickup_date": (today + timedelta(days=offset)).isoformat(),
+        })
+
+    _patch(lease_url, f"/leases/{expiring['id']}/status", {"status": "CANCELLED"})
+
+    seqs_before = {kind: s["seq"] for kind, s in reporting.kpi_state.source_status().items()}
+    reporting.kpi_state.sync()
+    status = reporting.kpi_state.source_status()
+    # Ændringerne er kommet via change feeds, ikke en ny fuld indlæsning
+    assert all(status[kind]["seq"] > seqs_before[kind] for kind in ("leases", "damages", "reservations"))
+    _assert_same_kpi(reporting)
+
+
+def test_incremental_sections_only_sync_their_sources(reporting):
+    kpi, status = reporting.build_kpi_incremental(["fleet"])
+    assert set(status) == {"vehicles"}
+    assert set(kpi) == reporting.snapshot.keys_for(["fleet"])
+